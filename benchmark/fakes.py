@@ -0,0 +1,137 @@
+"""Các thành phần giả lập (deterministic, chạy offline) thay cho Gemini, Tavily và MiniLM.
+
+install() phải được gọi TRƯỚC khi import src.controller / src.chatTools / main,
+vì các module đó lấy llm, model_emb, tavilySearch trực tiếp từ src.models.
+"""
+import hashlib
+import sys
+import time
+import types
+import uuid
+import numpy as np
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+
+class HashEmbedder:
+    """Embedding giả: băm từng từ vào vector 384 chiều (cùng số chiều với all-MiniLM-L6-v2)"""
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+        self.tokenizer = None
+
+    def _encode_one(self, text):
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for word in str(text).lower().split():
+            vec[int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % self.dim] += 1.0
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def encode(self, sentences, **kwargs):
+        if isinstance(sentences, str):
+            return self._encode_one(sentences)
+        return np.stack([self._encode_one(s) for s in sentences]) if len(sentences) else np.zeros((0, self.dim), dtype=np.float32)
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+
+class FakeSearchClient:
+    """Thay TavilyClient: trả kết quả cố định theo query, có thể giả lập độ trễ mạng"""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+
+    def search(self, query, **kwargs):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return {
+            "query": query,
+            "results": [
+                {
+                    "title": f"Kết quả {i + 1} cho '{query}'",
+                    "url": f"https://example.com/{i + 1}",
+                    "content": f"Thông tin tham khảo số {i + 1} về {query}. " * 5,
+                    "score": round(0.9 - i * 0.1, 2),
+                    "raw_content": None,
+                }
+                for i in range(3)
+            ],
+            "images": [],
+            "follow_up_questions": None,
+        }
+
+
+class ScriptedChatModel(BaseChatModel):
+    """Chat model giả có tool calling theo kịch bản.
+
+    scripts: {user_message: [step, ...]}, mỗi step là
+      {"tool_calls": [{"name": ..., "args": {...}}]} hoặc {"answer": "..."}.
+    Step hiện tại = số AIMessage sau HumanMessage cuối cùng, nên nhiều session chạy song song
+    vẫn cho kết quả deterministic.
+    """
+
+    scripts: dict = {}
+    latency_ms: float = 0.0
+    default_answer: str = "Dạ, mình đã ghi nhận yêu cầu của bạn."
+
+    @property
+    def _llm_type(self):
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _next_step(self, messages):
+        last_human, ai_after = None, 0
+        for msg in messages:
+            if isinstance(msg, HumanMessage):
+                last_human, ai_after = msg, 0
+            elif isinstance(msg, AIMessage):
+                ai_after += 1
+
+        steps = self.scripts.get(str(last_human.content), []) if last_human is not None else []
+        return steps[ai_after] if ai_after < len(steps) else {"answer": self.default_answer}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+        # Lời gọi tóm tắt hội thoại (không có tool)
+        if str(messages[-1].content).startswith("Hãy tóm tắt cuộc hội thoại"):
+            step = {"answer": "Khách đã hỏi về sản phẩm và khuyến mãi."}
+        else:
+            step = self._next_step(messages)
+
+        prompt_tokens = sum(len(str(m.content)) for m in messages) // 4
+        if "tool_calls" in step:
+            message = AIMessage(
+                content="",
+                tool_calls=[
+                    {"name": tc["name"], "args": tc.get("args", {}), "id": f"call_{uuid.uuid4().hex[:12]}"}
+                    for tc in step["tool_calls"]
+                ],
+            )
+        else:
+            message = AIMessage(content=step["answer"])
+        completion_tokens = max(1, len(str(message.content)) // 4)
+        message.usage_metadata = {
+            "input_tokens": prompt_tokens,
+            "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+def install(scripts=None, llm_latency_ms: float = 0.0, search_latency_ms: float = 0.0):
+    """Thay src.models bằng module giả (llm, model_emb, tavilySearch). Trả về module đó."""
+    import src  # noqa: F401 - đảm bảo package cha đã được load
+
+    module = types.ModuleType("src.models")
+    module.__path__ = []
+    module.llm = ScriptedChatModel(scripts=scripts or {}, latency_ms=llm_latency_ms)
+    module.model_emb = HashEmbedder()
+    module.tavilySearch = FakeSearchClient(latency_ms=search_latency_ms)
+    sys.modules["src.models"] = module
+    return module
@@ -0,0 +1,348 @@
+"""Load-test / benchmark latency offline cho ChatController và FastAPI app.
+
+Dùng LLM, Tavily và embedding giả lập (benchmark/fakes.py) nên chạy được trên laptop,
+không cần API key hay mạng. Mỗi lần chạy dùng bản copy của store.db và ChromaDB tạm.
+
+    python -m benchmark.load_test
+    python -m benchmark.load_test --mode both --sessions 1 4 8 --llm-latency-ms 50
+    python -m benchmark.load_test --output baseline.json
+    python -m benchmark.load_test --baseline baseline.json   # exit code 1 nếu p95 chậm hơn baseline
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+
+from . import fakes
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(BENCHMARK_DIR)
+conversations_path = os.path.join(BENCHMARK_DIR, "conversations.jsonl")
+
+
+# ----------- RECORDER -----------
+class LatencyRecorder:
+    """Gom thời gian chạy (ms) theo (category, name): node, tool, sql, rag, embed, checkpoint, turn"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, category, name, ms, error=False):
+        with self._lock:
+            self.samples[(category, name)].append(ms)
+            if error:
+                self.errors[(category, name)] += 1
+
+    def timed(self, category, name, fn, label_fn=None):
+        """Bọc fn để đo thời gian mỗi lần gọi"""
+        recorder = self
+
+        def wrapper(*args, **kwargs):
+            label = label_fn(*args, **kwargs) if label_fn else name
+            start = time.perf_counter()
+            error = False
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                error = True
+                raise
+            finally:
+                recorder.record(category, label, (time.perf_counter() - start) * 1000, error)
+
+        return wrapper
+
+    def reset(self):
+        with self._lock:
+            self.samples.clear()
+            self.errors.clear()
+
+    def summary(self):
+        rows = []
+        with self._lock:
+            items = sorted(self.samples.items())
+            errors = dict(self.errors)
+        for (category, name), values in items:
+            arr = np.array(values)
+            rows.append({
+                "category": category,
+                "name": name,
+                "count": len(values),
+                "errors": errors.get((category, name), 0),
+                "mean_ms": round(float(arr.mean()), 3),
+                "p50_ms": round(float(np.percentile(arr, 50)), 3),
+                "p95_ms": round(float(np.percentile(arr, 95)), 3),
+                "p99_ms": round(float(np.percentile(arr, 99)), 3),
+            })
+        return rows
+
+
+class GraphTimingCallback(BaseCallbackHandler):
+    """Callback LangChain: đo thời gian từng node của StateGraph và từng tool"""
+    run_inline = True
+
+    def __init__(self, recorder: LatencyRecorder):
+        self.recorder = recorder
+        self._starts = {}
+
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        name = kwargs.get("name")
+        if metadata and name and metadata.get("langgraph_node") == name:
+            self._starts[run_id] = ("node", name, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        # interrupt() (chờ xác nhận tool nhạy cảm) cũng đi qua đây, không tính là lỗi
+        self._finish(run_id, error=type(error).__name__ != "GraphInterrupt")
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name", "tool")
+        self._starts[run_id] = ("tool", name, time.perf_counter())
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, error=True)
+
+    def _finish(self, run_id, error=False):
+        started = self._starts.pop(run_id, None)
+        if started is not None:
+            category, name, start = started
+            self.recorder.record(category, name, (time.perf_counter() - start) * 1000, error)
+
+
+# ----------- SETUP -----------
+def load_conversations(path=conversations_path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def build_scripts(conversations):
+    """{user_message: steps} cho ScriptedChatModel"""
+    scripts = {}
+    for conv in conversations:
+        for turn in conv["turns"]:
+            if turn["user"] in scripts and scripts[turn["user"]] != turn["steps"]:
+                raise ValueError(f"Câu '{turn['user']}' có 2 kịch bản khác nhau")
+            scripts[turn["user"]] = turn["steps"]
+    return scripts
+
+
+def prepare_environment(workdir, conversations, llm_latency_ms=0.0, search_latency_ms=0.0):
+    """Copy store.db sang thư mục tạm, trỏ STORE_DB_PATH / CHROMA_PATH vào đó và cài model giả.
+    Phải chạy trước khi import src.utils / src.controller."""
+    db_copy = os.path.join(workdir, "store.db")
+    shutil.copy(os.path.join(PROJECT_DIR, "database", "repo", "store.db"), db_copy)
+    os.environ["STORE_DB_PATH"] = db_copy
+    os.environ["CHROMA_PATH"] = os.path.join(workdir, "chroma_db")
+    os.environ["RAG_VECTOR_PATH"] = os.path.join(workdir, "vector_store")
+
+    if PROJECT_DIR not in sys.path:
+        sys.path.insert(0, PROJECT_DIR)
+    fakes.install(build_scripts(conversations), llm_latency_ms=llm_latency_ms, search_latency_ms=search_latency_ms)
+
+
+def _sql_label(query, *args, **kwargs):
+    words = " ".join(str(query).split())
+    return words[:70]
+
+
+def instrument(bot, recorder: LatencyRecorder):
+    """Gắn đo đạc vào controller: node/tool qua callback, SQL / RAG / embedding / checkpoint qua wrapper"""
+    import src.utils.async_db as db_module
+    import src.chatTools.ragAgentic as rag_module
+
+    bot.callbacks.append(GraphTimingCallback(recorder))
+
+    if not hasattr(db_module.run_query, "__wrapped_for_bench__"):
+        # Tool chạy sync gọi run_query, chạy async (API) thì đi qua AsyncDatabase
+        db_module.run_query = recorder.timed("sql", "run_query", db_module.run_query, label_fn=_sql_label)
+        db_module.run_query.__wrapped_for_bench__ = True
+        adb = db_module.AsyncDatabase
+        adb._execute_one = recorder.timed("sql", "run_query", adb._execute_one,
+                                          label_fn=lambda db, conn, q: _sql_label(q.query))
+
+        emb = rag_module.model_emb
+        emb.encode = recorder.timed("embed", "encode", emb.encode)
+
+    if not getattr(bot.RAG, "__wrapped_for_bench__", False):
+        for method in ("search_hybrid", "search_with_neighbors", "search", "get_section"):
+            setattr(bot.RAG, method, recorder.timed("rag", method, getattr(bot.RAG, method)))
+        bot.RAG.__wrapped_for_bench__ = True
+
+    checkpointer = bot.checkpointer
+    for method in ("get_tuple", "put", "put_writes", "prune"):
+        if hasattr(checkpointer, method):
+            setattr(checkpointer, method, recorder.timed("checkpoint", method, getattr(checkpointer, method)))
+
+
+# ----------- REPLAY -----------
+def play_with_controller(bot, recorder):
+    def play(conv, session_id):
+        for turn in conv["turns"]:
+            start = time.perf_counter()
+            bot.run(turn["user"], session_id=session_id)
+            pending = bot.get_pending_action(session_id)
+            if pending is not None and turn.get("confirm"):
+                bot.confirm(session_id, pending["token"], approved=True)
+            recorder.record("turn", "controller", (time.perf_counter() - start) * 1000)
+        return len(conv["turns"])
+    return play
+
+
+def play_with_api(client, recorder):
+    def play(conv, session_id):
+        for turn in conv["turns"]:
+            start = time.perf_counter()
+            resp = client.post("/chat", json={"message": turn["user"], "session_id": session_id})
+            data = resp.json()
+            if resp.status_code == 200 and data.get("requires_confirmation") and turn.get("confirm"):
+                resp = client.post("/chat/confirm", json={
+                    "session_id": session_id, "token": data["pending_action"]["token"], "approved": True
+                })
+            recorder.record("turn", "api", (time.perf_counter() - start) * 1000, error=resp.status_code != 200)
+        return len(conv["turns"])
+    return play
+
+
+def run_load(play, conversations, sessions, repeat, tag):
+    """Chạy sessions phiên song song, mỗi phiên replay lần lượt các hội thoại repeat lần"""
+    jobs = [
+        (conv, f"{tag}-{sessions}-{worker}-{r}-{conv['id']}")
+        for worker in range(sessions)
+        for r in range(repeat)
+        for conv in conversations
+    ]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        turns = sum(pool.map(lambda job: play(*job), jobs))
+    elapsed = time.perf_counter() - start
+    return {
+        "mode": tag,
+        "sessions": sessions,
+        "turns": turns,
+        "seconds": round(elapsed, 3),
+        "turns_per_second": round(turns / elapsed, 2) if elapsed else None,
+    }
+
+
+# ----------- REPORT -----------
+def print_report(result):
+    print(f"\n{'category':<11}{'name':<72}{'count':>7}{'err':>5}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for row in result["latency"]:
+        print(f"{row['category']:<11}{row['name'][:70]:<72}{row['count']:>7}{row['errors']:>5}"
+              f"{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}")
+    print()
+    for row in result["throughput"]:
+        print(f"🚀 {row['mode']:<11} sessions={row['sessions']:<4} turns={row['turns']:<6} "
+              f"{row['turns_per_second']} turns/s ({row['seconds']}s)")
+
+
+def compare_with_baseline(result, baseline, tolerance=0.2, min_delta_ms=1.0):
+    """So sánh p95 với baseline, trả về danh sách các chỉ số bị chậm đi"""
+    base = {(r["category"], r["name"]): r for r in baseline["latency"]}
+    regressions = []
+    for row in result["latency"]:
+        old = base.get((row["category"], row["name"]))
+        if old is None:
+            continue
+        if row["p95_ms"] > old["p95_ms"] * (1 + tolerance) and row["p95_ms"] - old["p95_ms"] > min_delta_ms:
+            regressions.append({**row, "baseline_p95_ms": old["p95_ms"]})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load-test cho SmartShop chatbot")
+    parser.add_argument("--conversations", default=conversations_path)
+    parser.add_argument("--mode", choices=["controller", "api", "both"], default="controller")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="Độ trễ giả lập của mỗi lần gọi LLM")
+    parser.add_argument("--search-latency-ms", type=float, default=0.0, help="Độ trễ giả lập của Tavily")
+    parser.add_argument("--output", help="Ghi kết quả ra file JSON (dùng làm baseline)")
+    parser.add_argument("--baseline", help="File JSON baseline để so sánh p95")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    conversations = load_conversations(args.conversations)
+    workdir = tempfile.mkdtemp(prefix="smartshop-bench-")
+    try:
+        prepare_environment(workdir, conversations, args.llm_latency_ms, args.search_latency_ms)
+
+        # Import sau khi đã cài model giả và trỏ DB sang bản copy
+        from src.chatTools import RAG
+        RAG.get_instance().add_data(os.path.join(PROJECT_DIR, "database", "rag"))
+
+        recorder = LatencyRecorder()
+        players = {}
+        if args.mode in ("api", "both"):
+            from fastapi.testclient import TestClient
+            import main as api
+            instrument(api.SaleChatbot, recorder)
+            players["api"] = play_with_api(TestClient(api.app), recorder)
+        if args.mode in ("controller", "both"):
+            from src.controller import ChatController
+            from src.models import llm
+            from src.Prompts import system_prompt
+            from src.chatTools import safe_tools, sensitive_tools
+            bot = ChatController(llm, safe_tools, sensitive_tools, system_prompt)
+            instrument(bot, recorder)
+            players["controller"] = play_with_controller(bot, recorder)
+
+        # Warm-up (import lazy, build BM25, tạo connection...) rồi mới đo
+        for tag, play in players.items():
+            play(conversations[0], f"warmup-{tag}")
+        recorder.reset()
+
+        throughput = [
+            run_load(play, conversations, sessions, args.repeat, tag)
+            for tag, play in players.items()
+            for sessions in args.sessions
+        ]
+        result = {
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+            "latency": recorder.summary(),
+            "throughput": throughput,
+        }
+    finally:
+        # Dừng các thread nền đang trỏ vào bản copy DB trước khi xóa
+        from src.utils import ProductCatalog, InventoryManager, metrics
+        ProductCatalog.get_instance().close()
+        InventoryManager.get_instance().close()
+        metrics.close()
+        memory = sys.modules.get("src.controller.memory")
+        if memory is not None and memory.SemanticMemory._instance is not None:
+            memory.SemanticMemory._instance.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(result)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"✅ Đã lưu kết quả tại {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_with_baseline(result, json.load(f), args.tolerance)
+        if regressions:
+            for r in regressions:
+                print(f"❌ Chậm hơn baseline: {r['category']}/{r['name']} p95 {r['baseline_p95_ms']} -> {r['p95_ms']} ms")
+            return 1
+        print("✅ Không có chỉ số nào chậm hơn baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""Kiểm tra query plan của các câu tra cứu khách hàng / đơn hàng (src/utils/resolver.py).
+
+Mỗi câu phải đi qua index (SEARCH ... USING [COVERING] INDEX / PRIMARY KEY), không được quét bảng (SCAN).
+Chạy trên bản copy của store.db sau khi áp dụng migrations:
+    python -m benchmark.query_plans
+    python -m benchmark.query_plans --require-covering orders_by_status recent_orders
+Exit code 1 nếu có câu bị SCAN (hoặc không dùng covering index khi được yêu cầu).
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(BENCHMARK_DIR)
+if PROJECT_DIR not in sys.path:
+    sys.path.insert(0, PROJECT_DIR)
+
+from src.utils import apply_migrations
+from src.utils.resolver import LOOKUP_QUERIES
+
+DEFAULT_COVERING = ("orders_by_status", "recent_orders")
+
+
+def explain(conn, query, params):
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+
+
+def check_plans(db_path, require_covering=DEFAULT_COVERING):
+    """Trả về [(name, plan, problem)]; problem = None nếu query plan đạt yêu cầu"""
+    apply_migrations(db_path)
+    conn = sqlite3.connect(db_path)
+    results = []
+    try:
+        for name, (query, params) in LOOKUP_QUERIES.items():
+            plan = explain(conn, query, params)
+            problem = None
+            if any(step.startswith("SCAN") for step in plan):
+                problem = "quét bảng"
+            elif name in require_covering and not any("COVERING INDEX" in step for step in plan):
+                problem = "không dùng covering index"
+            results.append((name, plan, problem))
+    finally:
+        conn.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=os.getenv("STORE_DB_PATH", os.path.join(PROJECT_DIR, "database", "repo", "store.db")))
+    parser.add_argument("--require-covering", nargs="*", default=list(DEFAULT_COVERING))
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="query_plans_")
+    try:
+        db_copy = os.path.join(workdir, "store.db")
+        shutil.copy(args.db, db_copy)
+        results = check_plans(db_copy, args.require_covering)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    failed = 0
+    for name, plan, problem in results:
+        print(f"{'❌' if problem else '✅'} {name:<20} {' | '.join(plan)}" + (f"  <- {problem}" if problem else ""))
+        failed += problem is not None
+    if failed:
+        print(f"\n❌ {failed}/{len(results)} câu truy vấn không đạt")
+        sys.exit(1)
+    print(f"\n✅ {len(results)} câu truy vấn đều dùng index")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Benchmark recall / latency của các chiến lược tìm kiếm trong RAG.
+
+Chạy từ thư mục gốc project (cần ChromaDB đã có dữ liệu, xem README):
+    python -m benchmark.rag_retrieval
+    python -m benchmark.rag_retrieval --top-k 3 --rerank
+"""
+import argparse
+import json
+import os
+import time
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+queries_path = os.path.join(BENCHMARK_DIR, "rag_queries.jsonl")
+
+
+def load_queries(path=queries_path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def evaluate(name, search_fn, queries, top_k):
+    """Recall@k: có ít nhất 1 chunk trong top_k chứa đoạn 'expected'. MRR theo chunk đúng đầu tiên."""
+    hits, reciprocal_ranks, latencies = 0, [], []
+    for q in queries:
+        start = time.perf_counter()
+        docs = search_fn(q["query"], top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        rank = next((i + 1 for i, doc in enumerate(docs) if q["expected"] in doc), None)
+        hits += rank is not None
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+
+    latencies = np.array(latencies)
+    return {
+        "method": name,
+        f"recall@{top_k}": round(hits / len(queries), 3),
+        "mrr": round(float(np.mean(reciprocal_ranks)), 3),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark RAG retrieval")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--queries", default=queries_path)
+    parser.add_argument("--rerank", action="store_true", help="Thêm cấu hình hybrid + cross-encoder")
+    parser.add_argument("--reranker", default="cross-encoder/ms-marco-MiniLM-L-6-v2")
+    args = parser.parse_args()
+
+    from src.chatTools import RAG
+    rag = RAG.get_instance()
+    queries = load_queries(args.queries)
+    chunks, bm25 = rag._get_chunk_cache()
+    print(f"📊 {len(queries)} queries, {len(chunks)} chunks")
+
+    methods = {
+        "vector": lambda q, k: rag.search_with_metadata(q, k)["documents"],
+        "bm25": lambda q, k: [chunks[cid][0] for cid, _ in bm25.search(q, k)],
+        "hybrid": lambda q, k: rag.search_hybrid(q, k, rerank=False),
+    }
+    if args.rerank:
+        rag.reranker_name = args.reranker
+        methods["hybrid+rerank"] = lambda q, k: rag.search_hybrid(q, k, rerank=True)
+
+    # Warm-up: load model embedding / reranker trước khi đo
+    for fn in methods.values():
+        fn(queries[0]["query"], args.top_k)
+
+    results = [evaluate(name, fn, queries, args.top_k) for name, fn in methods.items()]
+    for res in results:
+        print(json.dumps(res, ensure_ascii=False))
+    return results
+
+
+if __name__ == "__main__":
+    main()
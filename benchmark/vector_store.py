@@ -0,0 +1,96 @@
+"""So sánh vector store của RAG: Chroma với store "flat" (NumPy memory-mapped).
+
+Nạp database/rag vào cả 2 store (thư mục tạm), rồi đo:
+- khởi động: import + mở store + query đầu tiên trong 1 process mới
+- latency query (p50 / p95) qua rag_queries.jsonl
+- kết quả: top-k id của 2 store có giống nhau không
+    python -m benchmark.vector_store
+    python -m benchmark.vector_store --top-k 20 --fake-embeddings   # chạy offline, không cần MiniLM
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(BENCHMARK_DIR)
+if PROJECT_DIR not in sys.path:
+    sys.path.insert(0, PROJECT_DIR)
+
+from benchmark.rag_retrieval import load_queries
+
+_STARTUP_SCRIPT = """
+import importlib.util, time, numpy as np
+start = time.perf_counter()
+# Nạp riêng module vector_store (không kéo theo src.chatTools / model)
+spec = importlib.util.spec_from_file_location("vector_store", "src/chatTools/vector_store.py")
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+store = module.create_vector_store({backend!r}, path={path!r})
+store.query([np.zeros({dim}, dtype=np.float32)], n_results=3)
+print((time.perf_counter() - start) * 1000)
+"""
+
+
+def measure_startup(backend, path, dim):
+    """ms từ lúc import tới query đầu tiên, trong 1 process mới (như 1 worker vừa khởi động)"""
+    output = subprocess.run(
+        [sys.executable, "-c", _STARTUP_SCRIPT.format(backend=backend, path=path, dim=dim)],
+        cwd=PROJECT_DIR, capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--data", default=os.path.join(PROJECT_DIR, "database", "rag"))
+    parser.add_argument("--fake-embeddings", action="store_true", help="Dùng embedding giả (benchmark/fakes.py)")
+    args = parser.parse_args()
+
+    if args.fake_embeddings:
+        from benchmark import fakes
+        fakes.install({})
+    from src.chatTools import RAG
+
+    workdir = tempfile.mkdtemp(prefix="vector_store_")
+    try:
+        rags = {}
+        for backend in ("chroma", "flat"):
+            rag = RAG(vector_store=backend, chroma_path=os.path.join(workdir, backend))
+            rag.add_data(args.data)
+            rags[backend] = rag
+
+        queries = [q["query"] for q in load_queries()]
+        dim = len(rags["flat"]._encode("warmup"))
+        report, rankings = {}, {}
+        for backend, rag in rags.items():
+            rag._vector_ranking(queries[0], args.top_k)  # warm-up
+            latencies, rankings[backend] = [], []
+            for query in queries:
+                start = time.perf_counter()
+                rankings[backend].append(rag._vector_ranking(query, args.top_k))
+                latencies.append((time.perf_counter() - start) * 1000)
+            report[backend] = {
+                "chunks": rag.store.count(),
+                "startup_ms": round(measure_startup(backend, os.path.join(workdir, backend), dim), 1),
+                "query_p50_ms": round(float(np.percentile(latencies, 50)), 3),
+                "query_p95_ms": round(float(np.percentile(latencies, 95)), 3),
+            }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    same = sum(a == b for a, b in zip(rankings["chroma"], rankings["flat"]))
+    for backend, res in report.items():
+        print(json.dumps({"backend": backend, **res}, ensure_ascii=False))
+    print(f"{'✅' if same == len(queries) else '❌'} top-{args.top_k} giống nhau: {same}/{len(queries)} query")
+    return 0 if same == len(queries) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
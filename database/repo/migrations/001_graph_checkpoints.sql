@@ -0,0 +1,49 @@
+-- ===== CHECKPOINT CHO LANGGRAPH (state hội thoại theo session) =====
+-- ThreadId = session_id. Mỗi bước graph chỉ lưu channel thay đổi (blobs)
+-- và message mới (graph_checkpoint_messages, khử trùng theo hash).
+
+CREATE TABLE IF NOT EXISTS graph_checkpoints (
+    ThreadId TEXT NOT NULL,
+    CheckpointNs TEXT NOT NULL DEFAULT '',
+    CheckpointId TEXT NOT NULL,
+    ParentCheckpointId TEXT,
+    CheckpointType TEXT NOT NULL,
+    Checkpoint BLOB NOT NULL,
+    MetadataType TEXT NOT NULL,
+    Metadata BLOB NOT NULL,
+    CreatedAt DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (ThreadId, CheckpointNs, CheckpointId)
+);
+
+CREATE TABLE IF NOT EXISTS graph_checkpoint_blobs (
+    ThreadId TEXT NOT NULL,
+    CheckpointNs TEXT NOT NULL DEFAULT '',
+    Channel TEXT NOT NULL,
+    Version TEXT NOT NULL,
+    ValueType TEXT NOT NULL,
+    Value BLOB,
+    PRIMARY KEY (ThreadId, CheckpointNs, Channel, Version)
+);
+
+CREATE TABLE IF NOT EXISTS graph_checkpoint_writes (
+    ThreadId TEXT NOT NULL,
+    CheckpointNs TEXT NOT NULL DEFAULT '',
+    CheckpointId TEXT NOT NULL,
+    TaskId TEXT NOT NULL,
+    Idx INTEGER NOT NULL,
+    Channel TEXT NOT NULL,
+    ValueType TEXT NOT NULL,
+    Value BLOB,
+    TaskPath TEXT DEFAULT '',
+    PRIMARY KEY (ThreadId, CheckpointNs, CheckpointId, TaskId, Idx)
+);
+
+CREATE TABLE IF NOT EXISTS graph_checkpoint_messages (
+    ThreadId TEXT NOT NULL,
+    MessageHash TEXT NOT NULL,
+    ValueType TEXT NOT NULL,
+    Value BLOB NOT NULL,
+    PRIMARY KEY (ThreadId, MessageHash)
+);
+
+CREATE INDEX IF NOT EXISTS idx_graph_checkpoints_created ON graph_checkpoints(CreatedAt);
@@ -0,0 +1,23 @@
+-- ===== STATE DÙNG CHUNG GIỮA CÁC WORKER =====
+-- Lịch sử chat theo session (trước đây là dict `sessions` trong main.py)
+-- và key-value ngắn hạn (vd: reference của ToolOutputFormatter).
+
+CREATE TABLE IF NOT EXISTS chat_session_history (
+    Id INTEGER PRIMARY KEY AUTOINCREMENT,
+    SessionId TEXT NOT NULL,
+    UserMessage TEXT,
+    BotResponse TEXT,
+    TraceId TEXT,
+    CreatedAt TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_session_history_session
+    ON chat_session_history (SessionId, Id);
+
+CREATE TABLE IF NOT EXISTS shared_kv (
+    Namespace TEXT NOT NULL,
+    Key TEXT NOT NULL,
+    Value TEXT,
+    ExpiresAt REAL,
+    PRIMARY KEY (Namespace, Key)
+);
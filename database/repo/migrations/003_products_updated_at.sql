@@ -0,0 +1,5 @@
+-- ===== CATALOGUE SNAPSHOT =====
+-- ProductCatalog (src/utils/catalog.py) refresh tăng dần theo products.UpdatedAt:
+-- index để câu "WHERE UpdatedAt >= ?" không phải quét toàn bảng.
+
+CREATE INDEX IF NOT EXISTS idx_products_updated_at ON products (UpdatedAt);
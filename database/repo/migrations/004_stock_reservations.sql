@@ -0,0 +1,20 @@
+-- ===== GIỮ HÀNG CHO ĐƠN PENDING =====
+-- Mỗi dòng là số lượng đã trừ khỏi products.Quantity cho 1 đơn hàng.
+-- Held: đang giữ tới ExpiresAt (unix time) | Committed: đơn đã được xử lý
+-- Released: khách hủy, đã hoàn kho | Expired: hết hạn, đã hoàn kho và hủy đơn
+
+CREATE TABLE IF NOT EXISTS stock_reservations (
+    ReservationId INTEGER PRIMARY KEY AUTOINCREMENT,
+    OrderId INTEGER NOT NULL,
+    ProductId INTEGER NOT NULL,
+    Quantity INTEGER NOT NULL CHECK(Quantity > 0),
+    Status TEXT NOT NULL CHECK(Status IN ('Held', 'Committed', 'Released', 'Expired')) DEFAULT 'Held',
+    ExpiresAt REAL NOT NULL,
+    CreatedAt DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_stock_reservations_order
+    ON stock_reservations (OrderId);
+
+CREATE INDEX IF NOT EXISTS idx_stock_reservations_held
+    ON stock_reservations (Status, ExpiresAt);
@@ -0,0 +1,14 @@
+-- ===== TRA CỨU KHÁCH HÀNG / ĐƠN HÀNG =====
+-- Tool tra cứu theo email / số điện thoại và lấy đơn gần nhất của khách hàng
+-- (src/utils/resolver.py). Kiểm tra query plan: python -m benchmark.query_plans
+
+-- Email so khớp không phân biệt hoa thường: WHERE Email = ? COLLATE NOCASE
+CREATE INDEX IF NOT EXISTS idx_customers_email_nocase ON customers (Email COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_customers_phone ON customers (Phone);
+
+-- Covering index cho "đơn của khách theo trạng thái, mới nhất trước" và "đơn gần nhất của khách"
+CREATE INDEX IF NOT EXISTS idx_orders_customer_status_date ON orders (CustomerId, Status, OrderDate, TotalAmount);
+CREATE INDEX IF NOT EXISTS idx_orders_customer_date ON orders (CustomerId, OrderDate, Status, TotalAmount);
+
+-- Đã được 2 index trên bao phủ (cùng tiền tố CustomerId)
+DROP INDEX IF EXISTS idx_orders_customer;
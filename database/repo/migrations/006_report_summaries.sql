@@ -0,0 +1,228 @@
+-- ===== BẢNG TỔNG HỢP CHO BÁO CÁO =====
+-- Bản materialize của các view customer_order_summary, product_sales_summary, daily_sales_report:
+-- trigger trên orders / order_details cộng trừ phần đóng góp của từng dòng, nên đọc báo cáo
+-- không phải aggregate lại toàn bộ bảng. Backfill / sửa lệch: python -m src.utils.reports rebuild
+-- Đơn "đã bán" = Status IN ('Completed', 'Delivered'); CompletedOrderValue của khách chỉ tính 'Completed' (giống view).
+
+CREATE TABLE IF NOT EXISTS report_customer_summary (
+    CustomerId INTEGER PRIMARY KEY,
+    TotalOrders INTEGER NOT NULL DEFAULT 0,
+    CompletedOrderValue DECIMAL(15,2) NOT NULL DEFAULT 0,
+    TotalOrderValue DECIMAL(15,2) NOT NULL DEFAULT 0,
+    LastOrderDate DATETIME
+);
+CREATE INDEX IF NOT EXISTS idx_report_customer_value ON report_customer_summary (TotalOrderValue DESC);
+
+CREATE TABLE IF NOT EXISTS report_product_sales (
+    ProductId INTEGER PRIMARY KEY,
+    TotalSold INTEGER NOT NULL DEFAULT 0,
+    Revenue DECIMAL(15,2) NOT NULL DEFAULT 0,
+    LineCount INTEGER NOT NULL DEFAULT 0,
+    UnitPriceSum DECIMAL(15,2) NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_report_product_revenue ON report_product_sales (Revenue DESC);
+CREATE INDEX IF NOT EXISTS idx_report_product_sold ON report_product_sales (TotalSold DESC);
+
+CREATE TABLE IF NOT EXISTS report_daily_sales (
+    SaleDate DATE PRIMARY KEY,
+    TotalOrders INTEGER NOT NULL DEFAULT 0,
+    TotalSales DECIMAL(15,2) NOT NULL DEFAULT 0,
+    CompletedOrders INTEGER NOT NULL DEFAULT 0,
+    CompletedSales DECIMAL(15,2) NOT NULL DEFAULT 0
+);
+
+-- Số đơn của mỗi khách trong ngày: UniqueCustomers = số dòng của ngày đó
+CREATE TABLE IF NOT EXISTS report_daily_customers (
+    SaleDate DATE NOT NULL,
+    CustomerId INTEGER NOT NULL,
+    Orders INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (SaleDate, CustomerId)
+);
+
+-- ----------- ORDERS: khách hàng + theo ngày -----------
+CREATE TRIGGER IF NOT EXISTS report_orders_after_insert
+    AFTER INSERT ON orders
+BEGIN
+    INSERT INTO report_customer_summary (CustomerId, TotalOrders, CompletedOrderValue, TotalOrderValue, LastOrderDate)
+    VALUES (NEW.CustomerId, 1, CASE WHEN NEW.Status = 'Completed' THEN NEW.TotalAmount ELSE 0 END, NEW.TotalAmount, NEW.OrderDate)
+    ON CONFLICT (CustomerId) DO UPDATE SET
+        TotalOrders = TotalOrders + 1,
+        CompletedOrderValue = CompletedOrderValue + excluded.CompletedOrderValue,
+        TotalOrderValue = TotalOrderValue + excluded.TotalOrderValue,
+        LastOrderDate = MAX(COALESCE(LastOrderDate, ''), excluded.LastOrderDate);
+
+    INSERT INTO report_daily_sales (SaleDate, TotalOrders, TotalSales, CompletedOrders, CompletedSales)
+    VALUES (DATE(NEW.OrderDate), 1, NEW.TotalAmount,
+            NEW.Status IN ('Completed', 'Delivered'),
+            CASE WHEN NEW.Status IN ('Completed', 'Delivered') THEN NEW.TotalAmount ELSE 0 END)
+    ON CONFLICT (SaleDate) DO UPDATE SET
+        TotalOrders = TotalOrders + 1,
+        TotalSales = TotalSales + excluded.TotalSales,
+        CompletedOrders = CompletedOrders + excluded.CompletedOrders,
+        CompletedSales = CompletedSales + excluded.CompletedSales;
+
+    INSERT INTO report_daily_customers (SaleDate, CustomerId, Orders)
+    VALUES (DATE(NEW.OrderDate), NEW.CustomerId, 1)
+    ON CONFLICT (SaleDate, CustomerId) DO UPDATE SET Orders = Orders + 1;
+END;
+
+-- Cập nhật = trừ phần đóng góp cũ (OLD) rồi cộng phần mới (NEW)
+CREATE TRIGGER IF NOT EXISTS report_orders_after_update
+    AFTER UPDATE OF CustomerId, OrderDate, Status, TotalAmount ON orders
+BEGIN
+    UPDATE report_customer_summary SET
+        TotalOrders = TotalOrders - 1,
+        CompletedOrderValue = CompletedOrderValue - CASE WHEN OLD.Status = 'Completed' THEN OLD.TotalAmount ELSE 0 END,
+        TotalOrderValue = TotalOrderValue - OLD.TotalAmount
+    WHERE CustomerId = OLD.CustomerId;
+
+    INSERT INTO report_customer_summary (CustomerId, TotalOrders, CompletedOrderValue, TotalOrderValue)
+    VALUES (NEW.CustomerId, 1, CASE WHEN NEW.Status = 'Completed' THEN NEW.TotalAmount ELSE 0 END, NEW.TotalAmount)
+    ON CONFLICT (CustomerId) DO UPDATE SET
+        TotalOrders = TotalOrders + 1,
+        CompletedOrderValue = CompletedOrderValue + excluded.CompletedOrderValue,
+        TotalOrderValue = TotalOrderValue + excluded.TotalOrderValue;
+
+    UPDATE report_customer_summary
+    SET LastOrderDate = (SELECT MAX(OrderDate) FROM orders WHERE CustomerId = report_customer_summary.CustomerId)
+    WHERE CustomerId IN (OLD.CustomerId, NEW.CustomerId);
+
+    UPDATE report_daily_sales SET
+        TotalOrders = TotalOrders - 1,
+        TotalSales = TotalSales - OLD.TotalAmount,
+        CompletedOrders = CompletedOrders - (OLD.Status IN ('Completed', 'Delivered')),
+        CompletedSales = CompletedSales - CASE WHEN OLD.Status IN ('Completed', 'Delivered') THEN OLD.TotalAmount ELSE 0 END
+    WHERE SaleDate = DATE(OLD.OrderDate);
+
+    INSERT INTO report_daily_sales (SaleDate, TotalOrders, TotalSales, CompletedOrders, CompletedSales)
+    VALUES (DATE(NEW.OrderDate), 1, NEW.TotalAmount,
+            NEW.Status IN ('Completed', 'Delivered'),
+            CASE WHEN NEW.Status IN ('Completed', 'Delivered') THEN NEW.TotalAmount ELSE 0 END)
+    ON CONFLICT (SaleDate) DO UPDATE SET
+        TotalOrders = TotalOrders + 1,
+        TotalSales = TotalSales + excluded.TotalSales,
+        CompletedOrders = CompletedOrders + excluded.CompletedOrders,
+        CompletedSales = CompletedSales + excluded.CompletedSales;
+
+    UPDATE report_daily_customers SET Orders = Orders - 1
+    WHERE SaleDate = DATE(OLD.OrderDate) AND CustomerId = OLD.CustomerId;
+    INSERT INTO report_daily_customers (SaleDate, CustomerId, Orders)
+    VALUES (DATE(NEW.OrderDate), NEW.CustomerId, 1)
+    ON CONFLICT (SaleDate, CustomerId) DO UPDATE SET Orders = Orders + 1;
+    DELETE FROM report_daily_customers
+    WHERE SaleDate = DATE(OLD.OrderDate) AND CustomerId = OLD.CustomerId AND Orders <= 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS report_orders_after_delete
+    AFTER DELETE ON orders
+BEGIN
+    UPDATE report_customer_summary SET
+        TotalOrders = TotalOrders - 1,
+        CompletedOrderValue = CompletedOrderValue - CASE WHEN OLD.Status = 'Completed' THEN OLD.TotalAmount ELSE 0 END,
+        TotalOrderValue = TotalOrderValue - OLD.TotalAmount,
+        LastOrderDate = (SELECT MAX(OrderDate) FROM orders WHERE CustomerId = OLD.CustomerId)
+    WHERE CustomerId = OLD.CustomerId;
+
+    UPDATE report_daily_sales SET
+        TotalOrders = TotalOrders - 1,
+        TotalSales = TotalSales - OLD.TotalAmount,
+        CompletedOrders = CompletedOrders - (OLD.Status IN ('Completed', 'Delivered')),
+        CompletedSales = CompletedSales - CASE WHEN OLD.Status IN ('Completed', 'Delivered') THEN OLD.TotalAmount ELSE 0 END
+    WHERE SaleDate = DATE(OLD.OrderDate);
+
+    UPDATE report_daily_customers SET Orders = Orders - 1
+    WHERE SaleDate = DATE(OLD.OrderDate) AND CustomerId = OLD.CustomerId;
+    DELETE FROM report_daily_customers
+    WHERE SaleDate = DATE(OLD.OrderDate) AND CustomerId = OLD.CustomerId AND Orders <= 0;
+END;
+
+-- ----------- SẢN PHẨM: chỉ tính chi tiết của đơn đã bán -----------
+CREATE TRIGGER IF NOT EXISTS report_orders_sold
+    AFTER UPDATE OF Status ON orders
+    WHEN NEW.Status IN ('Completed', 'Delivered') AND OLD.Status NOT IN ('Completed', 'Delivered')
+BEGIN
+    INSERT INTO report_product_sales (ProductId, TotalSold, Revenue, LineCount, UnitPriceSum)
+    SELECT ProductId, SUM(Quantity), SUM(SubTotal), COUNT(*), SUM(UnitPrice)
+    FROM order_details WHERE OrderId = NEW.OrderId GROUP BY ProductId
+    ON CONFLICT (ProductId) DO UPDATE SET
+        TotalSold = TotalSold + excluded.TotalSold,
+        Revenue = Revenue + excluded.Revenue,
+        LineCount = LineCount + excluded.LineCount,
+        UnitPriceSum = UnitPriceSum + excluded.UnitPriceSum;
+END;
+
+CREATE TRIGGER IF NOT EXISTS report_orders_unsold
+    AFTER UPDATE OF Status ON orders
+    WHEN OLD.Status IN ('Completed', 'Delivered') AND NEW.Status NOT IN ('Completed', 'Delivered')
+BEGIN
+    UPDATE report_product_sales SET
+        TotalSold = TotalSold - d.Sold,
+        Revenue = Revenue - d.Amount,
+        LineCount = LineCount - d.Lines,
+        UnitPriceSum = UnitPriceSum - d.UnitPrices
+    FROM (SELECT ProductId, SUM(Quantity) AS Sold, SUM(SubTotal) AS Amount, COUNT(*) AS Lines, SUM(UnitPrice) AS UnitPrices
+          FROM order_details WHERE OrderId = NEW.OrderId GROUP BY ProductId) AS d
+    WHERE report_product_sales.ProductId = d.ProductId;
+END;
+
+-- BEFORE DELETE: chi tiết đơn vẫn còn (ON DELETE CASCADE chưa chạy)
+CREATE TRIGGER IF NOT EXISTS report_orders_before_delete
+    BEFORE DELETE ON orders
+    WHEN OLD.Status IN ('Completed', 'Delivered')
+BEGIN
+    UPDATE report_product_sales SET
+        TotalSold = TotalSold - d.Sold,
+        Revenue = Revenue - d.Amount,
+        LineCount = LineCount - d.Lines,
+        UnitPriceSum = UnitPriceSum - d.UnitPrices
+    FROM (SELECT ProductId, SUM(Quantity) AS Sold, SUM(SubTotal) AS Amount, COUNT(*) AS Lines, SUM(UnitPrice) AS UnitPrices
+          FROM order_details WHERE OrderId = OLD.OrderId GROUP BY ProductId) AS d
+    WHERE report_product_sales.ProductId = d.ProductId;
+
+    -- Chi tiết bị xóa theo CASCADE sau đó không được trừ lần nữa (đơn cha đã không còn)
+END;
+
+CREATE TRIGGER IF NOT EXISTS report_details_after_insert
+    AFTER INSERT ON order_details
+    WHEN EXISTS (SELECT 1 FROM orders WHERE OrderId = NEW.OrderId AND Status IN ('Completed', 'Delivered'))
+BEGIN
+    INSERT INTO report_product_sales (ProductId, TotalSold, Revenue, LineCount, UnitPriceSum)
+    VALUES (NEW.ProductId, NEW.Quantity, NEW.SubTotal, 1, NEW.UnitPrice)
+    ON CONFLICT (ProductId) DO UPDATE SET
+        TotalSold = TotalSold + excluded.TotalSold,
+        Revenue = Revenue + excluded.Revenue,
+        LineCount = LineCount + 1,
+        UnitPriceSum = UnitPriceSum + excluded.UnitPriceSum;
+END;
+
+CREATE TRIGGER IF NOT EXISTS report_details_after_update
+    AFTER UPDATE OF ProductId, Quantity, UnitPrice, DiscountAmount ON order_details
+    WHEN EXISTS (SELECT 1 FROM orders WHERE OrderId = NEW.OrderId AND Status IN ('Completed', 'Delivered'))
+BEGIN
+    UPDATE report_product_sales SET
+        TotalSold = TotalSold - OLD.Quantity,
+        Revenue = Revenue - OLD.SubTotal,
+        LineCount = LineCount - 1,
+        UnitPriceSum = UnitPriceSum - OLD.UnitPrice
+    WHERE ProductId = OLD.ProductId;
+
+    INSERT INTO report_product_sales (ProductId, TotalSold, Revenue, LineCount, UnitPriceSum)
+    VALUES (NEW.ProductId, NEW.Quantity, NEW.SubTotal, 1, NEW.UnitPrice)
+    ON CONFLICT (ProductId) DO UPDATE SET
+        TotalSold = TotalSold + excluded.TotalSold,
+        Revenue = Revenue + excluded.Revenue,
+        LineCount = LineCount + 1,
+        UnitPriceSum = UnitPriceSum + excluded.UnitPriceSum;
+END;
+
+CREATE TRIGGER IF NOT EXISTS report_details_after_delete
+    AFTER DELETE ON order_details
+    WHEN EXISTS (SELECT 1 FROM orders WHERE OrderId = OLD.OrderId AND Status IN ('Completed', 'Delivered'))
+BEGIN
+    UPDATE report_product_sales SET
+        TotalSold = TotalSold - OLD.Quantity,
+        Revenue = Revenue - OLD.SubTotal,
+        LineCount = LineCount - 1,
+        UnitPriceSum = UnitPriceSum - OLD.UnitPrice
+    WHERE ProductId = OLD.ProductId;
+END;
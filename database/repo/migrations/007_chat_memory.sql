@@ -0,0 +1,18 @@
+-- ===== BỘ NHỚ DÀI HẠN THEO NGỮ NGHĨA =====
+-- Mỗi lượt hội thoại (câu hỏi + câu trả lời cuối) kèm embedding, tra cứu top-k theo cosine
+-- cho tin nhắn mới thay vì tóm tắt lịch sử bằng LLM.
+-- Cùng cột ContentEmbedding / EmbeddingModel như chat_messages, nhưng SessionId là thread_id dạng TEXT
+-- của graph (chat_messages.SessionId là INTEGER trỏ tới chat_sessions / customers).
+
+CREATE TABLE IF NOT EXISTS chat_memory (
+    MemoryId INTEGER PRIMARY KEY AUTOINCREMENT,
+    SessionId TEXT NOT NULL,
+    UserMessage TEXT NOT NULL,
+    BotResponse TEXT NOT NULL,
+    ContentEmbedding BLOB NOT NULL, -- đã chuẩn hóa (cosine = tích vô hướng)
+    EmbeddingModel TEXT,
+    CreatedAt DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_memory_session
+    ON chat_memory (SessionId, MemoryId);
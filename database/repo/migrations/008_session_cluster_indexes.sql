@@ -0,0 +1,12 @@
+-- ===== INDEX CHO JOB PHÂN CỤM SESSION (src/utils/session_clusters.py) =====
+-- Job đọc bản tóm tắt mới nhất / tin nhắn theo từng trang SessionId; không có index thì mỗi trang quét toàn bảng.
+
+CREATE INDEX IF NOT EXISTS idx_conversation_summaries_session
+    ON conversation_summaries (SessionId, SummaryId);
+
+CREATE INDEX IF NOT EXISTS idx_chat_messages_session
+    ON chat_messages (SessionId, MessageId);
+
+-- Xóa cụm (ON DELETE CASCADE) và cập nhật SessionCount theo ClusterId
+CREATE INDEX IF NOT EXISTS idx_session_clusters_cluster
+    ON session_clusters (ClusterId);
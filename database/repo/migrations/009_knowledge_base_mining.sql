@@ -0,0 +1,17 @@
+-- ===== KNOWLEDGE BASE TỪ HỘI THOẠI =====
+-- KnowledgeBase (src/controller/knowledge.py) lọc các cặp hỏi / đáp từ chat_memory vào knowledge_base,
+-- rồi trả lời thẳng câu hỏi trùng nghĩa trước khi chạy RAG + LLM.
+-- Title = câu hỏi, Content = câu trả lời; tra cứu theo câu hỏi nên cần thêm embedding của Title.
+
+ALTER TABLE knowledge_base ADD COLUMN TitleEmbedding BLOB; -- định dạng src/utils/vector_codec.py
+ALTER TABLE knowledge_base ADD COLUMN ConfirmCount INTEGER DEFAULT 1; -- số lần câu hỏi được trả lời giống nhau
+
+CREATE INDEX IF NOT EXISTS idx_knowledge_base_active
+    ON knowledge_base (IsActive, EmbeddingModel, KnowledgeId);
+
+-- Vị trí đã đọc tới của từng nguồn (chat_memory.MemoryId), lần sau chỉ đọc các dòng mới
+CREATE TABLE IF NOT EXISTS knowledge_mining_state (
+    Source TEXT PRIMARY KEY,
+    LastId INTEGER NOT NULL DEFAULT 0,
+    UpdatedAt DATETIME DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,5 @@
+-- ===== TOOL ĐÃ DÙNG TRONG MỖI LƯỢT =====
+-- KnowledgeBase.mine() chỉ lấy các lượt trả lời không dựa trên kết quả tool tra cứu (giá, tồn kho, đơn hàng...).
+-- ToolsUsed: tên các tool được gọi trong lượt, cách nhau bởi dấu phẩy ('' = không gọi tool, NULL = không rõ).
+
+ALTER TABLE chat_memory ADD COLUMN ToolsUsed TEXT;
@@ -0,0 +1,31 @@
+-- ===== BACKFILL BẢNG BÁO CÁO =====
+-- Tính lại các bảng tổng hợp của migration 006 từ orders / order_details ngay trong migration (cùng 1 transaction),
+-- thay vì để ReportStore backfill khi bảng còn trống: đơn được ghi sau khi 006 chạy nhưng trước lần đầu dùng
+-- ReportStore làm bảng không còn trống và phần dữ liệu cũ không bao giờ được backfill.
+-- Trigger của 006 đã có từ trước nên các đơn ghi sau transaction này vẫn được cộng dồn đúng.
+-- Giữ giống _FULL_AGGREGATES trong src/utils/reports.py.
+
+DELETE FROM report_customer_summary;
+INSERT INTO report_customer_summary (CustomerId, TotalOrders, CompletedOrderValue, TotalOrderValue, LastOrderDate)
+SELECT CustomerId, COUNT(*),
+       SUM(CASE WHEN Status = 'Completed' THEN TotalAmount ELSE 0 END),
+       SUM(TotalAmount), MAX(OrderDate)
+FROM orders GROUP BY CustomerId;
+
+DELETE FROM report_product_sales;
+INSERT INTO report_product_sales (ProductId, TotalSold, Revenue, LineCount, UnitPriceSum)
+SELECT od.ProductId, SUM(od.Quantity), SUM(od.SubTotal), COUNT(*), SUM(od.UnitPrice)
+FROM order_details od JOIN orders o ON o.OrderId = od.OrderId
+WHERE o.Status IN ('Completed', 'Delivered')
+GROUP BY od.ProductId;
+
+DELETE FROM report_daily_sales;
+INSERT INTO report_daily_sales (SaleDate, TotalOrders, TotalSales, CompletedOrders, CompletedSales)
+SELECT DATE(OrderDate), COUNT(*), SUM(TotalAmount),
+       SUM(Status IN ('Completed', 'Delivered')),
+       SUM(CASE WHEN Status IN ('Completed', 'Delivered') THEN TotalAmount ELSE 0 END)
+FROM orders GROUP BY DATE(OrderDate);
+
+DELETE FROM report_daily_customers;
+INSERT INTO report_daily_customers (SaleDate, CustomerId, Orders)
+SELECT DATE(OrderDate), CustomerId, COUNT(*) FROM orders GROUP BY DATE(OrderDate), CustomerId;
@@ -0,0 +1,28 @@
+-- ===== ĐỒNG BỘ RESERVATION KHI ĐỔI TRẠNG THÁI ĐƠN =====
+-- Trạng thái đơn được đổi ngoài chatbot (hệ thống quản lý đơn / thanh toán ghi thẳng vào orders),
+-- nên việc chốt / hoàn hàng giữ nằm ở trigger thay vì ở code của app.
+
+-- Đơn rời Pending (Processing / Shipped / ...): chốt phần hàng đang giữ, thread nền không thu hồi nữa
+CREATE TRIGGER IF NOT EXISTS reservations_commit_on_status
+    AFTER UPDATE OF Status ON orders
+    WHEN OLD.Status = 'Pending' AND NEW.Status NOT IN ('Pending', 'Cancelled')
+BEGIN
+    UPDATE stock_reservations SET Status = 'Committed'
+    WHERE OrderId = NEW.OrderId AND Status = 'Held';
+END;
+
+-- Đơn Pending bị hủy từ bên ngoài: hoàn kho phần đang giữ
+-- (thread nền đánh dấu Expired trước khi hủy nên không bị hoàn 2 lần)
+CREATE TRIGGER IF NOT EXISTS reservations_release_on_cancel
+    AFTER UPDATE OF Status ON orders
+    WHEN OLD.Status = 'Pending' AND NEW.Status = 'Cancelled'
+BEGIN
+    UPDATE products SET
+        Quantity = Quantity + (SELECT SUM(r.Quantity) FROM stock_reservations r
+                               WHERE r.OrderId = NEW.OrderId AND r.ProductId = products.ProductId AND r.Status = 'Held'),
+        UpdatedAt = CURRENT_TIMESTAMP
+    WHERE ProductId IN (SELECT ProductId FROM stock_reservations WHERE OrderId = NEW.OrderId AND Status = 'Held');
+
+    UPDATE stock_reservations SET Status = 'Released'
+    WHERE OrderId = NEW.OrderId AND Status = 'Held';
+END;
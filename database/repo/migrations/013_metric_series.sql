@@ -0,0 +1,15 @@
+-- ===== METRICS DÙNG CHUNG GIỮA CÁC WORKER =====
+-- Mỗi worker cộng dồn phần tăng thêm (delta) của counter / histogram vào đây theo chu kỳ,
+-- /metrics đọc tổng của mọi worker (không bị reset khi worker restart theo max_requests).
+
+CREATE TABLE IF NOT EXISTS metric_series (
+    Name TEXT NOT NULL,                 -- tên metric chưa có prefix, vd: sql_query_seconds
+    Labels TEXT NOT NULL,               -- JSON [[key, value], ...] đã sắp xếp theo key
+    Kind TEXT NOT NULL CHECK(Kind IN ('counter', 'histogram')),
+    Value REAL NOT NULL DEFAULT 0,      -- counter: giá trị | histogram: tổng (sum)
+    Count INTEGER NOT NULL DEFAULT 0,   -- histogram: số lần observe
+    Buckets TEXT,                       -- histogram: JSON số đếm (cộng dồn theo bucket)
+    Help TEXT,
+    UpdatedAt DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (Name, Labels)
+);
@@ -204,9 +204,9 @@ CREATE TABLE conversation_summaries (
     SummaryId INTEGER PRIMARY KEY AUTOINCREMENT,
     SessionId INTEGER NOT NULL,
     SummaryContent TEXT NOT NULL,
-    SummaryEmbedding BLOB, -- Vector embedding của summary (binary format)
-    EmbeddingModel TEXT DEFAULT 'text-embedding-ada-002', -- Model được sử dụng
-    EmbeddingDimension INTEGER DEFAULT 1536, -- Số chiều của vector
+    SummaryEmbedding BLOB, -- Vector embedding của summary (định dạng src/utils/vector_codec.py)
+    EmbeddingModel TEXT DEFAULT 'all-MiniLM-L6-v2', -- Model được sử dụng
+    EmbeddingDimension INTEGER DEFAULT 384, -- Số chiều của vector (header của BLOB, xem src/utils/vector_codec.py)
     MessageRangeStart INTEGER NOT NULL, -- MessageId đầu tiên được tóm tắt
     MessageRangeEnd INTEGER NOT NULL,   -- MessageId cuối cùng được tóm tắt
     MessageCount INTEGER NOT NULL DEFAULT 0, -- Số lượng messages được tóm tắt
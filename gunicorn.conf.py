@@ -0,0 +1,48 @@
+# Cấu hình chạy production nhiều worker:
+#     gunicorn -c gunicorn.conf.py main:app
+#
+# - preload_app: load model / RAG 1 lần ở process master rồi mới fork,
+#   các worker dùng chung trang bộ nhớ (copy-on-write) thay vì mỗi worker load 1 bản
+# - State dùng chung nằm trong SQLite (checkpoint LangGraph, lịch sử chat, reference của tool)
+# - Dev vẫn chạy: python main.py (1 process, auto reload)
+import gc
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', 8000)}")
+workers = int(os.getenv("WEB_CONCURRENCY", min(multiprocessing.cpu_count() * 2, 8)))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+
+# Lời gọi LLM + tool có thể mất vài chục giây
+timeout = int(os.getenv("WORKER_TIMEOUT", 120))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+
+# Khởi động lại worker định kỳ để tránh phình bộ nhớ (có jitter để không restart cùng lúc)
+max_requests = int(os.getenv("MAX_REQUESTS", 2000))
+max_requests_jitter = 200
+
+accesslog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info")
+
+
+def when_ready(server):
+    # Chạy ở master sau khi preload app, trước khi fork worker
+    import main
+    main.warmup()
+    # Đưa object đã load vào generation vĩnh viễn: GC của worker không chạm tới -> ít copy-on-write
+    gc.freeze()
+    server.log.info(f"✅ Đã preload model / RAG, chuẩn bị fork {workers} worker")
+
+
+def post_fork(server, worker):
+    # Chroma client của master không dùng được trong process con (store "flat" chỉ nạp lại, mmap dùng chung)
+    from src.chatTools import RAG
+    RAG.get_instance().reopen()
+
+
+def worker_exit(server, worker):
+    # Phòng trường hợp worker thoát mà không qua lifespan shutdown
+    from src.utils import SessionStore
+    SessionStore.get_instance().close()
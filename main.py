@@ -1,4 +1,4 @@
-# from src.controller import ChatController
+# from src.controller import ChatController, SemanticMemory
 # from src.models import llm
 # from src.Prompts import system_prompt
 # from src.chatTools import safe_tools, sensitive_tools
@@ -15,21 +15,50 @@
 #     response = SaleChatbot.run(user_input)
 #     print(f"[🤖 Bot]: {response}")
 
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, Response, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 from typing import List, Optional
 import uvicorn
 import logging
+import os
+import hmac
 import pandas as pd
 
-from src.controller import ChatController
+from src.controller import ChatController, SemanticMemory, KnowledgeBase
 from src.models import llm
 from src.Prompts import system_prompt
-from src.chatTools import safe_tools, sensitive_tools
+from src.chatTools import safe_tools, sensitive_tools, report_tools, RAG, ProductRecommender
+from src.utils import metrics, start_trace, RequestProfiler, SessionStore, AsyncDatabase, ProductCatalog, InventoryManager, ReportStore, SessionClusterer, arun_plan
+from src.utils.reports import customer_summary, product_sales, daily_sales
+
+# Lịch sử chat theo session: SQLite (WAL) dùng chung giữa các worker, hoặc trong process (SESSION_STORE=memory)
+sessions = SessionStore.get_instance()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    InventoryManager.get_instance().start_sweeper()
+    # Áp dụng migration của bảng báo cáo (backfill nằm trong migration 011)
+    ReportStore.get_instance()
+    # Phân cụm chat_sessions định kỳ (SESSION_CLUSTER_INTERVAL_SECONDS > 0)
+    SessionClusterer.get_instance().start_scheduler()
+    # Nạp knowledge base từ hội thoại định kỳ (KB_MINE_INTERVAL_SECONDS > 0)
+    KnowledgeBase.get_instance().start_miner()
+    yield
+    # Graceful shutdown: ghi nốt các thao tác còn trong buffer, dừng các thread DB
+    sessions.close()
+    AsyncDatabase.get_instance().close()
+    ProductCatalog.get_instance().close()
+    InventoryManager.get_instance().close()
+    SemanticMemory.get_instance().close()
+    KnowledgeBase.get_instance().close()
+    SessionClusterer.get_instance().close()
+    metrics.close()
 
 # Khởi tạo FastAPI app
-app = FastAPI(title="Sale Chatbot API", version="1.0.0")
+app = FastAPI(title="Sale Chatbot API", version="1.0.0", lifespan=lifespan)
 
 # Cấu hình CORS để cho phép React app kết nối
 app.add_middleware(
@@ -40,9 +69,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Khởi tạo chatbot
+# Khởi tạo chatbot (ENABLE_REPORT_TOOLS=1: thêm tool báo cáo cho bot nội bộ của nhân viên)
+if os.getenv("ENABLE_REPORT_TOOLS") == "1":
+    safe_tools = safe_tools + report_tools
 SaleChatbot = ChatController(llm, safe_tools, sensitive_tools, system_prompt)
 
+# Profiling theo request: header "X-Profile: <PROFILE_TOKEN>" hoặc lấy mẫu theo PROFILE_SAMPLE_RATE,
+# request chậm hơn SLOW_REQUEST_MS được ghi vào logs/slow_requests/
+profiler = RequestProfiler.get_instance()
+
 # Pydantic models cho request/response
 class ChatMessage(BaseModel):
     message: str
@@ -52,13 +87,25 @@ class ChatResponse(BaseModel):
     response: str
     session_id: str
     success: bool = True
+    requires_confirmation: bool = False
+    pending_action: Optional[dict] = None  # {token, tool_name, tool_args, message}
+    trace_id: Optional[str] = None  # dùng để tra cứu metrics / log của request này
+
+class ConfirmRequest(BaseModel):
+    session_id: Optional[str] = "default"
+    token: str
+    approved: bool = True
 
 class HealthResponse(BaseModel):
     status: str
     message: str
 
-# Dictionary để lưu trữ session (trong production nên dùng Redis hoặc database)
-sessions = {}
+def warmup():
+    """Nạp trước RAG (chunk cache, BM25, reranker), model embedding và catalogue sản phẩm.
+    Với gunicorn preload_app, gọi trước khi fork để các worker dùng chung trang bộ nhớ"""
+    RAG.get_instance().warmup()
+    ProductCatalog.get_instance().warmup()
+    ProductRecommender.get_instance().warmup()
 
 @app.get("/", response_model=HealthResponse)
 async def root():
@@ -70,65 +117,135 @@ async def health_check():
     """Detailed health check"""
     return HealthResponse(status="healthy", message="All systems operational")
 
+def _profile_requested(request: Request):
+    return profiler.authorized(request.headers.get("X-Profile", ""))
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(chat_message: ChatMessage):
+async def chat_endpoint(chat_message: ChatMessage, request: Request, response: Response):
     """Main chat endpoint"""
     try:
         # Lấy session_id, nếu không có thì tạo mới
         session_id = chat_message.session_id or "default"
         
         # Xử lý tin nhắn bằng chatbot
-        response = SaleChatbot.run(chat_message.message)
-        
-        # Lưu lại lịch sử chat cho session này
-        if session_id not in sessions:
-            sessions[session_id] = []
+        with start_trace() as trace_id:
+            forced = _profile_requested(request)
+            with profiler.profile(force=forced,
+                                  messages_fn=lambda: SaleChatbot.get_message_trace(session_id),
+                                  endpoint="/chat", trace_id=trace_id, session_id=session_id,
+                                  user_message=chat_message.message) as profile:
+                with metrics.timer("http_request", endpoint="/chat"):
+                    bot_response = await SaleChatbot.arun(chat_message.message, session_id=session_id)
         
-        sessions[session_id].append({
-            "user_message": chat_message.message,
-            "bot_response": response,
-            "timestamp": str(pd.Timestamp.now())
-        })
-        
-        return ChatResponse(
-            response=response,
-            session_id=session_id,
-            success=True
-        )
+        # Đường dẫn dump chỉ trả cho request có token, request chậm bình thường chỉ ghi ở server
+        if forced and profile["dump_path"]:
+            response.headers["X-Profile-Dump"] = profile["dump_path"]
+        return await _build_response(session_id, chat_message.message, bot_response, trace_id)
     
     except Exception as e:
         logging.error(f"Error in chat endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+@app.post("/chat/confirm", response_model=ChatResponse)
+async def confirm_endpoint(confirm_request: ConfirmRequest):
+    """Xác nhận / từ chối tool nhạy cảm đang chờ, graph chạy tiếp từ checkpoint"""
+    session_id = confirm_request.session_id or "default"
+    try:
+        with start_trace() as trace_id, metrics.timer("http_request", endpoint="/chat/confirm"):
+            response = await SaleChatbot.aconfirm(session_id, confirm_request.token, confirm_request.approved)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error in confirm endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    
+    action = "Đồng ý" if confirm_request.approved else "Từ chối"
+    return await _build_response(session_id, f"[{action} xác nhận]", response, trace_id)
+
+async def _build_response(session_id: str, user_message: str, response: str, trace_id: str = None):
+    """Lưu lịch sử và tạo ChatResponse (kèm yêu cầu xác nhận nếu graph đang dừng)"""
+    pending_action = await SaleChatbot.aget_pending_action(session_id)
+    
+    # Lưu lại lịch sử chat cho session này
+    sessions.append(session_id, {
+        "user_message": user_message,
+        "bot_response": response,
+        "timestamp": str(pd.Timestamp.now()),
+        "trace_id": trace_id
+    })
+    
+    return ChatResponse(
+        response=response,
+        session_id=session_id,
+        success=True,
+        requires_confirmation=pending_action is not None,
+        pending_action=pending_action,
+        trace_id=trace_id
+    )
+
 @app.get("/chat/history/{session_id}")
 async def get_chat_history(session_id: str):
     """Lấy lịch sử chat của một session"""
-    if session_id not in sessions:
-        return {"history": [], "session_id": session_id}
-    
-    return {"history": sessions[session_id], "session_id": session_id}
+    return {"history": sessions.get_history(session_id), "session_id": session_id}
 
 @app.delete("/chat/history/{session_id}")
 async def clear_chat_history(session_id: str):
     """Xóa lịch sử chat của một session"""
-    if session_id in sessions:
-        del sessions[session_id]
+    sessions.clear(session_id)
     return {"message": f"History cleared for session {session_id}"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    """Metrics dạng Prometheus: latency node / tool / SQL / Chroma / embedding, token LLM, cache, lỗi"""
+    # Đọc bảng metric_series (SQLite) -> hàm sync, FastAPI chạy trong threadpool
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+# ----------- BÁO CÁO (đọc bảng tổng hợp, không aggregate lại orders trên DB đang phục vụ checkout) -----------
+# Có tên / email khách và doanh thu: chỉ bật cùng tool báo cáo (ENABLE_REPORT_TOOLS=1) và phải gửi
+# header X-Staff-Token khớp REPORT_API_TOKEN
+def require_staff(x_staff_token: Optional[str] = Header(default=None)):
+    if os.getenv("ENABLE_REPORT_TOOLS") != "1":
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = os.getenv("REPORT_API_TOKEN", "")
+    if not token or not x_staff_token or not hmac.compare_digest(x_staff_token, token):
+        raise HTTPException(status_code=401, detail="Cần X-Staff-Token hợp lệ")
+
+async def _report(plan):
+    try:
+        return await arun_plan(plan)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/reports/customers", dependencies=[Depends(require_staff)])
+async def report_customers(limit: int = 20, sort_by: str = "value"):
+    """Top khách hàng theo giá trị đơn (sort_by: value | completed | orders | recent)"""
+    return {"customers": await _report(customer_summary(min(max(limit, 1), 500), sort_by))}
+
+@app.get("/reports/products", dependencies=[Depends(require_staff)])
+async def report_products(limit: int = 20, sort_by: str = "revenue"):
+    """Sản phẩm bán chạy, chỉ tính đơn Completed / Delivered (sort_by: revenue | sold)"""
+    return {"products": await _report(product_sales(min(max(limit, 1), 500), sort_by))}
+
+@app.get("/reports/daily", dependencies=[Depends(require_staff)])
+async def report_daily(days: int = 30, date_from: Optional[str] = None, date_to: Optional[str] = None):
+    """Doanh số theo ngày (mới nhất trước), lọc theo khoảng ngày YYYY-MM-DD"""
+    return {"days": await _report(daily_sales(min(max(days, 1), 366), date_from, date_to))}
+
 @app.get("/sessions")
 async def list_sessions():
     """Liệt kê tất cả các session hiện tại"""
-    return {"sessions": list(sessions.keys())}
+    return {"sessions": sessions.list_sessions()}
 
 if __name__ == "__main__":
     # Cấu hình logging
     logging.basicConfig(level=logging.INFO)
     
-    # Chạy server
+    # Chạy server (dev: 1 process).
+    # Production nhiều worker: gunicorn -c gunicorn.conf.py main:app
     uvicorn.run(
         "main:app", 
         host="0.0.0.0", 
-        port=8000, 
-        reload=True,  # Tự động reload khi code thay đổi
+        port=int(os.getenv("PORT", 8000)), 
+        reload=os.getenv("APP_ENV", "development") != "production",  # Tự động reload khi code thay đổi (chỉ dev)
         log_level="info"
     )
\ No newline at end of file
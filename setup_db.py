@@ -24,4 +24,8 @@ cursor.executescript(schema_sql)
 conn.commit()
 conn.close()
 
+# Áp dụng các migration (bảng checkpoint của LangGraph, ...)
+from src.utils.migrations import apply_migrations
+apply_migrations(db_path)
+
 print("✅ Database mới đã được khởi tạo thành công!")
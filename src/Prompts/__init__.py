@@ -1 +1,2 @@
-from .default import system_prompt
\ No newline at end of file
+from .default import system_prompt
+from .assembler import PromptAssembler
\ No newline at end of file
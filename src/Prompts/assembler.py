@@ -0,0 +1,128 @@
+import itertools
+import re
+import threading
+from langchain_core.messages import HumanMessage, AIMessage
+from ..utils import metrics, estimate_tokens
+from .default import sections as default_sections, render_sections
+
+INTENTS = ("browsing", "checkout", "account", "policy", "support")
+
+# Từ khóa trong tin nhắn của khách (có dấu / không dấu)
+_KEYWORDS = {
+    "checkout": r"đặt hàng|đặt mua|mua ngay|chốt đơn|thanh toán|giỏ hàng|đơn hàng|giao hàng|giao (về|tới|đến)|"
+                r"lấy cho (tôi|mình|em)|lấy \d+|\d+ (cái|chiếc|bộ)|tiền mặt|chuyển khoản|\bcod\b|khách hàng số|"
+                r"dat hang|chot don|thanh toan|gio hang|don hang|giao hang|giao ve|tien mat|chuyen khoan",
+    "account": r"tài khoản|đăng ký|email|số điện thoại|sđt|địa chỉ của (tôi|mình)|thông tin (của )?(tôi|mình)|"
+               r"cập nhật thông tin|tai khoan|dang ky|so dien thoai|"
+               # Tra cứu đơn đã đặt: lịch sử mua, trạng thái / vị trí đơn (get_customer_orders)
+               r"lịch sử (mua|đặt|đơn|giao dịch)|theo dõi đơn|tình trạng đơn|trạng thái đơn|đơn gần đây|"
+               r"đơn [^.?!]{0,40}(ở đâu|đến đâu|tới đâu|giao chưa|chưa giao|chưa tới|chưa đến)|"
+               r"lich su mua|theo doi don|tinh trang don|trang thai don|don [^.?!]{0,40}(o dau|den dau|toi dau)",
+    "policy": r"chính sách|bảo hành|đổi trả|hoàn tiền|vận chuyển|giờ mở cửa|hotline|liên hệ|techworld|"
+              r"cửa hàng (ở|nằm|có chi nhánh)|chinh sach|bao hanh|doi tra|hoan tien|van chuyen",
+    "support": r"phàn nàn|khiếu nại|không hài lòng|thất vọng|bị lỗi|bị hỏng|hỏng rồi|quá chậm|"
+               r"khieu nai|phan nan|khong hai long",
+    "browsing": r"sản phẩm|điện thoại|laptop|máy tính|tai nghe|chuột|bàn phím|màn hình|phụ kiện|giá|"
+                r"khuyến mãi|giảm giá|so sánh|gợi ý|tư vấn|danh mục|còn hàng|tìm|mua|"
+                r"san pham|dien thoai|may tinh|khuyen mai|giam gia|so sanh|goi y|tu van",
+}
+
+# Tool được gọi gần đây -> luồng hiện tại (vd: đang đặt đơn thì câu "ok, giao tới 12 Lê Lợi" vẫn là checkout)
+TOOL_INTENTS = {
+    "add_order": "checkout",
+    "view_cart": "checkout",
+    "register_customer": "account",
+    "get_customer_info": "account",
+    "get_customer_orders": "account",
+    "update_customer_info": "account",
+    "rag_tool": "policy",
+}
+
+
+class PromptAssembler:
+    """Ghép system prompt chỉ gồm các phần liên quan tới intent của lượt hiện tại (src/Prompts/default.py).
+
+    - Intent lấy từ từ khóa trong 2 tin nhắn gần nhất của khách và câu trả lời gần nhất của bot
+      (vd: bot hỏi "Bạn có muốn đặt hàng luôn không?" -> "Có" là checkout) + tool được gọi trong vài message
+      gần nhất (tool không có trong TOOL_INTENTS = browsing)
+    - Checkout giữ nguyên trong sticky_window message kể từ khi bắt đầu (khách / bot nhắc đặt hàng, tool đặt đơn)
+    - Không nhận ra intent nào (chào hỏi, câu mơ hồ) -> dùng prompt đầy đủ
+    - Prompt đã ghép được cache theo tập intent (tối đa 2^5 tổ hợp)
+    - Metrics: prompt_tokens_total / prompt_assembled_total theo intent, prompt_tokens_saved_total
+    """
+
+    def __init__(self, sections=None, window: int = 6, sticky_window: int = 12):
+        self.sections = sections or default_sections
+        self.window = window
+        self.sticky_window = sticky_window
+        self.full_prompt = render_sections(self.sections)
+        self.full_tokens = estimate_tokens(self.full_prompt)
+        self._patterns = {intent: re.compile(pattern, re.IGNORECASE) for intent, pattern in _KEYWORDS.items()}
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def detect_intents(self, messages) -> frozenset:
+        recent = messages[-self.window:]
+        intents = set()
+        for message in recent:
+            for tool_call in getattr(message, "tool_calls", None) or []:
+                intents.add(TOOL_INTENTS.get(tool_call["name"], "browsing"))
+
+        human = [m for m in messages if isinstance(m, HumanMessage)][-2:]
+        last_ai = next((m for m in reversed(messages) if isinstance(m, AIMessage) and m.content), None)
+        text = " ".join(str(m.content) for m in human + ([last_ai] if last_ai is not None else []))
+        intents.update(intent for intent, pattern in self._patterns.items() if pattern.search(text))
+        if "checkout" not in intents and self._in_checkout(messages[-self.sticky_window:]):
+            intents.add("checkout")
+        return frozenset(intents)
+
+    def _in_checkout(self, messages) -> bool:
+        """Đang trong luồng đặt hàng: tin nhắn (khách / bot) hoặc tool đặt đơn gần đây"""
+        for message in messages:
+            if any(TOOL_INTENTS.get(tc["name"]) == "checkout" for tc in getattr(message, "tool_calls", None) or []):
+                return True
+            if isinstance(message, (HumanMessage, AIMessage)) and self._patterns["checkout"].search(str(message.content)):
+                return True
+        return False
+
+    def assemble(self, intents) -> str:
+        """Prompt cho 1 tập intent (rỗng = prompt đầy đủ)"""
+        intents = frozenset(intents)
+        prompt = self._cache.get(intents)
+        if prompt is None:
+            if intents:
+                prompt = render_sections([s for s in self.sections if not s.intents or intents & set(s.intents)])
+            else:
+                prompt = self.full_prompt
+            with self._lock:
+                self._cache[intents] = prompt
+        return prompt
+
+    def build(self, messages, intents=None):
+        """(prompt, intents) cho lượt hiện tại, ghi số token của prompt vào metrics"""
+        if intents is None:
+            intents = self.detect_intents(messages)
+        prompt = self.assemble(intents)
+        label = "+".join(sorted(intents)) or "full"
+        tokens = estimate_tokens(prompt)
+        metrics.inc("prompt_assembled_total", intents=label, help="Số lần ghép system prompt theo intent")
+        metrics.inc("prompt_tokens_total", tokens, intents=label, help="Tổng token (ước lượng) của system prompt đã ghép")
+        metrics.inc("prompt_tokens_saved_total", self.full_tokens - tokens,
+                    help="Số token system prompt tiết kiệm được so với prompt đầy đủ")
+        return prompt, intents
+
+    def report(self):
+        """Số token của prompt cho từng intent và từng cặp intent"""
+        rows = [{"intents": "full", "tokens": self.full_tokens}]
+        for size in (1, 2):
+            for combo in itertools.combinations(INTENTS, size):
+                rows.append({"intents": "+".join(combo), "tokens": estimate_tokens(self.assemble(combo))})
+        return rows
+
+
+if __name__ == "__main__":
+    # python -m src.Prompts.assembler
+    assembler = PromptAssembler()
+    for row in assembler.report():
+        saved = 1 - row["tokens"] / assembler.full_tokens
+        print(f"{row['intents']:<22} {row['tokens']:>6} tokens  (-{saved:.0%})")
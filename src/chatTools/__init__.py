@@ -1,2 +1,4 @@
-from .tools import safe_tools, sensitive_tools
-from .ragAgentic import RAG
\ No newline at end of file
+from .tools import safe_tools, sensitive_tools, report_tools
+from .ragAgentic import RAG
+from .recommender import ProductRecommender
+from .embedding_batcher import EmbeddingBatcher
@@ -0,0 +1,76 @@
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def fold_accents(text: str) -> str:
+    """Bỏ dấu tiếng Việt: 'bảo hành' -> 'bao hanh' (khách hay gõ không dấu)"""
+    text = unicodedata.normalize("NFD", text)
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    return text.replace("đ", "d").replace("Đ", "D")
+
+
+def tokenize(text: str):
+    """Tách token cho BM25: chữ thường, bỏ dấu, unigram + bigram.
+    Từ tiếng Việt thường gồm 2 âm tiết ('bảo hành', 'địa chỉ') nên bigram giúp khớp chính xác hơn."""
+    words = _WORD_RE.findall(fold_accents(text.lower()))
+    bigrams = [f"{a}_{b}" for a, b in zip(words, words[1:])]
+    return words + bigrams
+
+
+class BM25Index:
+    """Inverted index BM25 in-memory cho các chunk của RAG"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+
+        self.doc_ids = []
+        self.doc_lens = []
+        self.avg_len = 0.0
+        self.postings = defaultdict(list)  # term -> [(doc_idx, tf)]
+        self.idf = {}
+
+    def build(self, doc_ids, texts):
+        """Xây lại index từ danh sách (id, text)"""
+        self.doc_ids = list(doc_ids)
+        self.doc_lens = []
+        self.postings = defaultdict(list)
+
+        for doc_idx, text in enumerate(texts):
+            tokens = tokenize(text)
+            self.doc_lens.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                self.postings[term].append((doc_idx, tf))
+
+        n_docs = len(self.doc_ids)
+        self.avg_len = sum(self.doc_lens) / n_docs if n_docs else 0.0
+        self.idf = {
+            term: math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+            for term, posting in self.postings.items()
+        }
+        return self
+
+    def search(self, query: str, top_k: int = 10):
+        """Trả về [(doc_id, score)] sắp xếp giảm dần theo điểm BM25"""
+        if not self.doc_ids:
+            return []
+
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = self.idf[term]
+            for doc_idx, tf in posting:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lens[doc_idx] / self.avg_len)
+                scores[doc_idx] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:top_k]
+        return [(self.doc_ids[doc_idx], score) for doc_idx, score in ranked]
+
+    def __len__(self):
+        return len(self.doc_ids)
@@ -0,0 +1,165 @@
+import re
+from ..utils import estimate_tokens
+
+# "1. LỊCH SỬ HÌNH THÀNH VÀ PHÁT TRIỂN", "14. TRUYỀN THÔNG & MARKETING"
+_NUMBERED_RE = re.compile(r"^(\d{1,2})\.\s+(\S.*)$")
+_BULLET_PREFIXES = ("•", "-", "*", "+", "–")
+
+
+def _is_upper(text: str) -> bool:
+    letters = [ch for ch in text if ch.isalpha()]
+    return len(letters) >= 3 and all(ch.isupper() for ch in letters)
+
+
+class SectionChunker:
+    """Chia tài liệu dạng rag.txt theo cấu trúc heading thay vì cắt cứng theo ký tự.
+
+    - Level 0: dòng IN HOA không đánh số (tiêu đề tài liệu)
+    - Level 1: "<số>. <TIÊU ĐỀ IN HOA>"
+    - Level 2: dòng ngắn không có dấu câu cuối dòng (vd: "Khởi nguồn (2015-2017)", "Chi nhánh")
+    Mỗi section level 1 vừa max_tokens được giữ nguyên 1 chunk; section dài được chia theo
+    sub-heading rồi theo dòng. Metadata: section_path, section_id, char offsets, token_count.
+    max_tokens tính cả section_path được ghép vào đầu chunk khi embed (MiniLM cắt ở 256 token),
+    nên mỗi section chỉ dùng max_tokens trừ đi số token của path dài nhất trong section.
+    """
+
+    def __init__(self, max_tokens: int = 200, token_counter=None, max_subheading_len: int = 60):
+        self.max_tokens = max_tokens
+        self.count_tokens = token_counter or estimate_tokens
+        self.max_subheading_len = max_subheading_len
+
+    # ----------- HEADING DETECTION -----------
+    def heading_level(self, line: str):
+        text = line.strip()
+        if not text or text.startswith(_BULLET_PREFIXES):
+            return None
+
+        numbered = _NUMBERED_RE.match(text)
+        if numbered:
+            return 1 if _is_upper(numbered.group(2)) else None
+        if _is_upper(text) and len(text) <= 80:
+            return 0
+        if (len(text) <= self.max_subheading_len and "\t" not in text
+                and not text.endswith((".", ":", ",", ";", "?", "!", "\"")) and ":" not in text):
+            return 2
+        return None
+
+    # ----------- SPLIT -----------
+    def _lines(self, text: str):
+        """Danh sách (start, end, line) theo offset ký tự trong text gốc"""
+        lines, pos = [], 0
+        for line in text.splitlines(keepends=True):
+            lines.append((pos, pos + len(line.rstrip("\r\n")), line.rstrip("\r\n")))
+            pos += len(line)
+        return lines
+
+    def _sections(self, text: str):
+        """Gom các dòng thành section level 1, ghi lại sub-heading (level 2) trong section"""
+        sections = []
+        title = None
+        current = {"heading": None, "lines": []}
+
+        for start, end, line in self._lines(text):
+            level = self.heading_level(line)
+            if level == 0 and not current["lines"] and current["heading"] is None:
+                title = line.strip()
+                continue
+            if level == 1:
+                if current["lines"]:
+                    sections.append(current)
+                current = {"heading": line.strip(), "lines": []}
+            if line.strip():
+                current["lines"].append((start, end, line, level == 2 and bool(current["lines"])))
+        if current["lines"]:
+            sections.append(current)
+        return title, sections
+
+    def _pack(self, units, budget):
+        """Ghép các unit (list dòng) liên tiếp thành chunk không vượt budget"""
+        chunks, current = [], []
+        for unit in units:
+            candidate = current + unit
+            if current and self._tokens(candidate) > budget:
+                chunks.append(current)
+                current = list(unit)
+            else:
+                current = candidate
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def _tokens(self, lines):
+        return self.count_tokens("\n".join(line for _, _, line, _ in lines))
+
+    def _split_long_line(self, start, line, budget):
+        """Dòng đơn quá dài -> cắt theo từ"""
+        pieces, piece_start, words = [], start, []
+        offset = start
+        for word in re.finditer(r"\S+", line):
+            words.append(word.group())
+            if len(words) > 1 and self.count_tokens(" ".join(words)) > budget:
+                end = offset
+                pieces.append((piece_start, end, line[piece_start - start:end - start], False))
+                piece_start, words = start + word.start(), [word.group()]
+            offset = start + word.end()
+        pieces.append((piece_start, offset, line[piece_start - start:offset - start], False))
+        return pieces
+
+    def split(self, text: str):
+        """Trả về list dict: {"text", "section_path", "section_id", "section_title",
+        "char_start", "char_end", "token_count"}"""
+        title, sections = self._sections(text)
+        chunks = []
+
+        for section_idx, section in enumerate(sections):
+            lines = section["lines"]
+            heading = section["heading"]
+            base_path = [p for p in (title, heading) if p]
+
+            # Chừa chỗ cho section_path (path dài nhất của section: kèm sub-heading dài nhất)
+            paths = [base_path] + [base_path + [line.strip()] for _, _, line, is_sub in lines
+                                   if is_sub and line.strip() != heading]
+            reserved = max(self.count_tokens(" > ".join(path) + "\n") for path in paths) if base_path else 0
+            budget = max(self.max_tokens - reserved, self.max_tokens // 2)
+
+            # Chia section theo sub-heading, dòng quá dài thì cắt nhỏ
+            subsections = []
+            active_subheading, subheading_at = None, {}
+            for start, end, line, is_subheading in lines:
+                if is_subheading:
+                    active_subheading = line.strip()
+                line_units = [(start, end, line, is_subheading)]
+                if self.count_tokens(line) > budget:
+                    line_units = self._split_long_line(start, line, budget)
+                for unit in line_units:
+                    subheading_at[unit[0]] = active_subheading
+                if is_subheading or not subsections:
+                    subsections.append([])
+                subsections[-1].extend(line_units)
+
+            groups = [lines] if self._tokens(lines) <= budget else []
+            if not groups:
+                for subsection in subsections:
+                    if self._tokens(subsection) <= budget:
+                        groups.append(subsection)
+                    else:
+                        groups.extend(self._pack([[unit] for unit in subsection], budget))
+                groups = self._pack(groups, budget)
+
+            for group in groups:
+                subheading = subheading_at.get(group[0][0])
+                path = list(base_path)
+                if subheading and subheading != heading:
+                    path.append(subheading)
+                char_start, char_end = group[0][0], group[-1][1]
+                chunk_text = text[char_start:char_end]
+                chunks.append({
+                    "text": chunk_text,
+                    "section_path": " > ".join(path),
+                    "section_id": f"s{section_idx}",
+                    "section_title": heading or title or "",
+                    "char_start": char_start,
+                    "char_end": char_end,
+                    "token_count": self.count_tokens(chunk_text),
+                })
+        return chunks
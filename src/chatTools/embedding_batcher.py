@@ -0,0 +1,118 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+from ..models import model_emb
+from ..utils import metrics, get_trace_id, trace_thread
+
+_SIZE_LABELS = ((1, "1"), (4, "2-4"), (8, "5-8"), (16, "9-16"), (32, "17-32"))
+
+
+def _size_label(n: int):
+    return next((label for bound, label in _SIZE_LABELS if n <= bound), "33+")
+
+
+class EmbeddingBatcher:
+    """Gom các lệnh encode 1 câu (query RAG, câu hỏi tra bộ nhớ...) từ mọi request đang chạy thành 1 batch.
+
+    - Thread nền lấy lệnh đầu tiên trong hàng đợi, chờ thêm tối đa max_wait_ms (hoặc tới max_batch câu)
+      rồi chạy 1 lần model_emb.encode(list) và trả kết quả về Future của từng caller
+    - Lệnh encode nhiều câu (nạp dữ liệu) đã là batch nên chạy thẳng
+    - EMBED_BATCHING=0: tắt, encode trực tiếp như trước
+    - Metrics: embed_batches_total theo kích thước batch, embed_batch_items_total, embed_queue_wait_seconds
+    - Sau khi fork (gunicorn preload) hàng đợi và thread nền được tạo lại trong worker
+    """
+    _instance = None
+
+    def __init__(self, encoder=None, max_batch: int = None, max_wait_ms: float = None, enabled: bool = None):
+        self.encoder = encoder or model_emb
+        self.max_batch = max_batch or int(os.getenv("EMBED_BATCH_MAX", 32))
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else float(os.getenv("EMBED_BATCH_WAIT_MS", 3))) / 1000
+        self.enabled = os.getenv("EMBED_BATCHING", "1") != "0" if enabled is None else enabled
+        # Giữ nguyên các thuộc tính của model gốc mà code khác dùng (vd: tokenizer)
+        self.tokenizer = getattr(self.encoder, "tokenizer", None)
+        self._init_process_state()
+
+    def _init_process_state(self):
+        self._pid = os.getpid()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._init_process_state()
+
+    def _ensure_worker(self):
+        self._check_pid()
+        if self._worker is not None:
+            return
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+                self._worker.start()
+
+    # ----------- CALLER -----------
+    def submit(self, text: str) -> Future:
+        """Đưa 1 câu vào hàng đợi, Future trả về vector của câu đó"""
+        future = Future()
+        if not self.enabled:
+            future.set_result(np.asarray(self.encoder.encode([text]))[0])
+            return future
+        self._ensure_worker()
+        self._queue.put((text, future, time.perf_counter(), get_trace_id()))
+        return future
+
+    def encode(self, sentences, **kwargs):
+        """Cùng cách gọi với model_emb.encode: 1 câu -> vector, list -> ma trận"""
+        if isinstance(sentences, str):
+            return self.submit(sentences).result()
+        if len(sentences) == 1 and not kwargs:
+            return self.submit(sentences[0]).result()[None, :]
+        return self.encoder.encode(sentences, **kwargs)
+
+    async def aencode(self, text: str):
+        """Bản async: chờ Future mà không chặn event loop"""
+        return await asyncio.wrap_future(self.submit(text))
+
+    # ----------- WORKER -----------
+    def _collect(self):
+        """Lấy 1 batch: chờ lệnh đầu tiên, gom thêm tới max_batch hoặc hết max_wait"""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            now = time.perf_counter()
+            for _, _, queued_at, _ in batch:
+                metrics.observe("embed_queue_wait_seconds", now - queued_at, help="Thời gian chờ trong hàng đợi embed")
+            metrics.inc("embed_batches_total", size=_size_label(len(batch)), help="Số batch embed theo kích thước")
+            metrics.inc("embed_batch_items_total", len(batch), help="Số câu đã embed qua batcher")
+            try:
+                # Batch dùng chung: thread được tính cho mọi request (đang profile) có câu trong batch
+                with trace_thread([trace_id for *_, trace_id in batch]), \
+                        metrics.timer("embed", help="Thời gian encode embedding", kind="batcher"):
+                    vectors = np.asarray(self.encoder.encode([text for text, *_ in batch]))
+            except Exception as e:
+                for _, future, *_ in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future, *_), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
@@ -1,9 +1,12 @@
 import os
-import chromadb
-from chromadb.config import Settings
 from langchain.text_splitter import RecursiveCharacterTextSplitter, CharacterTextSplitter
-import shutil
+import threading
 from ..models import model_emb 
+from ..utils import metrics
+from .bm25 import BM25Index
+from .chunker import SectionChunker
+from .vector_store import create_vector_store
+from .embedding_batcher import EmbeddingBatcher
 
 class RAG:
     _instance = None
@@ -12,11 +15,19 @@ class RAG:
                  base_db_folder: str = "database/rag",
                  db_name: str = "rag_db",
                  chroma_path: str = None,  # Mặc định sẽ tự động tạo
+                 vector_store = None,      # "chroma" | "flat" hoặc instance, mặc định lấy từ env RAG_VECTOR_STORE
                  
                  separator="\n",    
                  chunk_size=500,  
                  chunk_overlap=50, 
-                 length_function=len
+                 length_function=len,
+                 
+                 chunk_strategy=None,      # "section": chia theo heading, "recursive": cắt theo ký tự như cũ,
+                                           # mặc định lấy từ env RAG_CHUNK_STRATEGY (= "recursive", khớp index đang commit)
+                 chunk_tokens=200,         # token tối đa khi embed (chunk + section_path) khi chia theo section
+                 
+                 rrf_k=60,          # hằng số của Reciprocal Rank Fusion
+                 reranker_name=None # vd: "cross-encoder/ms-marco-MiniLM-L-6-v2", mặc định lấy từ env RAG_RERANKER
                  ):
         
         self.separator = separator
@@ -27,23 +38,26 @@ class RAG:
         self.base_db_folder = base_db_folder
         self.db_name = db_name
         
-        # Tự động tạo đường dẫn nếu không được cung cấp
-        if chroma_path is None:
-            self.chroma_path = os.path.join(os.getcwd(), "database", "chroma_db")
-        else:
-            self.chroma_path = chroma_path
-            
+        
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
-
-        # Tạo thư mục nếu chưa tồn tại
-        os.makedirs(self.chroma_path, exist_ok=True)
         
-        # init chroma client
-        self.client = chromadb.PersistentClient(path=self.chroma_path)
-        self.collection = self.client.get_or_create_collection(name=self.db_name)
+        self.chunk_strategy = chunk_strategy or os.getenv("RAG_CHUNK_STRATEGY", "recursive")
+        self.chunker = SectionChunker(max_tokens=chunk_tokens, token_counter=self._token_counter())
+
+        # Vector store: Chroma, hoặc "flat" (ma trận NumPy memory-mapped, top-k chính xác / IVF)
+        if vector_store is None or isinstance(vector_store, str):
+            vector_store = create_vector_store(vector_store, path=chroma_path, name=self.db_name)
+        self.store = vector_store
+        self.chroma_path = self.store.path
         
-        print(f"💾 ChromaDB được lưu tại: {os.path.abspath(self.chroma_path)}")
+        # Hybrid search: cache toàn bộ chunk + BM25 index (build lại khi dữ liệu thay đổi)
+        self.rrf_k = rrf_k
+        self.reranker_name = reranker_name or os.getenv("RAG_RERANKER")
+        self._reranker = None
+        self._chunk_cache = None
+        self._bm25 = None
+        self._cache_lock = threading.Lock()
 
     def load_file(self, file_path: str) -> str:
         """Đọc toàn bộ file txt"""
@@ -67,34 +81,74 @@ class RAG:
         
         chunks = text_splitter.split_text(text)
         return chunks
+    
+    def _encode(self, texts):
+        """Encode qua model embedding (có đo latency). Query 1 câu đi qua EmbeddingBatcher
+        để gom với query của các request khác đang chạy"""
+        if isinstance(texts, str):
+            return EmbeddingBatcher.get_instance().encode(texts)
+        with metrics.timer("embed", help="Thời gian encode embedding", kind="batch"):
+            return model_emb.encode(texts)
+    
+    def _query(self, **kwargs):
+        """Query vector store (có đo latency)"""
+        with metrics.timer("vector_query", help="Thời gian query vector store", op="query", backend=self.store.backend):
+            return self.store.query(**kwargs)
+    
+    def _token_counter(self):
+        """Đếm token bằng tokenizer của model embedding (nếu có), không thì ước lượng"""
+        tokenizer = getattr(model_emb, "tokenizer", None)
+        if tokenizer is None:
+            return None
+        return lambda text: len(tokenizer.tokenize(text))
+    
+    def split_document(self, text: str):
+        """Chia tài liệu thành list (chunk, metadata bổ sung) theo chunk_strategy"""
+        if self.chunk_strategy == "recursive":
+            return [(chunk, {}) for chunk in self.split_chunk(text)]
+        
+        chunks = []
+        for chunk in self.chunker.split(text):
+            meta = {k: v for k, v in chunk.items() if k != "text"}
+            chunks.append((chunk["text"], meta))
+        return chunks
+    
+    def _add_chunks(self, chunks, file_path: str, file_name: str, rel_path: str, file_prefix: str):
+        """Encode theo batch và add toàn bộ chunk của 1 file vào vector store"""
+        if not chunks:
+            return
+        # Ghép section_path vào nội dung khi embed để chunk con vẫn mang ngữ cảnh của section
+        texts = [f"{meta['section_path']}\n{chunk}" if meta.get("section_path") else chunk for chunk, meta in chunks]
+        embs = self._encode(texts)
+        self.store.add(
+            documents=[chunk for chunk, _ in chunks],
+            embeddings=embs,
+            ids=[f"{file_prefix}_{i}" for i in range(len(chunks))],
+            metadatas=[{
+                'file_path': file_path,
+                'file_name': file_name,
+                'chunk_index': i,
+                'relative_path': rel_path,
+                **meta
+            } for i, (_, meta) in enumerate(chunks)]
+        )
 
     def add_to_db(self, file_path: str):
-        """Đọc file, split chunk và add vào ChromaDB"""
+        """Đọc file, split chunk và add vào vector store"""
         text = self.load_file(file_path)
-        chunks = self.split_chunk(text)
+        chunks = self.split_document(text)
 
         file_name = os.path.basename(file_path)
         rel_path = os.path.relpath(file_path, os.path.dirname(file_path))
         file_prefix = file_name.replace('.', '_')
 
-        for i, chunk in enumerate(chunks):
-            emb = model_emb.encode(chunk).tolist()
-            self.collection.add(
-                documents=[chunk],
-                embeddings=[emb],
-                ids=[f"{file_prefix}_{i}"],
-                metadatas=[{
-                    'file_path': file_path,
-                    'file_name': file_name,
-                    'chunk_index': i,
-                    'relative_path': rel_path
-                }]
-            )
-        print(f"✅ Đã thêm {len(chunks)} chunks từ {file_path} vào ChromaDB")
+        self._add_chunks(chunks, file_path, file_name, rel_path, file_prefix)
+        self._invalidate_cache()
+        print(f"✅ Đã thêm {len(chunks)} chunks từ {file_path} vào vector store")
 
 
     def add_folder_to_db(self, folder_path: str, file_extensions: list = ['.txt', '.md', '.py', '.json']):
-        """Đọc tất cả files trong folder và add vào ChromaDB"""
+        """Đọc tất cả files trong folder và add vào vector store"""
         if not os.path.exists(folder_path):
             print(f"❌ Folder không tồn tại: {folder_path}")
             return
@@ -102,46 +156,36 @@ class RAG:
         total_files = 0
         total_chunks = 0
         
-        # Duyệt qua tất cả files trong folder (bao gồm cả subfolder)
-        for root, dirs, files in os.walk(folder_path):
-            for file in files:
-                # Kiểm tra extension của file
-                file_ext = os.path.splitext(file)[1].lower()
-                if file_ext in file_extensions:
-                    file_path = os.path.join(root, file)
-                    
-                    try:
-                        # Đọc và xử lý file
-                        text = self.load_file(file_path)
-                        chunks = self.split_chunk(text)
-                        
-                        # Tạo relative path để làm prefix cho ID
-                        rel_path = os.path.relpath(file_path, folder_path)
-                        file_prefix = rel_path.replace(os.sep, '_').replace('.', '_')
-                        
-                        # Add chunks vào database
-                        for i, chunk in enumerate(chunks):
-                            emb = model_emb.encode(chunk).tolist()
-                            self.collection.add(
-                                documents=[chunk],
-                                embeddings=[emb],
-                                ids=[f"{file_prefix}_{i}"],
-                                metadatas=[{
-                                    'file_path': file_path,
-                                    'file_name': file,
-                                    'chunk_index': i,
-                                    'relative_path': rel_path
-                                }]
-                            )
-                        
-                        total_files += 1
-                        total_chunks += len(chunks)
-                        print(f"✅ Đã xử lý: {rel_path} - {len(chunks)} chunks")
-                        
-                    except Exception as e:
-                        print(f"❌ Lỗi khi xử lý file {file_path}: {str(e)}")
-                        continue
+        # Duyệt qua tất cả files trong folder (bao gồm cả subfolder), ghi vector store 1 lần khi xong
+        with self.store.batch():
+            for root, dirs, files in os.walk(folder_path):
+                for file in files:
+                    # Kiểm tra extension của file
+                    file_ext = os.path.splitext(file)[1].lower()
+                    if file_ext in file_extensions:
+                        file_path = os.path.join(root, file)
+
+                        try:
+                            # Đọc và xử lý file
+                            text = self.load_file(file_path)
+                            chunks = self.split_document(text)
+
+                            # Tạo relative path để làm prefix cho ID
+                            rel_path = os.path.relpath(file_path, folder_path)
+                            file_prefix = rel_path.replace(os.sep, '_').replace('.', '_')
+
+                            # Add chunks vào database
+                            self._add_chunks(chunks, file_path, file, rel_path, file_prefix)
+
+                            total_files += 1
+                            total_chunks += len(chunks)
+                            print(f"✅ Đã xử lý: {rel_path} - {len(chunks)} chunks")
+
+                        except Exception as e:
+                            print(f"❌ Lỗi khi xử lý file {file_path}: {str(e)}")
+                            continue
         
+        self._invalidate_cache()
         print(f"🎉 Hoàn thành! Đã xử lý {total_files} files với tổng {total_chunks} chunks")
 
     def add_data(self, path: str, file_extensions: list = ['.txt', '.md', '.py', '.json']):
@@ -157,8 +201,8 @@ class RAG:
 
     def search(self, query: str, top_k: int = 3):
         """Tìm kiếm theo query"""
-        q_emb = model_emb.encode(query).tolist()
-        results = self.collection.query(
+        q_emb = self._encode(query).tolist()
+        results = self._query(
             query_embeddings=[q_emb],
             n_results=top_k,
             include=["embeddings", "documents", "metadatas", "distances"] # Mặc định sẽ ko lấy ra emb luôn, phải set thì mới lấy ra.
@@ -169,8 +213,8 @@ class RAG:
     def search_with_neighbors(self, query: str, top_k: int = 3, return_docs_only: bool = True):
         """Tìm kiếm query, lấy thêm chunk trước & sau mỗi kết quả.
         Nếu return_docs_only=True thì trả ra list document thôi."""
-        q_emb = model_emb.encode(query).tolist()
-        results = self.collection.query(
+        q_emb = self._encode(query).tolist()
+        results = self._query(
             query_embeddings=[q_emb],
             n_results=top_k,
             include=["documents", "metadatas", "distances"]
@@ -185,10 +229,11 @@ class RAG:
             chunk_id = meta.get("chunk_id", f"{rel_path}_{chunk_index}")
 
             # lấy toàn bộ chunks trong file này
-            file_chunks = self.collection.get(
-                where={"relative_path": rel_path},
-                include=["documents", "metadatas"]
-            )
+            with metrics.timer("vector_query", op="get", backend=self.store.backend):
+                file_chunks = self.store.get(
+                    where={"relative_path": rel_path},
+                    include=["documents", "metadatas"]
+                )
 
             # map index -> content
             chunks_map = {
@@ -226,8 +271,8 @@ class RAG:
 
     def search_with_metadata(self, query: str, top_k: int = 3):
         """Tìm kiếm kèm metadata để biết chunk từ file nào"""
-        q_emb = model_emb.encode(query).tolist()
-        results = self.collection.query(
+        q_emb = self._encode(query).tolist()
+        results = self._query(
             query_embeddings=[q_emb],
             n_results=top_k
         )
@@ -239,13 +284,142 @@ class RAG:
             "distances": results["distances"][0]
         }
         
+    # ----------- HYBRID SEARCH (BM25 + VECTOR) -----------
+    def _invalidate_cache(self):
+        with self._cache_lock:
+            self._chunk_cache = None
+            self._bm25 = None
+
+    def _get_chunk_cache(self):
+        """Cache id -> (document, metadata) của toàn bộ chunk và BM25 index tương ứng"""
+        with self._cache_lock:
+            metrics.inc("cache_total", cache="rag_chunks", result="hit" if self._chunk_cache is not None else "miss")
+            if self._chunk_cache is None:
+                data = self.store.get(include=["documents", "metadatas"])
+                self._chunk_cache = {
+                    chunk_id: (doc, meta)
+                    for chunk_id, doc, meta in zip(data["ids"], data["documents"], data["metadatas"])
+                }
+                self._bm25 = BM25Index().build(
+                    self._chunk_cache.keys(),
+                    [f"{meta.get('section_path', '')}\n{doc}" for doc, meta in self._chunk_cache.values()]
+                )
+            return self._chunk_cache, self._bm25
+
+    def _vector_ranking(self, query: str, n_results: int):
+        q_emb = self._encode(query).tolist()
+        results = self._query(
+            query_embeddings=[q_emb],
+            n_results=n_results,
+            include=["distances"]
+        )
+        return results["ids"][0]
+
+    def _get_reranker(self):
+        """Load CrossEncoder (CPU) khi cần, lỗi thì tắt rerank"""
+        if self._reranker is None and self.reranker_name:
+            try:
+                from sentence_transformers import CrossEncoder
+                self._reranker = CrossEncoder(self.reranker_name, device="cpu")
+                print(f"✅ Đã load reranker: {self.reranker_name}")
+            except Exception as e:
+                print(f"❌ Không load được reranker {self.reranker_name}: {e}")
+                self.reranker_name = None
+        return self._reranker
+
+    def _neighbor_ids(self, chunks, chunk_ids):
+        """Lấy thêm chunk trước & sau (cùng file) của mỗi kết quả, không trùng lặp.
+        Chunk chia theo section đã đủ ngữ cảnh nên giữ nguyên."""
+        position = {(m["relative_path"], m["chunk_index"]): cid for cid, (_, m) in chunks.items()}
+        expanded = []
+        for chunk_id in chunk_ids:
+            meta = chunks[chunk_id][1]
+            indexes = [meta["chunk_index"]] if "section_id" in meta else [meta["chunk_index"] - 1, meta["chunk_index"], meta["chunk_index"] + 1]
+            for i in indexes:
+                neighbor_id = position.get((meta["relative_path"], i))
+                if neighbor_id is not None and neighbor_id not in expanded:
+                    expanded.append(neighbor_id)
+        return expanded
+
+    def _section_ids(self, chunks, chunk_ids):
+        """Thay mỗi kết quả bằng toàn bộ chunk thuộc cùng section (theo thứ tự trong file)"""
+        expanded = []
+        for chunk_id in chunk_ids:
+            meta = chunks[chunk_id][1]
+            if "section_id" not in meta:
+                if chunk_id not in expanded:
+                    expanded.append(chunk_id)
+                continue
+            same_section = sorted(
+                (m["chunk_index"], cid) for cid, (_, m) in chunks.items()
+                if m["relative_path"] == meta["relative_path"] and m.get("section_id") == meta["section_id"]
+            )
+            expanded.extend(cid for _, cid in same_section if cid not in expanded)
+        return expanded
+
+    def get_section(self, section: str, file_name: str = None):
+        """Lấy nguyên văn toàn bộ 1 section theo section_id ("s6") hoặc tiêu đề ("7. THÔNG TIN LIÊN HỆ VÀ VỊ TRÍ")"""
+        chunks, _ = self._get_chunk_cache()
+        matched = sorted(
+            (m["relative_path"], m["chunk_index"], doc) for doc, m in chunks.values()
+            if section in (m.get("section_id"), m.get("section_title"))
+            and (file_name is None or m["file_name"] == file_name)
+        )
+        return "\n".join(doc for _, _, doc in matched)
+
+    def search_hybrid(self, query: str, top_k: int = 3, candidate_k: int = 20, rerank: bool = None,
+                      with_neighbors: bool = False, whole_section: bool = False, return_docs_only: bool = True):
+        """Tìm kiếm kết hợp BM25 (khớp từ khóa: số hotline, địa chỉ, 'bảo hành 24 tháng'...)
+        và vector (ngữ nghĩa), gộp thứ hạng bằng Reciprocal Rank Fusion.
+        Nếu có reranker (cross-encoder) thì sắp xếp lại top candidate trước khi lấy top_k."""
+        chunks, bm25 = self._get_chunk_cache()
+        if not chunks:
+            return [] if return_docs_only else {"documents": [], "metadatas": [], "ids": [], "scores": []}
+
+        candidate_k = min(max(candidate_k, top_k), len(chunks))
+        vector_ids = self._vector_ranking(query, candidate_k)
+        with metrics.timer("bm25_search"):
+            bm25_ids = [chunk_id for chunk_id, _ in bm25.search(query, candidate_k)]
+
+        # Reciprocal Rank Fusion: score = sum 1 / (k + rank)
+        fused = {}
+        for ranking in (vector_ids, bm25_ids):
+            for rank, chunk_id in enumerate(ranking):
+                fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        ranked = sorted(fused.items(), key=lambda x: x[1], reverse=True)
+
+        use_rerank = self.reranker_name is not None if rerank is None else rerank
+        reranker = self._get_reranker() if use_rerank else None
+        if reranker is not None:
+            candidates = [chunk_id for chunk_id, _ in ranked[:candidate_k]]
+            with metrics.timer("rerank"):
+                scores = reranker.predict([(query, chunks[chunk_id][0]) for chunk_id in candidates])
+            ranked = sorted(zip(candidates, [float(s) for s in scores]), key=lambda x: x[1], reverse=True)
+
+        ranked = ranked[:top_k]
+        result_ids = [chunk_id for chunk_id, _ in ranked]
+        if whole_section:
+            result_ids = self._section_ids(chunks, result_ids)
+        elif with_neighbors:
+            result_ids = self._neighbor_ids(chunks, result_ids)
+
+        if return_docs_only:
+            return [chunks[chunk_id][0] for chunk_id in result_ids]
+
+        scores = dict(ranked)
+        return {
+            "documents": [chunks[chunk_id][0] for chunk_id in result_ids],
+            "metadatas": [chunks[chunk_id][1] for chunk_id in result_ids],
+            "ids": result_ids,
+            "scores": [scores.get(chunk_id) for chunk_id in result_ids]
+        }
+        
     # Trả về cả documents và metadata
     def get_db_info(self):
         """Hiển thị thông tin về database"""
         print(f"📍 Database path: {os.path.abspath(self.chroma_path)}")
-        print(f"📊 Database name: {self.db_name}")
-        print(f"📁 Collections: {[col.name for col in self.client.list_collections()]}")
-        print(f"📈 Total documents: {self.collection.count()}")
+        print(f"📊 Database name: {self.db_name} ({self.store.backend})")
+        print(f"📈 Total documents: {self.store.count()}")
         
         # Liệt kê files trong database folder
         if os.path.exists(self.chroma_path):
@@ -255,30 +429,36 @@ class RAG:
         return {
             'path': os.path.abspath(self.chroma_path),
             'name': self.db_name,
-            'collections': [col.name for col in self.client.list_collections()],
-            'document_count': self.collection.count()
+            'backend': self.store.backend,
+            'document_count': self.store.count()
         }
     
     def clear_database(self):
         """Xóa toàn bộ database (collection + file lưu trữ)"""
         try:
-            # Xóa collection trong client
-            self.client.delete_collection(self.db_name)
-            print(f"🗑️ Đã xóa collection '{self.db_name}' trong client")
-
-            # Xóa thư mục vật lý chứa DB
-            if os.path.exists(self.chroma_path):
-                shutil.rmtree(self.chroma_path)
-                print(f"🗑️ Đã xóa toàn bộ database folder: {self.chroma_path}")
-
-            # Tạo lại thư mục rỗng để dùng tiếp
-            os.makedirs(self.chroma_path, exist_ok=True)
-            self.client = chromadb.PersistentClient(path=self.chroma_path)
-            self.collection = self.client.get_or_create_collection(name=self.db_name)
+            # Xóa collection + thư mục lưu trữ rồi tạo lại rỗng để dùng tiếp
+            self.store.reset()
+            print(f"🗑️ Đã xóa toàn bộ database folder: {self.chroma_path}")
+            self._invalidate_cache()
             print("✅ Database đã được reset mới hoàn toàn")
 
         except Exception as e:
             print(f"❌ Lỗi khi xóa database: {e}")
+
+    def warmup(self):
+        """Nạp trước chunk cache, BM25 index, reranker (nếu có) và chạy thử model embedding"""
+        self._get_chunk_cache()
+        self._get_reranker()
+        self._encode("warmup")
+
+    def reopen(self):
+        """Mở lại vector store trong worker vừa fork (gunicorn preload).
+
+        Client Chroma của process cha giữ thread / connection không dùng được sau fork;
+        store "flat" chỉ nạp lại (trang mmap dùng chung giữa các worker).
+        Model embedding, chunk cache và BM25 index vẫn dùng chung (copy-on-write).
+        """
+        self.store.reopen()
         
     @classmethod
     def get_instance(cls):
@@ -0,0 +1,139 @@
+import threading
+import time
+import numpy as np
+from ..models import model_emb
+from ..utils import ProductCatalog, Query, run_plan, metrics
+
+
+class ProductRecommender:
+    """Gợi ý sản phẩm liên quan (upsell / phụ kiện) cho 1 sản phẩm.
+
+    - Index embedding: name + category + description của mọi sản phẩm trong ProductCatalog, encode
+      bằng model_emb và chuẩn hóa, chỉ encode lại sản phẩm có text thay đổi
+    - Co-purchase: số đơn hàng có cả 2 sản phẩm (order_details), cache copurchase_ttl giây. recommend_plan là
+      query plan nên tool async chạy self-join qua AsyncDatabase, không chặn event loop
+    - score = cosine + copurchase_weight * log(1 + số đơn mua chung) / log(1 + max)
+    - Chỉ trả về sản phẩm đang bán (IsActive) và còn hàng
+    """
+    _instance = None
+
+    def __init__(self, catalog: ProductCatalog = None, copurchase_weight: float = 0.5, copurchase_ttl: float = 300):
+        self.catalog = catalog or ProductCatalog.get_instance()
+        self.copurchase_weight = copurchase_weight
+        self.copurchase_ttl = copurchase_ttl
+        self._lock = threading.Lock()
+        self._vectors = {}  # product_id -> (text, vector)
+        self._index = None  # (snapshot, matrix) khớp thứ tự dòng của snapshot
+        self._copurchase = None
+        self._copurchase_at = 0.0
+
+    # ----------- EMBEDDING INDEX -----------
+    @staticmethod
+    def _product_text(snapshot, i):
+        category = snapshot.categories.get(int(snapshot.category_ids[i]), "")
+        return f"{snapshot.names[i]}. {category}. {snapshot.descriptions[i]}"
+
+    def _embedding_index(self):
+        snapshot = self.catalog.snapshot
+        index = self._index
+        if index is not None and index[0] is snapshot:
+            return index
+
+        with self._lock:
+            if self._index is not None and self._index[0] is snapshot:
+                return self._index
+            texts = [self._product_text(snapshot, i) for i in range(len(snapshot))]
+            stale = [i for i, text in enumerate(texts)
+                     if self._vectors.get(int(snapshot.ids[i]), (None,))[0] != text]
+            if stale:
+                with metrics.timer("embed", help="Thời gian encode embedding", kind="batch"):
+                    vectors = np.asarray(model_emb.encode([texts[i] for i in stale]), dtype=np.float32)
+                norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+                vectors = vectors / np.where(norms == 0, 1, norms)
+                for i, vec in zip(stale, vectors):
+                    self._vectors[int(snapshot.ids[i])] = (texts[i], vec)
+
+            if len(snapshot):
+                matrix = np.stack([self._vectors[int(pid)][1] for pid in snapshot.ids])
+            else:
+                matrix = np.zeros((0, 0), dtype=np.float32)
+            self._index = (snapshot, matrix)
+            return self._index
+
+    # ----------- CO-PURCHASE -----------
+    def _copurchase_counts(self):
+        """Query plan: {product_id: {product_id khác: số đơn mua chung}}"""
+        if self._copurchase is not None and time.time() - self._copurchase_at < self.copurchase_ttl:
+            return self._copurchase
+        rows = yield Query("""
+            SELECT a.ProductId, b.ProductId, COUNT(DISTINCT a.OrderId)
+            FROM order_details a
+            JOIN order_details b ON a.OrderId = b.OrderId AND a.ProductId <> b.ProductId
+            GROUP BY a.ProductId, b.ProductId
+        """, fetch=True)
+        counts = {}
+        for pid, other, n in rows:
+            counts.setdefault(pid, {})[other] = n
+        self._copurchase, self._copurchase_at = counts, time.time()
+        return counts
+
+    # ----------- RECOMMEND -----------
+    def recommend(self, product_id: int, k: int = 5, same_category: bool = False):
+        """Top-k sản phẩm liên quan tới product_id. Mặc định bỏ qua sản phẩm cùng danh mục
+        (laptop -> chuột, túi, tản nhiệt thay vì laptop khác)"""
+        return run_plan(self.recommend_plan(product_id, k, same_category))
+
+    def recommend_plan(self, product_id: int, k: int = 5, same_category: bool = False):
+        """Query plan của recommend (chạy bằng run_plan / arun_plan hoặc yield from trong tool)"""
+        snapshot, matrix = self._embedding_index()
+        row = snapshot.row_by_id.get(int(product_id))
+        if row is None:
+            return None
+        if k <= 0:
+            return []
+
+        bought_with = (yield from self._copurchase_counts()).get(int(product_id), {})
+        with metrics.timer("recommend", help="Thời gian tính gợi ý sản phẩm liên quan"):
+            scores = matrix @ matrix[row]
+
+            copurchase = np.zeros(len(snapshot), dtype=np.float32)
+            for other, n in bought_with.items():
+                i = snapshot.row_by_id.get(other)
+                if i is not None:
+                    copurchase[i] = n
+            # Mọi sản phẩm mua chung đã rời snapshot -> max = 0, bỏ qua để không chia cho 0 (NaN)
+            top = copurchase.max() if len(copurchase) else 0
+            if top > 0:
+                scores = scores + self.copurchase_weight * np.log1p(copurchase) / np.log1p(top)
+
+            mask = snapshot.active & (snapshot.quantities > 0)
+            mask[row] = False
+            if not same_category:
+                mask &= snapshot.category_ids != snapshot.category_ids[row]
+
+            candidates = np.flatnonzero(mask)
+            if k < len(candidates):
+                candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+            candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+
+        return [
+            {
+                "id": int(snapshot.ids[i]),
+                "name": snapshot.names[i],
+                "category_name": snapshot.categories.get(int(snapshot.category_ids[i])),
+                "price": float(snapshot.prices[i]),
+                "quantity": int(snapshot.quantities[i]),
+                "score": round(float(scores[i]), 4),
+                "bought_together": int(copurchase[i]),
+            }
+            for i in candidates
+        ]
+
+    def warmup(self):
+        self._embedding_index()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
@@ -1,7 +1,28 @@
+import functools
+from datetime import datetime
 from langchain.tools import tool
 from typing import List, Dict
-from ..utils import run_query
+from ..utils import ToolOutputFormatter, ProductCatalog, InventoryManager, OutOfStockError, Query, Call, run_plan, arun_plan
+from ..utils.resolver import resolve_customer, recent_orders, normalize_phone, PENDING_ORDERS
+from ..utils.reports import customer_summary, product_sales, daily_sales
 from ..models import tavilySearch
+from .recommender import ProductRecommender
+
+def db_tool(func):
+    """@tool cho tool truy cập DB viết dạng query plan (generator `rows = yield Query(...)`).
+    Cùng một thân hàm: bản sync chạy qua run_query, bản async (ToolNode.ainvoke) chạy qua
+    AsyncDatabase nên không chặn event loop"""
+    @functools.wraps(func)
+    def _sync(*args, **kwargs):
+        return run_plan(func(*args, **kwargs))
+
+    @functools.wraps(func)
+    async def _async(*args, **kwargs):
+        return await arun_plan(func(*args, **kwargs))
+
+    db = tool(_sync)
+    db.coroutine = _async
+    return db
 
 # ---------------- SAFE TOOLS ----------------
 
@@ -19,7 +40,7 @@ def smart_search(query: str):
 # 1.1 Gợi ý sản phẩm theo danh mục: Khách hỏi “có laptop không?”, 
 # bot trả danh sách laptop kèm giá, mô tả ngắn.
 # ----------- CATEGORY LIST TOOL -----------
-@tool
+@db_tool
 def check_categories():
     """
     Lấy danh sách tất cả danh mục sản phẩm trong cửa hàng.
@@ -31,12 +52,14 @@ def check_categories():
         FROM categories
         ORDER BY CategoryName
     """
-    rows = run_query(q, fetch=True)
+    rows = yield Query(q, fetch=True)
     return {
         "total": len(rows),
         "categories": [{"id": r[0], "name": r[1], "description": r[2]} for r in rows]}
 
 # ----------- LIST PRODUCTS BY CATEGORY TOOL -----------
+# Các tool đọc sản phẩm dùng ProductCatalog (snapshot trong RAM, refresh theo products.UpdatedAt):
+# không truy cập disk mỗi lần gọi.
 @tool
 def list_products_by_category(category_name: str):
     """
@@ -44,16 +67,8 @@ def list_products_by_category(category_name: str):
     Trả về danh sách sản phẩm gồm ProductId, ProductName, Price, ShortDesc.
     Ví dụ: list_products_by_category("Laptop")
     """
-    q = """
-        SELECT p.ProductId, p.ProductName, p.Price, 
-               COALESCE(p.Description, 'Không có mô tả') AS ShortDesc
-        FROM products p
-        JOIN categories c ON p.CategoryId = c.CategoryId
-        WHERE LOWER(c.CategoryName) = LOWER(?)
-        ORDER BY p.ProductName
-    """
-    rows = run_query(q, (category_name,), fetch=True)
-    return [{"id": r[0], "name": r[1], "price": float(r[2]), "description": r[3]} for r in rows]
+    rows = ProductCatalog.get_instance().query(category=category_name, sort_by="name")
+    return [{"id": r["id"], "name": r["name"], "price": r["price"], "description": r["description"]} for r in rows]
 
 # 1.2 Tìm sản phẩm theo từ khóa: Khách hỏi “cho tôi điện thoại iPhone 14 Pro”, 
 # bot tìm đúng sản phẩm.
@@ -66,32 +81,7 @@ def get_all_products():
     Trả về tất cả thông tin: ProductId, ProductName, CategoryId, CategoryName,
     Description, Price, Quantity, ImageUrl, IsActive, CreatedAt, UpdatedAt.
     """
-    q = """
-        SELECT p.ProductId, p.ProductName, p.CategoryId, c.CategoryName,
-               COALESCE(p.Description, 'Không có mô tả') AS Description,
-               p.Price, p.Quantity, p.ImageUrl, p.IsActive,
-               p.CreatedAt, p.UpdatedAt
-        FROM products p
-        JOIN categories c ON p.CategoryId = c.CategoryId
-        ORDER BY p.ProductName
-    """
-    rows = run_query(q, fetch=True)
-    return [
-        {
-            "id": r[0],
-            "name": r[1],
-            "category_id": r[2],
-            "category_name": r[3],
-            "description": r[4],
-            "price": float(r[5]),
-            "quantity": r[6],
-            "image_url": r[7],
-            "is_active": bool(r[8]),
-            "created_at": r[9],
-            "updated_at": r[10]
-        }
-        for r in rows
-    ]
+    return ProductCatalog.get_instance().query(sort_by="name")
 
 # ----------- GET PRODUCT BY NAME TOOL -----------
 @tool
@@ -101,63 +91,34 @@ def get_product_by_name(product_name: str):
     Trả về ProductId, ProductName, CategoryId, CategoryName, Description, Price, Quantity, ImageUrl, IsActive, CreatedAt, UpdatedAt.
     Ví dụ: get_product_by_name("iPhone 15 Pro")
     """
-    q = """
-        SELECT p.ProductId, p.ProductName, p.CategoryId, c.CategoryName,
-               COALESCE(p.Description, 'Không có mô tả') AS Description,
-               p.Price, p.Quantity, p.ImageUrl, p.IsActive,
-               p.CreatedAt, p.UpdatedAt
-        FROM products p
-        JOIN categories c ON p.CategoryId = c.CategoryId
-        WHERE LOWER(p.ProductName) = LOWER(?)
-        LIMIT 1
-    """
-    rows = run_query(q, (product_name,), fetch=True)
-    if not rows:
+    product = ProductCatalog.get_instance().find_by_name(product_name)
+    if product is None:
         return {"message": f"❌ Không tìm thấy sản phẩm tên '{product_name}'"}
-
-    r = rows[0]
-    return {
-        "id": r[0],
-        "name": r[1],
-        "category_id": r[2],
-        "category_name": r[3],
-        "description": r[4],
-        "price": float(r[5]),
-        "quantity": r[6],
-        "image_url": r[7],
-        "is_active": bool(r[8]),
-        "created_at": r[9],
-        "updated_at": r[10]
-    }
+    return product
 
 # 1.3 So sánh sản phẩm: Khách có thể so sánh 2 sản phẩm 
 # (ví dụ iPhone 14 vs Samsung S23).
 
-@tool
+@db_tool
 def compare_products(product1: str, product2: str):
     """
     So sánh hai sản phẩm theo tên.
     Lấy thông tin trong DB (nếu có), và dùng Tavily để bổ sung dữ liệu ngoài.
     Trả về kết quả so sánh chi tiết.
     """
+    catalog = ProductCatalog.get_instance()
+
     def get_product_info(name):
-        q = """
-            SELECT p.ProductId, p.ProductName, c.CategoryName, p.Price, p.Description
-            FROM products p
-            JOIN categories c ON p.CategoryId = c.CategoryId
-            WHERE LOWER(p.ProductName) = LOWER(?)
-        """
-        rows = run_query(q, (name,), fetch=True)
-        if rows:
-            r = rows[0]
+        product = catalog.find_by_name(name)
+        if product is not None:
             return {
-                "id": r[0], "name": r[1], "category": r[2],
-                "price": float(r[3]), "description": r[4]
+                "id": product["id"], "name": product["name"], "category": product["category_name"],
+                "price": product["price"], "description": product["description"]
             }
         else:
             # fallback: gọi Tavily
             print(f"⚠️ Không tìm thấy '{name}' trong DB, gọi Tavily để bổ sung thông tin.")
-            tavily_res = tavilySearch.search(f"Thông tin sản phẩm {name}")
+            tavily_res = yield Call(tavilySearch.search, f"Thông tin sản phẩm {name}")
             return {
                 "id": None, "name": name,
                 "category": "Unknown",
@@ -165,16 +126,30 @@ def compare_products(product1: str, product2: str):
                 "description": tavily_res['results'][0]['content'] if tavily_res['results'] else "Không tìm thấy"
             }
 
-    info1 = get_product_info(product1)
-    info2 = get_product_info(product2)
+    info1 = yield from get_product_info(product1)
+    info2 = yield from get_product_info(product2)
 
     return {"product1": info1, "product2": info2}
 
+# ----------- RECOMMEND RELATED TOOL -----------
+@db_tool
+def recommend_related(product_id: int, k: int = 5):
+    """
+    Gợi ý sản phẩm mua kèm / phụ kiện cho một sản phẩm (upsell), vd: laptop -> chuột, túi, tản nhiệt.
+    Dựa trên độ tương đồng (tên, danh mục, mô tả) và số đơn hàng đã mua chung.
+    Chỉ trả về sản phẩm đang bán và còn hàng: id, name, category_name, price, quantity, score, bought_together.
+    Ví dụ: recommend_related(12, 5)
+    """
+    items = yield from ProductRecommender.get_instance().recommend_plan(product_id, k=min(max(int(k), 1), 20))
+    if items is None:
+        return {"message": f"❌ Không tìm thấy sản phẩm ID {product_id}"}
+    return {"product_id": product_id, "recommendations": items}
+
 # 1.4 Hiển thị sản phẩm nổi bật/khuyến mãi: 
 # Bot chủ động gợi ý sản phẩm đang giảm giá.
 
 # ----------- GET DISCOUNTED PRODUCTS TOOL -----------
-@tool
+@db_tool
 def get_discounted_products():
     """
     Lấy tất cả sản phẩm đang có khuyến mãi (giảm giá).
@@ -193,7 +168,7 @@ def get_discounted_products():
           AND datetime('now') BETWEEN pr.StartDate AND pr.EndDate
         ORDER BY p.ProductName
     """
-    rows = run_query(q, fetch=True)
+    rows = yield Query(q, fetch=True)
     if not rows:
         return {"message": "❌ Hiện tại không có sản phẩm nào đang giảm giá."}
 
@@ -225,6 +200,19 @@ def get_discounted_products():
 
     return result
 
+# ----------- REFERENCE DETAIL TOOL -----------
+# Kết quả tool được format gọn, text dài bị cắt kèm mã [ref:Rn].
+@tool
+def get_reference_detail(ref_id: str):
+    """
+    Lấy nội dung đầy đủ của một trường đã bị rút gọn trong kết quả tool trước đó.
+    Dùng khi thấy ký hiệu [ref:Rn] và cần xem chi tiết. Ví dụ: get_reference_detail("R3")
+    """
+    content = ToolOutputFormatter.get_instance().get_reference(ref_id)
+    if content is None:
+        return f"❌ Không tìm thấy nội dung cho mã tham chiếu '{ref_id}'"
+    return content
+
 # ---------------- SENSITIVE TOOLS ----------------
 # # ----------- ADD PRODUCT TOOL -----------
 # @tool
@@ -274,9 +262,9 @@ def get_discounted_products():
 # ----------- ADD ORDER TOOL -----------
 # ----------- HELPER FUNCTIONS -----------
 def get_order_by_id(order_id: int):
-    """Lấy thông tin đơn hàng theo ID"""
+    """Lấy thông tin đơn hàng theo ID (query plan: chạy bằng run_plan / arun_plan hoặc yield from trong tool)"""
     try:
-        order_info = run_query(
+        order_info = yield Query(
             """SELECT o.OrderId, o.CustomerId, c.Name, o.OrderDate, o.Status, 
                       o.TotalAmount, o.ShippingAddress, o.PaymentMethod, o.Notes
                FROM orders o
@@ -291,7 +279,7 @@ def get_order_by_id(order_id: int):
         order = order_info[0]
         
         # Lấy chi tiết sản phẩm
-        items = run_query(
+        items = yield Query(
             """SELECT od.ProductId, p.ProductName, od.Quantity, od.UnitPrice, od.SubTotal
                FROM order_details od
                JOIN products p ON od.ProductId = p.ProductId
@@ -323,7 +311,7 @@ def get_order_by_id(order_id: int):
     except Exception as e:
         return {"error": str(e)}
     
-@tool
+@db_tool
 def add_order(
     customer_id: int,
     items: List[Dict[str, int]],
@@ -361,7 +349,7 @@ def add_order(
                 merged_items[pid] = qty
 
         # 2. Validate customer
-        customer_check = run_query(
+        customer_check = yield Query(
             "SELECT Name FROM customers WHERE CustomerId = ?",
             (customer_id,), fetch=True
         )
@@ -377,7 +365,7 @@ def add_order(
         total = 0
         order_items = []
         for pid, qty in merged_items.items():
-            row = run_query(
+            row = yield Query(
                 "SELECT Price, Quantity, ProductName FROM products WHERE ProductId = ? AND IsActive = 1", 
                 (pid,), fetch=True
             )
@@ -394,76 +382,25 @@ def add_order(
         if total <= 0:
             return {"error": "Tổng tiền đơn hàng phải > 0"}
 
-        # 5. Tạo đơn hàng
-        run_query(
-            """INSERT INTO orders (CustomerId, Status, ShippingAddress, PaymentMethod, Notes, TotalAmount)
-               VALUES (?, ?, ?, ?, ?, ?)""",
-            (customer_id, "Pending", shipping_address, payment_method, notes, total),
-            fetch=False
-        )
-        
-        # 6. Lấy OrderId (với fallback nếu last_insert_rowid() = 0)
-        order_id_result = run_query("SELECT last_insert_rowid()", fetch=True)
-        order_id = order_id_result[0][0]
-        
-        if order_id == 0:
-            # Fallback: tìm OrderId mới nhất của customer này
-            alt_order = run_query(
-                "SELECT OrderId FROM orders WHERE CustomerId = ? ORDER BY OrderDate DESC LIMIT 1",
-                (customer_id,), fetch=True
+        # 5. Tạo đơn + trừ kho có điều kiện + giữ hàng trong 1 transaction (an toàn khi checkout đồng thời)
+        try:
+            placed = yield Call(
+                InventoryManager.get_instance().place_order,
+                customer_id, order_items, shipping_address, payment_method, notes
             )
-            if alt_order:
-                order_id = alt_order[0][0]
-            else:
-                return {"error": "Không thể tạo đơn hàng - lỗi database"}
-
-        # 7. Kiểm tra OrderId đã có chi tiết chưa (để tránh trùng lặp)
-        existing_details = run_query(
-            "SELECT COUNT(*) FROM order_details WHERE OrderId = ?",
-            (order_id,), fetch=True
-        )
-        if existing_details[0][0] > 0:
-            return {"error": f"Đơn hàng ID {order_id} đã có chi tiết. Vui lòng thử lại."}
-
-        # 8. Thêm chi tiết đơn hàng & trừ tồn kho
-        for oi in order_items:
-            # Thêm chi tiết
-            run_query(
-                """INSERT INTO order_details (OrderId, ProductId, Quantity, UnitPrice)
-                   VALUES (?, ?, ?, ?)""",
-                (order_id, oi["pid"], oi["qty"], oi["price"]),
-                fetch=False
-            )
-            
-            # Trừ tồn kho
-            run_query(
-                "UPDATE products SET Quantity = Quantity - ?, UpdatedAt = CURRENT_TIMESTAMP WHERE ProductId = ?",
-                (oi["qty"], oi["pid"]),
-                fetch=False
-            )
-
-        # 9. Lấy thông tin chi tiết đơn hàng
-        details = run_query(
-            """SELECT od.ProductId, p.ProductName, od.Quantity, od.UnitPrice, od.SubTotal
-               FROM order_details od
-               JOIN products p ON od.ProductId = p.ProductId
-               WHERE od.OrderId = ?""",
-            (order_id,), fetch=True
-        )
-        
-        # 10. Lấy tổng tiền cuối cùng (từ trigger)
-        final_total = run_query(
-            "SELECT TotalAmount FROM orders WHERE OrderId = ?",
-            (order_id,), fetch=True
-        )
+        except OutOfStockError as e:
+            return {"error": str(e)}
+        order_id = placed["order_id"]
+        details = placed["details"]
 
         return {
             "success": True,
             "order_id": order_id,
             "customer_id": customer_id,
             "customer_name": customer_check[0][0],
-            "total_amount": final_total[0][0] if final_total else total,
+            "total_amount": placed["total_amount"],
             "status": "Pending",
+            "reserved_until": datetime.fromtimestamp(placed["reserved_until"]).isoformat(sep=" ", timespec="seconds"),
             "shipping_address": shipping_address,
             "payment_method": payment_method,
             "notes": notes,
@@ -486,11 +423,12 @@ def add_order(
 # 2.2 Hiển thị giỏ hàng: Cho khách xem giỏ hàng hiện tại.
 # ----------- VIEW CART TOOL -----------
 # ----------- VIEW CART TOOL - FIXED -----------
-@tool
-def view_cart(customer_id: int):
+@db_tool
+def view_cart(customer_id: int = None, email: str = None, phone: str = None):
     """
     Hiển thị giỏ hàng hiện tại của khách hàng.
     Giỏ hàng = tất cả đơn hàng ở trạng thái 'Pending' của khách hàng.
+    Xác định khách hàng bằng customer_id, hoặc email / số điện thoại nếu chưa biết ID.
     
     Trả về:
     - customer_info: thông tin khách hàng
@@ -500,24 +438,15 @@ def view_cart(customer_id: int):
     """
     try:
         # 1. Kiểm tra khách hàng tồn tại
-        customer_info = run_query(
-            "SELECT CustomerId, Name, Email, Phone FROM customers WHERE CustomerId = ?",
-            (customer_id,), fetch=True
-        )
+        customer_info, error = yield from resolve_customer(customer_id, email, phone)
+        if error:
+            return {"error": error}
         
-        if not customer_info:
-            return {"error": f"Không tìm thấy khách hàng ID {customer_id}"}
+        customer = (customer_info["customer_id"], customer_info["name"], customer_info["email"], customer_info["phone"])
+        customer_id = customer[0]
         
-        customer = customer_info[0]
-        
-        # 2. Lấy tất cả đơn hàng pending của khách hàng
-        pending_orders = run_query(
-            """SELECT OrderId, TotalAmount, OrderDate, ShippingAddress, PaymentMethod, Notes
-               FROM orders 
-               WHERE CustomerId = ? AND Status = 'Pending' 
-               ORDER BY OrderDate DESC""",
-            (customer_id,), fetch=True
-        )
+        # 2. Lấy tất cả đơn hàng pending của khách hàng (LIMIT -1: không giới hạn)
+        pending_orders = yield Query(PENDING_ORDERS, (customer_id, -1), fetch=True)
         
         if not pending_orders:
             return {
@@ -536,19 +465,22 @@ def view_cart(customer_id: int):
         total_cart_value = 0
         total_item_count = 0
         
-        for order in pending_orders:
-            order_id, total_amount, order_date, shipping_addr, payment_method, notes = order
-            
-            # Lấy chi tiết sản phẩm của đơn hàng này
-            items = run_query(
+        # Lấy chi tiết sản phẩm của tất cả đơn hàng (đọc trong cùng 1 batch)
+        items_per_order = yield [
+            Query(
                 """SELECT od.ProductId, p.ProductName, p.Description, od.Quantity, 
                           od.UnitPrice, od.SubTotal, p.ImageUrl
                    FROM order_details od
                    JOIN products p ON od.ProductId = p.ProductId
                    WHERE od.OrderId = ?
                    ORDER BY od.OrderDetailId""",
-                (order_id,), fetch=True
+                (order[0],), fetch=True
             )
+            for order in pending_orders
+        ]
+        
+        for order, items in zip(pending_orders, items_per_order):
+            order_id, total_amount, order_date, shipping_addr, payment_method, notes = order
             
             # Format chi tiết sản phẩm
             formatted_items = []
@@ -601,39 +533,31 @@ def view_cart(customer_id: int):
 
 
 # ----------- RELATED CART TOOLS -----------
-@tool 
-def get_latest_cart(customer_id: int):
+@db_tool 
+def get_latest_cart(customer_id: int = None, email: str = None, phone: str = None):
     """
     Lấy đơn hàng pending mới nhất (giỏ hàng hiện tại đang được chỉnh sửa)
+    Xác định khách hàng bằng customer_id, hoặc email / số điện thoại nếu chưa biết ID.
     """
     try:
         # Kiểm tra customer
-        customer_check = run_query(
-            "SELECT Name FROM customers WHERE CustomerId = ?",
-            (customer_id,), fetch=True
-        )
-        if not customer_check:
-            return {"error": f"Không tìm thấy khách hàng ID {customer_id}"}
+        customer, error = yield from resolve_customer(customer_id, email, phone)
+        if error:
+            return {"error": error}
         
         # Lấy đơn pending mới nhất
-        latest_order = run_query(
-            """SELECT OrderId, TotalAmount, OrderDate, ShippingAddress, PaymentMethod, Notes
-               FROM orders 
-               WHERE CustomerId = ? AND Status = 'Pending' 
-               ORDER BY OrderDate DESC LIMIT 1""",
-            (customer_id,), fetch=True
-        )
+        latest_order = yield Query(PENDING_ORDERS, (customer["customer_id"], 1), fetch=True)
         
         if not latest_order:
             return {
-                "customer_name": customer_check[0][0],
+                "customer_name": customer["name"],
                 "message": "Chưa có đơn hàng nào trong giỏ."
             }
         
         order_id, total, order_date, shipping_addr, payment_method, notes = latest_order[0]
         
         # Lấy chi tiết sản phẩm
-        items = run_query(
+        items = yield Query(
             """SELECT od.ProductId, p.ProductName, od.Quantity, od.UnitPrice, od.SubTotal
                FROM order_details od
                JOIN products p ON od.ProductId = p.ProductId
@@ -643,7 +567,7 @@ def get_latest_cart(customer_id: int):
         
         return {
             "success": True,
-            "customer_name": customer_check[0][0],
+            "customer_name": customer["name"],
             "order_id": order_id,
             "order_date": order_date,
             "total_amount": total,
@@ -666,7 +590,7 @@ def get_latest_cart(customer_id: int):
         return {"error": str(e)}
 
 
-@tool
+@db_tool
 def clear_cart(customer_id: int, order_id: int = None):
     """
     Xóa giỏ hàng (hủy đơn hàng pending)
@@ -675,7 +599,7 @@ def clear_cart(customer_id: int, order_id: int = None):
     """
     try:
         # Kiểm tra customer
-        customer_check = run_query(
+        customer_check = yield Query(
             "SELECT Name FROM customers WHERE CustomerId = ?",
             (customer_id,), fetch=True
         )
@@ -685,7 +609,7 @@ def clear_cart(customer_id: int, order_id: int = None):
         if order_id:
             # Xóa đơn hàng cụ thể
             # Kiểm tra đơn hàng thuộc về customer và đang pending
-            order_check = run_query(
+            order_check = yield Query(
                 "SELECT OrderId FROM orders WHERE OrderId = ? AND CustomerId = ? AND Status = 'Pending'",
                 (order_id, customer_id), fetch=True
             )
@@ -693,24 +617,8 @@ def clear_cart(customer_id: int, order_id: int = None):
             if not order_check:
                 return {"error": f"Không tìm thấy đơn hàng pending ID {order_id} của khách hàng này"}
             
-            # Lấy thông tin sản phẩm để hoàn lại tồn kho
-            items_to_restore = run_query(
-                "SELECT ProductId, Quantity FROM order_details WHERE OrderId = ?",
-                (order_id,), fetch=True
-            )
-            
-            # Hoàn lại tồn kho
-            for product_id, quantity in items_to_restore:
-                run_query(
-                    "UPDATE products SET Quantity = Quantity + ? WHERE ProductId = ?",
-                    (quantity, product_id), fetch=False
-                )
-            
-            # Xóa đơn hàng (order_details sẽ tự động xóa do CASCADE)
-            run_query(
-                "DELETE FROM orders WHERE OrderId = ?",
-                (order_id,), fetch=False
-            )
+            # Hoàn lại phần hàng đang giữ và xóa đơn hàng trong 1 transaction
+            items_to_restore = yield Call(InventoryManager.get_instance().cancel_order, order_id)
             
             return {
                 "success": True,
@@ -719,7 +627,7 @@ def clear_cart(customer_id: int, order_id: int = None):
             }
         else:
             # Xóa tất cả đơn pending
-            pending_orders = run_query(
+            pending_orders = yield Query(
                 "SELECT OrderId FROM orders WHERE CustomerId = ? AND Status = 'Pending'",
                 (customer_id,), fetch=True
             )
@@ -729,24 +637,9 @@ def clear_cart(customer_id: int, order_id: int = None):
             
             total_restored = 0
             for (order_id_to_delete,) in pending_orders:
-                # Hoàn lại tồn kho
-                items_to_restore = run_query(
-                    "SELECT ProductId, Quantity FROM order_details WHERE OrderId = ?",
-                    (order_id_to_delete,), fetch=True
-                )
-                
-                for product_id, quantity in items_to_restore:
-                    run_query(
-                        "UPDATE products SET Quantity = Quantity + ? WHERE ProductId = ?",
-                        (quantity, product_id), fetch=False
-                    )
-                    total_restored += quantity
-                
-                # Xóa đơn hàng
-                run_query(
-                    "DELETE FROM orders WHERE OrderId = ?",
-                    (order_id_to_delete,), fetch=False
-                )
+                # Hoàn lại tồn kho và xóa đơn hàng
+                items_to_restore = yield Call(InventoryManager.get_instance().cancel_order, order_id_to_delete)
+                total_restored += sum(quantity for _, quantity in items_to_restore)
             
             return {
                 "success": True,
@@ -764,7 +657,7 @@ def clear_cart(customer_id: int, order_id: int = None):
 # @ 3. Quản lý tài khoản khách hàng (Customer Management)
 # 3.1 Đăng ký khách hàng mới:
 
-@tool
+@db_tool
 def register_customer(name: str, email: str, phone: str = None, address: str = None):
     """
     Đăng ký khách hàng mới.
@@ -777,12 +670,13 @@ def register_customer(name: str, email: str, phone: str = None, address: str = N
     """
     try:
         # Kiểm tra email đã tồn tại chưa
-        existing = run_query("SELECT CustomerId FROM customers WHERE Email = ?", (email,), fetch=True)
+        existing = yield Query("SELECT CustomerId FROM customers WHERE Email = ?", (email,), fetch=True)
         if existing:
             return {"error": f"Email {email} đã được sử dụng"}
 
-        # Thêm khách hàng mới
-        run_query(
+        # Thêm khách hàng mới (số điện thoại lưu dạng chuẩn để tra cứu được theo index)
+        phone = normalize_phone(phone) if phone else phone
+        yield Query(
             """
             INSERT INTO customers (Name, Email, Phone, Address)
             VALUES (?, ?, ?, ?)
@@ -792,7 +686,7 @@ def register_customer(name: str, email: str, phone: str = None, address: str = N
         )
 
         # Lấy ID vừa thêm
-        customer_id = run_query("SELECT last_insert_rowid()", fetch=True)[0][0]
+        customer_id = (yield Query("SELECT last_insert_rowid()", fetch=True))[0][0]
 
         # Trả về thông tin khách hàng
         return {
@@ -807,41 +701,44 @@ def register_customer(name: str, email: str, phone: str = None, address: str = N
         return {"error": str(e)}
     
 # 3.2 Tra cứu thông tin khách hàng
-@tool
-def get_customer_info(customer_id: int):
+@db_tool
+def get_customer_info(customer_id: int = None, email: str = None, phone: str = None):
     """
-    Tra cứu thông tin khách hàng theo ID.
+    Tra cứu thông tin khách hàng theo ID, hoặc theo email / số điện thoại nếu chưa biết ID.
     Khách có thể hỏi “Thông tin của tôi lưu thế nào?”.
     """
     try:
-        row = run_query(
-            """
-            SELECT CustomerId, Name, Email, Phone, Address, CreatedAt, UpdatedAt
-            FROM customers
-            WHERE CustomerId = ?
-            """,
-            (customer_id,), fetch=True
-        )
-        if not row:
-            return {"error": f"Không tìm thấy khách hàng ID {customer_id}"}
+        customer, error = yield from resolve_customer(customer_id, email, phone)
+        if error:
+            return {"error": error}
+        return customer
 
-        r = row[0]
-        return {
-            "customer_id": r[0],
-            "name": r[1],
-            "email": r[2],
-            "phone": r[3],
-            "address": r[4],
-            "created_at": r[5],
-            "updated_at": r[6]
-        }
+    except Exception as e:
+        return {"error": str(e)}
+
+# 3.2b Đơn hàng gần đây của khách hàng
+@db_tool
+def get_customer_orders(customer_id: int = None, email: str = None, phone: str = None,
+                        status: str = None, limit: int = 5):
+    """
+    Lấy các đơn hàng gần nhất của khách hàng (mới nhất trước).
+    - Xác định khách hàng bằng customer_id, hoặc email / số điện thoại nếu chưa biết ID
+    - status: lọc theo trạng thái ('Pending', 'Processing', 'Shipped', 'Delivered', 'Cancelled', 'Completed')
+    - limit: số đơn tối đa (mặc định 5)
+    """
+    try:
+        customer, error = yield from resolve_customer(customer_id, email, phone)
+        if error:
+            return {"error": error}
+        orders = yield from recent_orders(customer["customer_id"], status, min(max(int(limit), 1), 50))
+        return {"customer_id": customer["customer_id"], "customer_name": customer["name"], "orders": orders}
 
     except Exception as e:
         return {"error": str(e)}
 
 # 3.3 Cập nhật thông tin cá nhân
 # ----------- UPDATE CUSTOMER INFO TOOL -----------
-@tool
+@db_tool
 def update_customer_info(customer_id: int, field: str, value: str):
     """
     Cập nhật thông tin cá nhân của khách hàng.
@@ -858,17 +755,62 @@ def update_customer_info(customer_id: int, field: str, value: str):
 
         # Nếu update Email -> check trùng
         if field == "Email":
-            exists = run_query("SELECT CustomerId FROM customers WHERE Email = ?", (value,), fetch=True)
+            exists = yield Query("SELECT CustomerId FROM customers WHERE Email = ?", (value,), fetch=True)
             if exists:
                 return {"error": f"Email {value} đã tồn tại"}
 
+        if field == "Phone":
+            value = normalize_phone(value)
+
         # Update
         query = f"UPDATE customers SET {field} = ?, UpdatedAt = datetime('now') WHERE CustomerId = ?"
-        run_query(query, (value, customer_id), fetch=False)
+        yield Query(query, (value, customer_id), fetch=False)
+
+        # Trả về thông tin sau khi update (chạy tiếp query plan của get_customer_info)
+        return (yield from get_customer_info.func.__wrapped__(customer_id))
+
+    except Exception as e:
+        return {"error": str(e)}
+
+# ---------------- REPORT TOOLS (cho nhân viên) ----------------
+# Đọc bảng tổng hợp do trigger cập nhật (migration 006), không aggregate lại orders / order_details
+
+@db_tool
+def report_top_customers(limit: int = 10, sort_by: str = "value"):
+    """
+    Báo cáo khách hàng mua nhiều nhất.
+    - sort_by: 'value' (tổng giá trị đơn), 'completed' (giá trị đơn hoàn tất), 'orders' (số đơn), 'recent' (mua gần nhất)
+    - limit: số khách tối đa (mặc định 10)
+    """
+    try:
+        customers = yield from customer_summary(min(max(int(limit), 1), 100), sort_by)
+        return {"total": len(customers), "customers": customers}
+    except Exception as e:
+        return {"error": str(e)}
 
-        # Trả về thông tin sau khi update
-        return get_customer_info(customer_id)
+@db_tool
+def report_best_sellers(limit: int = 10, sort_by: str = "revenue"):
+    """
+    Báo cáo sản phẩm bán chạy (chỉ tính đơn Completed / Delivered).
+    - sort_by: 'revenue' (doanh thu) hoặc 'sold' (số lượng bán)
+    - limit: số sản phẩm tối đa (mặc định 10)
+    """
+    try:
+        products = yield from product_sales(min(max(int(limit), 1), 100), sort_by)
+        return {"total": len(products), "products": products}
+    except Exception as e:
+        return {"error": str(e)}
 
+@db_tool
+def report_daily_sales(days: int = 7, date_from: str = None, date_to: str = None):
+    """
+    Báo cáo doanh số theo ngày (mới nhất trước): số đơn, số khách, doanh số đơn hoàn tất, tổng giá trị đơn.
+    - days: số ngày gần nhất có đơn (mặc định 7)
+    - date_from / date_to: lọc theo khoảng ngày 'YYYY-MM-DD'
+    """
+    try:
+        days_report = yield from daily_sales(min(max(int(days), 1), 366), date_from, date_to)
+        return {"total": len(days_report), "days": days_report}
     except Exception as e:
         return {"error": str(e)}
 
@@ -880,12 +822,21 @@ safe_tools = [smart_search, #  Tìm kiếm thông tin chung trên web. Sử dụ
               get_all_products, # Lấy tất cả sản phẩm
               get_product_by_name, # lấy sản phẩm theo tên sản phẩm
               get_discounted_products, # Lây tất cả thông tin giảm giá
-              compare_products # So sáng 2 sản phẩm, cái này có search thêm với Tavily nếu thiếu thông tin
+              compare_products, # So sáng 2 sản phẩm, cái này có search thêm với Tavily nếu thiếu thông tin
+              recommend_related, # Gợi ý sản phẩm mua kèm / phụ kiện còn hàng cho 1 sản phẩm
+              get_reference_detail # Lấy nội dung đầy đủ của trường bị rút gọn [ref:Rn]
               ]
 
 sensitive_tools = [add_order, # thêm đặt hàng mới
                    view_cart, # xem giỏ hàng
                    register_customer, # đăng kí khách hàng mới
                    get_customer_info, # Xem thông tin của khách hàng
+                   get_customer_orders, # Xem các đơn hàng gần đây của khách hàng
                    update_customer_info # update thông tin khách hàng
-                   ]
\ No newline at end of file
+                   ]
+
+# Chỉ bind khi ENABLE_REPORT_TOOLS=1 (bot nội bộ cho nhân viên)
+report_tools = [report_top_customers, # Khách hàng mua nhiều nhất
+                report_best_sellers, # Sản phẩm bán chạy
+                report_daily_sales # Doanh số theo ngày
+                ]
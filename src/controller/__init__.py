@@ -1 +1,5 @@
-from . controller import ChatController
\ No newline at end of file
+from . controller import ChatController
+from .memory import SemanticMemory
+from .knowledge import KnowledgeBase
+from .tool_selector import ToolSelector
+from .prefetch import ToolPrefetcher
\ No newline at end of file
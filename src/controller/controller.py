@@ -5,25 +5,51 @@ from langgraph.prebuilt import ToolNode
 from langchain.tools import tool
 from typing import TypedDict, List, Annotated
 import operator
+import asyncio
 from IPython.display import Image, display
 from langgraph.graph import StateGraph
+from langgraph.graph.message import add_messages, REMOVE_ALL_MESSAGES
+from langgraph.managed import RemainingSteps
+from langgraph.types import interrupt, Command
+from langchain_core.messages import RemoveMessage, messages_to_dict
+from langchain_core.runnables import RunnableLambda
 import os
 from ..models import llm
-from ..Prompts import system_prompt
+from ..Prompts import system_prompt, PromptAssembler
+from ..utils import ToolOutputFormatter, SqliteCheckpointSaver, MetricsCallbackHandler, get_trace_id, metrics, traced
+from .memory import SemanticMemory
+from .knowledge import KnowledgeBase
+from .tool_selector import ToolSelector
+from .prefetch import ToolPrefetcher, tool_call_key
 
 PROJECT_DIR = os.path.abspath(os.path.join(__file__, "..", "..", ".."))
 
 class State(TypedDict):
-    messages: Annotated[list, operator.add]
+    messages: Annotated[list, add_messages]
+    # Toàn bộ lịch sử chat (không bị tóm tắt), chỉ append
+    history: Annotated[list, operator.add]
+    # Các lượt cũ liên quan tới tin nhắn hiện tại (SemanticMemory), ghi đè mỗi lượt
+    recalled: str
+    # LLM gọi lại tool y hệt trong cùng lượt -> lần gọi LLM tiếp theo không bind tool, bắt trả lời
+    force_answer: bool
+    # Số bước còn lại trước recursion_limit (LangGraph tự điền)
+    remaining_steps: RemainingSteps
+    # Kết quả tool đã chạy trước (ToolPrefetcher) song song với lần gọi LLM đầu tiên của lượt, theo tool_call_key
+    prefetched: dict
 
 class ChatController:
-    def __init__(self, llm, safe_tools, sensitive_tools, system_prompt, len_summary = 20):
+    def __init__(self, llm, safe_tools, sensitive_tools, system_prompt, len_summary = 20, checkpointer = None, memory = None, knowledge = None):
         
         from ..chatTools import RAG
         self.RAG = RAG.get_instance()
         
         self.len_summary = len_summary
         self.llm = llm
+        
+        # Format gọn output của tool (bảng, bỏ field rỗng) để giảm input tokens
+        self.formatter = ToolOutputFormatter.get_instance()
+        safe_tools = [self.formatter.wrap_tool(t) for t in safe_tools]
+        sensitive_tools = [self.formatter.wrap_tool(t) for t in sensitive_tools]
     
         self.safe_tools = safe_tools
         self.safe_tools_node = ToolNode(tools=self.safe_tools)
@@ -42,14 +68,43 @@ class ChatController:
         self.llm_with_tools = llm.bind_tools(self.all_tools)
         
         self.system_prompt = system_prompt
+        # System prompt mặc định được ghép theo intent của từng lượt (chỉ các phần liên quan) để giảm input tokens;
+        # prompt tùy chỉnh hoặc PROMPT_ASSEMBLY=0 thì gửi nguyên prompt
+        assembler = PromptAssembler()
+        use_assembler = os.getenv("PROMPT_ASSEMBLY", "1") != "0" and assembler.full_prompt == system_prompt
+        self.prompt_assembler = assembler if use_assembler else None
+        
+        # Mỗi lần gọi LLM chỉ bind các tool liên quan tới intent (cùng bộ nhận intent với prompt),
+        # model đã bind được cache theo tập tool (TOOL_SELECTION=0 để luôn bind mọi tool)
+        self.intent_detector = assembler
+        self.tool_selector = ToolSelector(llm, self.all_tools) if os.getenv("TOOL_SELECTION", "1") != "0" else None
+        
+        # Tin nhắn nhắc tới sản phẩm / danh mục -> chạy trước get_product_by_name, list_products_by_category,
+        # get_discounted_products trong lúc chờ LLM, tool node trả ngay kết quả nếu LLM gọi đúng (TOOL_PREFETCH=0 để tắt)
+        self.prefetcher = ToolPrefetcher(self.safe_tools)
+        
+        # State của từng session được lưu trong checkpointer SQLite (thread_id = session_id),
+        # nhờ đó graph có thể dừng lại chờ xác nhận, chạy tiếp sau khi crash và chạy nhiều worker
+        self.checkpointer = checkpointer or SqliteCheckpointSaver()
+        self.recursion_limit = 10
+        
+        # Callback handler của LangChain gắn vào mọi lượt chạy (metrics latency node/tool/LLM, token...)
+        self.callbacks = [MetricsCallbackHandler()]
         
         self.app = self.build_graph()
         
-        self.state = {"messages": [SystemMessage(content=system_prompt)]}
-        self.len_state = 0
+        # Bộ nhớ dài hạn theo ngữ nghĩa (CHAT_MEMORY_MODE):
+        # - semantic (mặc định): khi quá len_summary messages chỉ cắt bớt context, không gọi LLM tóm tắt;
+        #   các lượt cũ liên quan được tra cứu lại cho mỗi tin nhắn mới
+        # - both: vừa tóm tắt vừa tra cứu; summary: chỉ tóm tắt như trước
+        self.memory_mode = os.getenv("CHAT_MEMORY_MODE", "semantic")
+        self.memory_top_k = int(os.getenv("MEMORY_TOP_K", 3))
+        self.memory = memory or SemanticMemory.get_instance()
         
-        # Lưu trữ toàn bộ lịch sử chat (không bị tóm tắt)
-        self.full_chat_history = [SystemMessage(content=system_prompt)]
+        # Câu hỏi trùng nghĩa với câu đã được xác nhận trong knowledge_base được trả lời ngay,
+        # không chạy RAG + LLM (KNOWLEDGE_SHORTCUT=0 để tắt)
+        self.knowledge_shortcut = os.getenv("KNOWLEDGE_SHORTCUT", "1") != "0"
+        self.knowledge = knowledge or KnowledgeBase.get_instance()
         
         # Prompt template cho tóm tắt
         self.summary_template = ChatPromptTemplate.from_messages([
@@ -66,16 +121,146 @@ class ChatController:
             HumanMessagePromptTemplate.from_template("Hãy tóm tắt cuộc hội thoại sau:\n\n{conversation_history}")
         ])
 
-    def llm_node(self, state: State):
+    def _llm_input(self, state: State):
+        """(model đã bind tool, messages) cho lần gọi LLM: tool và system prompt theo intent của lượt hiện tại"""
+        # Đang lặp tool hoặc không đủ bước cho 1 vòng tool + LLM nữa -> gọi LLM không kèm tool để trả lời ngay
+        # thay vì chạy tới GraphRecursionError
+        if state.get("force_answer") or state.get("remaining_steps", self.recursion_limit) <= 2:
+            reason = "loop" if state.get("force_answer") else "budget"
+            metrics.inc("llm_forced_answer_total", reason=reason, help="Số lần bắt LLM trả lời không gọi thêm tool")
+            return self.llm, self._llm_messages(state)
+        intents = None
+        if self.prompt_assembler is not None or self.tool_selector is not None:
+            intents = self.intent_detector.detect_intents(state["messages"])
+        llm = self.tool_selector.bind(intents) if self.tool_selector is not None else self.llm_with_tools
+        return llm, self._llm_messages(state, intents)
+    
+    def _llm_messages(self, state: State, intents=None):
         messages = state["messages"]
+        prompt = self.system_prompt
+        if self.prompt_assembler is not None:
+            prompt, _ = self.prompt_assembler.build(messages, intents)
     
-        # Nếu chưa có system message, thêm vào
+        # Nếu chưa có system message, thêm vào; system prompt lưu trong state được thay bằng bản đã ghép
         if not messages or not isinstance(messages[0], SystemMessage):
-            messages = [SystemMessage(content=self.system_prompt)] + messages
+            messages = [SystemMessage(content=prompt)] + messages
+        elif messages[0].content == self.system_prompt:
+            messages = [SystemMessage(content=prompt)] + messages[1:]
         
-        response = self.llm_with_tools.invoke(messages)
+        # Các lượt cũ liên quan chèn ngay sau system prompt (không lưu vào messages)
+        if state.get("recalled"):
+            messages = messages[:1] + [SystemMessage(content=state["recalled"])] + messages[1:]
+        return messages
+    
+    def _llm_update(self, response):
+        # Câu trả lời cuối cùng (không gọi tool) được lưu vào full history
+        if not getattr(response, "tool_calls", None):
+            return {"messages": [response], "history": [response]}
         return {"messages": [response]}
     
+    def _prefetch_text(self, state: State):
+        """Tin nhắn của khách nếu đây là lần gọi LLM đầu tiên của lượt, ngược lại None"""
+        last_message = state["messages"][-1] if state["messages"] else None
+        return str(last_message.content) if isinstance(last_message, HumanMessage) else None
+    
+    def llm_node(self, state: State):
+        llm, messages = self._llm_input(state)
+        text = self._prefetch_text(state)
+        pending = self.prefetcher.start(text) if text else {}
+        try:
+            response = llm.invoke(messages)
+        except BaseException:
+            self.prefetcher.collect(pending, None)
+            raise
+        update = self._llm_update(response)
+        if pending:
+            update["prefetched"] = self.prefetcher.collect(pending, response)
+        return update
+    
+    async def allm_node(self, state: State):
+        llm, messages = self._llm_input(state)
+        text = self._prefetch_text(state)
+        pending = self.prefetcher.astart(text) if text else {}
+        try:
+            response = await llm.ainvoke(messages)
+        except BaseException:
+            await self.prefetcher.acollect(pending, None)
+            raise
+        update = self._llm_update(response)
+        if pending:
+            update["prefetched"] = await self.prefetcher.acollect(pending, response)
+        return update
+    
+    @staticmethod
+    def _tool_key(tool_call):
+        """Khóa để nhận ra 2 lời gọi giống nhau (không phân biệt hoa thường, khoảng trắng)"""
+        return tool_call_key(tool_call["name"], tool_call["args"])
+    
+    @staticmethod
+    def _turn_tools(messages):
+        """Tên các tool đã gọi trong lượt hiện tại (sau HumanMessage cuối)"""
+        start = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=-1)
+        return [tc["name"] for m in messages[start + 1:] for tc in getattr(m, "tool_calls", None) or []]
+    
+    def _turn_tool_results(self, messages):
+        """Kết quả (không lỗi) của các tool đã chạy trong lượt hiện tại (sau HumanMessage cuối), theo _tool_key"""
+        start = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=-1)
+        keys, results = {}, {}
+        for message in messages[start + 1:-1]:
+            for tool_call in getattr(message, "tool_calls", None) or []:
+                keys[tool_call["id"]] = self._tool_key(tool_call)
+            if isinstance(message, ToolMessage) and message.tool_call_id in keys and message.status != "error":
+                results[keys[message.tool_call_id]] = message.content
+        return results
+    
+    def _split_tool_calls(self, state: State):
+        """Tách tool call của AIMessage cuối: đã có kết quả trong lượt (trả lại ToolMessage cũ) /
+        đã chạy trước (ToolPrefetcher) / cần chạy"""
+        last_message = state["messages"][-1]
+        results = self._turn_tool_results(state["messages"])
+        prefetched = state.get("prefetched") or {}
+        hits, ready, misses = [], [], []
+        for tool_call in last_message.tool_calls:
+            key = self._tool_key(tool_call)
+            if key in results:
+                metrics.inc("tool_memo_hits_total", tool=tool_call["name"], help="Số lời gọi tool lặp lại trong lượt, dùng lại kết quả")
+                hits.append(ToolMessage(
+                    content=f"{results[key]}\n[Kết quả giống lần gọi trước, hãy trả lời khách bằng thông tin đã có]",
+                    tool_call_id=tool_call["id"], name=tool_call["name"]
+                ))
+            elif key in prefetched:
+                ready.append(ToolMessage(content=prefetched[key], tool_call_id=tool_call["id"], name=tool_call["name"]))
+            else:
+                misses.append(tool_call)
+        return hits, ready, misses
+    
+    def _memo_update(self, state: State, hits, ready, misses, result):
+        order = {tc["id"]: i for i, tc in enumerate(state["messages"][-1].tool_calls)}
+        messages = sorted(hits + ready + (result["messages"] if result else []), key=lambda m: order.get(m.tool_call_id, 0))
+        # Mọi lời gọi đều lặp lại y hệt -> LLM đang lặp: lần gọi tiếp theo bắt trả lời bằng thông tin đã có
+        if hits and not ready and not misses:
+            metrics.inc("tool_loops_total", help="Số lần phát hiện LLM gọi lại tool y hệt")
+            return {"messages": messages, "force_answer": True}
+        return {"messages": messages}
+    
+    def _memo_tool_node(self, tool_node: ToolNode):
+        """Bọc ToolNode: tool call trùng (tool, args) với lời gọi trước trong cùng lượt không chạy lại SQL / RAG"""
+        def run(state: State, config):
+            hits, ready, misses = self._split_tool_calls(state)
+            result = None
+            if misses:
+                result = tool_node.invoke({"messages": [AIMessage(content="", tool_calls=misses)]}, config)
+            return self._memo_update(state, hits, ready, misses, result)
+        
+        async def arun(state: State, config):
+            hits, ready, misses = self._split_tool_calls(state)
+            result = None
+            if misses:
+                result = await tool_node.ainvoke({"messages": [AIMessage(content="", tool_calls=misses)]}, config)
+            return self._memo_update(state, hits, ready, misses, result)
+        
+        return RunnableLambda(run, afunc=arun)
+    
     def _create_rag_tool(self):
         """Tạo RAG tool"""
         @tool
@@ -90,7 +275,8 @@ class ChatController:
             """
             try:
                 # result = self.RAG.search(query)
-                result = self.RAG.search_with_neighbors(query)
+                # result = self.RAG.search_with_neighbors(query)
+                result = self.RAG.search_hybrid(query, with_neighbors=True)
                 if len(result) > 0:
                     return ". ".join(result)
                 else:
@@ -104,6 +290,7 @@ class ChatController:
         last_message = state["messages"][-1]
         # Nếu không có tool calls, kết thúc
         if not hasattr(last_message, "tool_calls") or not last_message.tool_calls:
+            metrics.inc("graph_route_total", route="end")
             return "end"
         print(f"Tool list: {last_message.tool_calls}")
         # Lấy tool call đầu tiên
@@ -113,13 +300,15 @@ class ChatController:
         print(f"Tool được gọi: {tool_name}")
         
         if tool_name == "rag_tool":  # Kiểm tra RAG tool
-            return "rag"
+            route = "rag"
         elif tool_name in self.sensitive_tool_names:
-            return "sensitive_confirm"
+            route = "sensitive_confirm"
         elif tool_name in self.safe_tool_names:
-            return "safe"
+            route = "safe"
         else:
-            return "end"
+            route = "end"
+        metrics.inc("graph_route_total", route=route)
+        return route
     
     def note_sensitive_confirm(self, state: State):
         last_message = state["messages"][-1]
@@ -128,30 +317,46 @@ class ChatController:
         tool_args = first_tool_call["args"]
         print(f"⚠️ Tool nhạy cảm được gọi: {tool_name} với args {tool_args}")
         
-        confirm = input(f"Bạn có chắc chắn muốn sử dụng tool nhạy cảm '{tool_name}' không? (y/n): ").strip().lower()
+        # Dừng graph, lưu checkpoint và chờ client xác nhận qua confirm().
+        # Token = id của tool call nên giữ nguyên khi node chạy lại lúc resume.
+        decision = interrupt({
+            "token": first_tool_call["id"],
+            "tool_name": tool_name,
+            "tool_args": tool_args,
+            "message": f"Bạn có chắc chắn muốn sử dụng tool nhạy cảm '{tool_name}' không?"
+        })
+        approved = decision.get("approved", False) if isinstance(decision, dict) else bool(decision)
         
-        if confirm == "y":
+        if approved:
             # Thực thi tool nhạy cảm
             for tool in self.sensitive_tools:
                 if tool.name == tool_name:
                     try:
                         tool_result = tool.invoke(tool_args)
-                        return {"messages": [ToolMessage(content=str(tool_result), tool_call_id=first_tool_call["id"])]}
+                        return {"messages": [ToolMessage(content=self.formatter.format(tool_result), tool_call_id=first_tool_call["id"])]}
                     except Exception as e:
                         return {"messages": [ToolMessage(content=f"Lỗi khi chạy tool {tool_name}: {e}", tool_call_id=first_tool_call["id"])]}
         else:
             print("❌ Người dùng đã từ chối chạy tool nhạy cảm.")
             # Gửi phản hồi từ chối về cho LLM để xử lý tiếp
-            return {"messages": [AIMessage(content=f"Người dùng đã từ chối sử dụng tool nhạy cảm '{tool_name}'.")]}      
+            return {"messages": [self._rejection_message(first_tool_call)]}
+    
+    def _rejection_message(self, tool_call):
+        return ToolMessage(
+            content=f"Người dùng đã từ chối sử dụng tool nhạy cảm '{tool_call['name']}'.",
+            tool_call_id=tool_call["id"]
+        )
         
     def build_graph(self):
         workflow = StateGraph(State)
         
         # Add nodes
-        workflow.add_node("llm", self.llm_node)
-        workflow.add_node("safe_tools", self.safe_tools_node)
+        # invoke() dùng llm_node, ainvoke() dùng allm_node
+        workflow.add_node("llm", RunnableLambda(self.llm_node, afunc=self.allm_node))
+        # Tool an toàn / RAG: lời gọi lặp lại trong cùng lượt dùng lại kết quả cũ (tool nhạy cảm luôn chạy qua xác nhận)
+        workflow.add_node("safe_tools", self._memo_tool_node(self.safe_tools_node))
         workflow.add_node("sensitive_confirm", self.note_sensitive_confirm)
-        workflow.add_node("rag", self.rag_tools_node)
+        workflow.add_node("rag", self._memo_tool_node(self.rag_tools_node))
         
         # Add edges
         workflow.add_edge("__start__", "llm")
@@ -169,7 +374,7 @@ class ChatController:
         workflow.add_edge("sensitive_confirm", "llm")
         workflow.add_edge("rag", "llm")
         
-        return workflow.compile()
+        return workflow.compile(checkpointer=self.checkpointer)
     
     def get_figure(self, path_plot=os.path.join(PROJECT_DIR, "illustration", "workflow.mmd")):
         graph = self.build_graph().get_graph()
@@ -183,7 +388,10 @@ class ChatController:
         conversation_text = ""
         for msg in messages:
             if isinstance(msg, SystemMessage):
-                continue  # Bỏ qua system message
+                # Bỏ qua system prompt, giữ lại nội dung các bản tóm tắt cũ
+                if "Tóm tắt cuộc hội thoại" in str(msg.content):
+                    conversation_text += f"{msg.content}\n"
+                continue
             elif isinstance(msg, HumanMessage):
                 conversation_text += f"Human: {msg.content}\n"
             elif isinstance(msg, AIMessage):
@@ -206,7 +414,7 @@ class ChatController:
             )
 
             # Gọi LLM để tóm tắt
-            summary_response = self.llm.invoke(summary_prompt)
+            summary_response = self.llm.invoke(summary_prompt, config={"callbacks": self.callbacks, "run_name": "summarize"})
             summary_content = summary_response.content if hasattr(summary_response, 'content') else str(summary_response)
             
             return summary_content
@@ -216,26 +424,47 @@ class ChatController:
             return "Không thể tóm tắt cuộc hội thoại do lỗi hệ thống."
 
         
-    def get_stats(self):
+    def _config(self, session_id: str):
+        """Config cho một lượt chạy graph: mỗi session là một thread trong checkpointer"""
+        config = {"configurable": {"thread_id": session_id}, "recursion_limit": self.recursion_limit}
+        if self.callbacks:
+            config["callbacks"] = self.callbacks
+        if get_trace_id():
+            config["metadata"] = {"trace_id": get_trace_id()}
+        return config
+    
+    def _get_messages(self, session_id: str):
+        snapshot = self.app.get_state(self._config(session_id))
+        return snapshot.values.get("messages", [])
+    
+    def _get_history(self, session_id: str):
+        snapshot = self.app.get_state(self._config(session_id))
+        return snapshot.values.get("history", [])
+        
+    def get_stats(self, session_id: str = "default"):
         """Lấy thống kê về cuộc hội thoại"""
-        current_count = len([msg for msg in self.state["messages"] if not isinstance(msg, SystemMessage)])
-        full_count = len([msg for msg in self.full_chat_history if not isinstance(msg, SystemMessage)])
+        messages = self._get_messages(session_id)
+        current_count = len([msg for msg in messages if not isinstance(msg, SystemMessage)])
+        full_count = len([msg for msg in self._get_history(session_id) if not isinstance(msg, SystemMessage)])
         
         return {
             "current_messages": current_count,
             "full_history_messages": full_count,
             "summary_threshold": self.len_summary,
-            "has_summary": any("Tóm tắt cuộc hội thoại" in str(msg.content) for msg in self.state["messages"] if isinstance(msg, SystemMessage))
+            "has_summary": any("Tóm tắt cuộc hội thoại" in str(msg.content) for msg in messages if isinstance(msg, SystemMessage)),
+            "memory_mode": self.memory_mode,
+            "pending_action": self.get_pending_action(session_id),
+            "tool_output": self.formatter.get_stats()
         }
-    def _perform_summarization(self):
-        """Thực hiện tóm tắt khi cần thiết"""
+    def _perform_summarization(self, session_id: str, summarize: bool = True):
+        """Thực hiện tóm tắt khi cần thiết (summarize=False: chỉ bỏ các messages cũ, không gọi LLM)"""
         try:
-            # Tách system message và các messages khác
+            # Tách system prompt, các bản tóm tắt cũ và các messages khác
             system_msg = None
             other_messages = []
             
-            for msg in self.state["messages"]:
-                if isinstance(msg, SystemMessage):
+            for msg in self._get_messages(session_id):
+                if isinstance(msg, SystemMessage) and system_msg is None:
                     system_msg = msg
                 else:
                     other_messages.append(msg)
@@ -248,6 +477,20 @@ class ChatController:
             messages_to_summarize = other_messages[:-messages_to_keep] if len(other_messages) > messages_to_keep else other_messages[:-2]
             messages_to_keep_list = other_messages[-messages_to_keep:] if len(other_messages) > messages_to_keep else other_messages[-2:]
             
+            # Không để ToolMessage mồ côi (thiếu AIMessage gọi tool) ở đầu phần giữ lại
+            while messages_to_keep_list and isinstance(messages_to_keep_list[0], ToolMessage):
+                messages_to_summarize.append(messages_to_keep_list.pop(0))
+            
+            if not summarize:
+                # Các lượt cũ đã có trong SemanticMemory, được tra cứu lại khi liên quan
+                new_messages = [system_msg] + messages_to_keep_list
+                self.app.update_state(
+                    self._config(session_id),
+                    {"messages": [RemoveMessage(id=REMOVE_ALL_MESSAGES)] + new_messages}
+                )
+                print(f"✂️ Đã bỏ {len(messages_to_summarize)} messages cũ khỏi context (tra cứu lại qua semantic memory)")
+                return
+            
             # Tóm tắt phần cũ
             summary_content = self._summarize_conversation(messages_to_summarize)
                    
@@ -258,66 +501,221 @@ class ChatController:
             
             # Cập nhật state với: system_prompt + summary + messages gần nhất
             new_messages = [system_msg, summary_message] + messages_to_keep_list
-            self.state["messages"] = new_messages
+            self.app.update_state(
+                self._config(session_id),
+                {"messages": [RemoveMessage(id=REMOVE_ALL_MESSAGES)] + new_messages}
+            )
             
             print(f"✅ Đã tóm tắt {len(messages_to_summarize)} messages thành 1 summary message")
-            print(f"📊 Số messages hiện tại: {len(self.state['messages'])}")
+            print(f"📊 Số messages hiện tại: {len(new_messages)}")
             
         except Exception as e:
             print(f"❌ Lỗi khi thực hiện tóm tắt: {e}")
             
-    def _should_summarize(self):
+    def _should_summarize(self, session_id: str):
         """Kiểm tra xem có nên tóm tắt không"""
         # Đếm số messages (trừ system message)
-        message_count = len([msg for msg in self.state["messages"] if not isinstance(msg, SystemMessage)])
+        message_count = len([msg for msg in self._get_messages(session_id) if not isinstance(msg, SystemMessage)])
         return message_count >= self.len_summary
     
-    def get_full_history(self):
+    def get_full_history(self, session_id: str = "default"):
         """Lấy toàn bộ lịch sử chat (chưa tóm tắt)"""
-        return self.full_chat_history
+        history = self._get_history(session_id)
+        return [SystemMessage(content=self.system_prompt)] + history if history else []
     
-    def get_current_state(self):
+    def get_current_state(self, session_id: str = "default"):
         """Lấy state hiện tại (đã tóm tắt nếu cần)"""
-        return self.state["messages"]
+        return self._get_messages(session_id)
     
-    def reset_conversation(self):
+    def get_message_trace(self, session_id: str = "default"):
+        """Toàn bộ message trong state (kể cả tool call / tool result) dạng dict, dùng cho debug"""
+        return messages_to_dict(self._get_messages(session_id))
+    
+    def reset_conversation(self, session_id: str = "default"):
         """Reset cuộc hội thoại"""
-        self.state = {"messages": [SystemMessage(content=self.system_prompt)]}
-        self.full_chat_history = [SystemMessage(content=self.system_prompt)]
+        self.checkpointer.delete_thread(session_id)
+        self.memory.clear(session_id)
         print("✅ Đã reset cuộc hội thoại")     
+    
+    def get_pending_action(self, session_id: str = "default"):
+        """Lấy thao tác nhạy cảm đang chờ xác nhận (nếu có)"""
+        snapshot = self.app.get_state(self._config(session_id))
+        for intr in snapshot.interrupts:
+            return intr.value
+        return None
+    
+    async def aget_pending_action(self, session_id: str = "default"):
+        snapshot = await self.app.aget_state(self._config(session_id))
+        for intr in snapshot.interrupts:
+            return intr.value
+        return None
+    
+    def _reject_pending(self, session_id: str, pending: dict):
+        """Khách gửi tin nhắn mới thay vì xác nhận -> coi như từ chối thao tác đang chờ"""
+        last_message = self._get_messages(session_id)[-1]
+        tool_call = next(tc for tc in last_message.tool_calls if tc["id"] == pending["token"])
+        self.app.update_state(
+            self._config(session_id),
+            {"messages": [self._rejection_message(tool_call)]},
+            as_node="sensitive_confirm"
+        )
+    
+    def _finish_turn(self, session_id: str, result, remember: bool = True):
+        """Xử lý kết quả sau một lượt chạy graph (kết thúc hoặc đang chờ xác nhận)"""
+        pending = self.get_pending_action(session_id)
+        if pending is not None:
+            return pending["message"]
+        
+        last_message = result["messages"][-1]
+        if isinstance(last_message, AIMessage):
+            bot_response = last_message.content
+            
+            # Lưu lượt này vào bộ nhớ dài hạn (embed ở thread nền)
+            user_message = next((m for m in reversed(result.get("history", [])) if isinstance(m, HumanMessage)), None)
+            if remember and user_message is not None and isinstance(bot_response, str):
+                self.memory.add(session_id, user_message.content, bot_response, tools=self._turn_tools(result["messages"]))
+
+            # Kiểm tra và thực hiện tóm tắt nếu cần
+            if self._should_summarize(session_id):
+                if self.memory_mode == "semantic":
+                    with metrics.timer("context_trim"):
+                        self._perform_summarization(session_id, summarize=False)
+                else:
+                    print("🔄 Đang thực hiện tóm tắt lịch sử chat...")
+                    with metrics.timer("summarization"):
+                        self._perform_summarization(session_id)
+            
+            # Dọn các checkpoint cũ của session, chỉ giữ lại vài checkpoint gần nhất
+            if hasattr(self.checkpointer, "prune"):
+                with metrics.timer("checkpoint_prune"):
+                    self.checkpointer.prune(thread_id=session_id)
+            
+            return bot_response
+        else:
+            return "Xin lỗi, tôi không thể xử lý yêu cầu này."
+        
+    def _prepare_turn(self, session_id: str, user_input: str):
+        """Input cho graph của một lượt mới (từ chối thao tác đang chờ nếu có)"""
+        pending = self.get_pending_action(session_id)
+        if pending is not None:
+            self._reject_pending(session_id, pending)
+        
+        # Thêm user message vào state (session mới thì kèm system prompt)
+        messages = self._get_messages(session_id)
+        user_message = HumanMessage(content=user_input)
+        new_messages = [user_message]
+        if not messages:
+            new_messages = [SystemMessage(content=self.system_prompt)] + new_messages
+        return {
+            "messages": new_messages,
+            "history": [user_message],
+            "recalled": self._recall(session_id, user_input, messages),
+            "force_answer": False,
+            "prefetched": {}
+        }
+    
+    def _knowledge_turn(self, session_id: str, user_input: str):
+        """Trả lời từ knowledge_base (không chạy graph) nếu có câu trả lời đã xác nhận, ngược lại trả về None"""
+        if not self.knowledge_shortcut or self.get_pending_action(session_id) is not None:
+            return None
+        try:
+            with metrics.timer("knowledge_lookup"):
+                hit = self.knowledge.lookup(user_input)
+        except Exception as e:
+            print(f"❌ Lỗi khi tra cứu knowledge base: {e}")
+            return None
+        if hit is None:
+            return None
+        print(f"📚 Trả lời từ knowledge base (KnowledgeId={hit['knowledge_id']}, score={hit['score']})")
+        
+        # Ghi lượt này vào state như một câu trả lời của node llm để hội thoại tiếp tục bình thường
+        user_message = HumanMessage(content=user_input)
+        ai_message = AIMessage(content=hit["answer"])
+        new_messages = [user_message, ai_message]
+        if not self._get_messages(session_id):
+            new_messages = [SystemMessage(content=self.system_prompt)] + new_messages
+        self.app.update_state(
+            self._config(session_id),
+            {"messages": new_messages, "history": [user_message, ai_message]},
+            as_node="llm"
+        )
+        # Không ghi vào SemanticMemory: chat_memory là nguồn để mine(), lượt lấy từ knowledge base không phải xác nhận mới
+        return self._finish_turn(session_id, {"messages": [ai_message], "history": [user_message, ai_message]}, remember=False)
+    
+    def _recall(self, session_id: str, user_input: str, messages: List):
+        """Các lượt cũ (đã ra khỏi context) liên quan tới tin nhắn mới, dạng text để chèn vào prompt"""
+        if self.memory_mode == "summary" or self.memory_top_k <= 0:
+            return ""
+        try:
+            in_context = {m.content for m in messages if isinstance(m, HumanMessage)}
+            with metrics.timer("memory_recall"):
+                turns = self.memory.search(session_id, user_input, k=self.memory_top_k, exclude=in_context)
+        except Exception as e:
+            print(f"❌ Lỗi khi tra cứu bộ nhớ hội thoại: {e}")
+            return ""
+        if not turns:
+            return ""
+        lines = [f"- Khách: {t['user_message']}\n  Trợ lý: {t['bot_response']}" for t in turns]
+        return "[Các lượt hội thoại trước có liên quan]:\n" + "\n".join(lines)
+    
+    def _check_confirm(self, pending, session_id: str, token: str):
+        if pending is None:
+            raise ValueError(f"Session '{session_id}' không có thao tác nào đang chờ xác nhận")
+        if pending["token"] != token:
+            raise ValueError("Token xác nhận không hợp lệ hoặc đã hết hạn")
+    
+    def _run_error(self, e):
+        print(f"❌ Lỗi trong quá trình chạy: {e}")
+        metrics.inc("errors_total", component="controller", error=type(e).__name__)
+        return f"Xin lỗi, đã xảy ra lỗi: {str(e)}"
         
-    def run(self, user_input: str):
+    def run(self, user_input: str, session_id: str = "default"):
         """Chạy workflow với input từ người dùng"""
         try:
-            # Thêm user message vào state
-            user_message = HumanMessage(content=user_input)
-            self.state["messages"].append(user_message)
-            
-            # Lưu vào full history
-            self.full_chat_history.append(user_message)
+            config = self._config(session_id)
+            answer = self._knowledge_turn(session_id, user_input)
+            if answer is not None:
+                return answer
             
             # Chạy workflow
-            result = self.app.invoke(self.state, {"recursion_limit": 10})
-            last_message = result["messages"][-1]
-            
-            if isinstance(last_message, AIMessage):
-                bot_response = last_message.content
-                
-                # Cập nhật state
-                self.state = result
-                
-                # Lưu response vào full history
-                self.full_chat_history.extend([msg for msg in result["messages"][1:] if ((msg not in self.full_chat_history) and (isinstance(msg, HumanMessage) or isinstance(msg, AIMessage)))])
-
-                # Kiểm tra và thực hiện tóm tắt nếu cần
-                if self._should_summarize():
-                    print("🔄 Đang thực hiện tóm tắt lịch sử chat...")
-                    self._perform_summarization()
-                
-                return bot_response
-            else:
-                return "Xin lỗi, tôi không thể xử lý yêu cầu này."
+            result = self.app.invoke(self._prepare_turn(session_id, user_input), config)
+            return self._finish_turn(session_id, result)
+        except Exception as e:
+            return self._run_error(e)
+    
+    def confirm(self, session_id: str, token: str, approved: bool = True):
+        """Tiếp tục lượt chạy đang chờ xác nhận tool nhạy cảm (resume từ checkpoint)"""
+        self._check_confirm(self.get_pending_action(session_id), session_id, token)
+        
+        try:
+            result = self.app.invoke(Command(resume={"approved": approved}), self._config(session_id))
+            return self._finish_turn(session_id, result)
+        except Exception as e:
+            return self._run_error(e)
+    
+    # ----------- ASYNC (FastAPI) -----------
+    # Graph chạy bằng ainvoke: LLM gọi qua ainvoke, tool DB chạy qua AsyncDatabase,
+    # phần việc đồng bộ còn lại (đọc/ghi state, tóm tắt, prune) chạy trong thread pool
+    async def arun(self, user_input: str, session_id: str = "default"):
+        """Bản async của run(), không chặn event loop"""
+        try:
+            config = self._config(session_id)
+            answer = await asyncio.to_thread(traced(self._knowledge_turn), session_id, user_input)
+            if answer is not None:
+                return answer
+            graph_input = await asyncio.to_thread(traced(self._prepare_turn), session_id, user_input)
+            result = await self.app.ainvoke(graph_input, config)
+            return await asyncio.to_thread(traced(self._finish_turn), session_id, result)
+        except Exception as e:
+            return self._run_error(e)
+    
+    async def aconfirm(self, session_id: str, token: str, approved: bool = True):
+        """Bản async của confirm()"""
+        self._check_confirm(await self.aget_pending_action(session_id), session_id, token)
+        
+        try:
+            result = await self.app.ainvoke(Command(resume={"approved": approved}), self._config(session_id))
+            return await asyncio.to_thread(traced(self._finish_turn), session_id, result)
         except Exception as e:
-            print(f"❌ Lỗi trong quá trình chạy: {e}")
-            return f"Xin lỗi, đã xảy ra lỗi: {str(e)}"
+            return self._run_error(e)
         
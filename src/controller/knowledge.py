@@ -0,0 +1,346 @@
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import numpy as np
+from ..chatTools.embedding_batcher import EmbeddingBatcher
+from ..utils import apply_migrations, metrics, encode_vector, load_matrix, top_k
+from ..utils.tools import db_path
+
+# Câu trả lời không dùng lại được: lỗi, hỏi xác nhận tool nhạy cảm, từ chối
+_NOT_ANSWERS = ("Xin lỗi", "Bạn có chắc chắn muốn", "Người dùng đã từ chối")
+# Thông tin riêng của khách (email, số điện thoại, đơn hàng, giỏ hàng) -> không đưa vào knowledge base
+_PERSONAL = re.compile(
+    r"[\w.+-]+@[\w-]+\.[\w.]+|\b0\d{9,10}\b|đơn (hàng )?(số |#)?\d+|giỏ hàng của|customer_id",
+    re.IGNORECASE
+)
+# Câu trả lời có giá, tồn kho -> thay đổi theo thời gian / theo khách, không dùng lại
+_VOLATILE = re.compile(
+    r"\d[\d.,]*\s*(đ\b|₫|vnđ|vnd|triệu|nghìn|ngàn|k\b)|còn \d+|tồn kho|hết hàng|còn hàng",
+    re.IGNORECASE
+)
+# Câu hỏi phụ thuộc các lượt trước ("sản phẩm này", "cái đó", "thế còn ...") -> không trả lời ngoài ngữ cảnh
+_FOLLOW_UP = re.compile(
+    r"\b(này|đó|kia|ấy|nó|vậy|vừa rồi|vừa nãy|lúc nãy|ở trên|thế còn|còn .+ thì sao|cái khác)\b",
+    re.IGNORECASE
+)
+# Tool chỉ đọc thông tin chung của cửa hàng: lượt chỉ gọi các tool này vẫn dùng lại được
+_STATIC_TOOLS = {"rag_tool"}
+
+
+class KnowledgeBase:
+    """Knowledge base các câu hỏi đã được trả lời: câu hỏi trùng nghĩa được trả lời ngay, không chạy RAG + LLM.
+
+    - mine(): đọc các lượt mới của chat_memory (theo MemoryId), bỏ lượt lỗi / có thông tin riêng của khách /
+      trả lời từ kết quả tool (sản phẩm, giá, tồn kho, đơn hàng) / câu hỏi phụ thuộc lượt trước, gộp câu hỏi
+      trùng nghĩa (ConfirmCount). Dòng mới luôn ở trạng thái chờ duyệt (IsActive = 0), chỉ bật bằng approve
+    - LastId được dời trong cùng transaction BEGIN IMMEDIATE với việc đối chiếu / thêm dòng mới: encode hoặc ghi lỗi
+      thì trang chưa bị đánh dấu là đã mine. Nhiều worker cùng mine: worker commit sau thấy LastId đã đổi thì bỏ
+      kết quả của trang đó, nên mỗi trang chỉ được ghi 1 lần và không trùng dòng
+    - lookup(): cosine giữa câu hỏi mới và Title của các dòng đang bật (ma trận NumPy trong RAM, nạp lại khi
+      knowledge_base thay đổi); dòng lấy từ hội thoại quá max_age_days không cập nhật thì không dùng nữa
+      (giá / tồn kho có thể đã đổi), dòng nhập tay (SourceType = manual) không hết hạn
+    - UseCount được cộng dồn trong RAM rồi ghi theo batch ở thread nền (trigger update_knowledge_usage cập nhật LastUsedAt)
+    - Sau khi fork (gunicorn preload) connection, bộ đếm và thread nền được tạo lại trong worker
+    """
+    _instance = None
+
+    def __init__(self, encoder=None, DB_PATH: str = db_path, model_name: str = None, match_threshold: float = None,
+                 answer_threshold: float = 0.8, min_confirmations: int = None, max_age_days: float = None,
+                 refresh_interval: float = 5.0, flush_interval: float = 1.0):
+        self.encoder = encoder or EmbeddingBatcher.get_instance()
+        self.db_path = DB_PATH
+        self.model_name = model_name or os.getenv("MEMORY_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+        self.match_threshold = match_threshold or float(os.getenv("KB_MATCH_THRESHOLD", 0.9))
+        self.answer_threshold = answer_threshold
+        self.min_confirmations = min_confirmations or int(os.getenv("KB_MIN_CONFIRMATIONS", 2))
+        self.max_age_days = max_age_days if max_age_days is not None else float(os.getenv("KB_MAX_AGE_DAYS", 7))
+        self.refresh_interval = refresh_interval
+        self.flush_interval = flush_interval
+
+        apply_migrations(self.db_path)
+        self._init_process_state()
+
+    def _init_process_state(self):
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._mine_lock = threading.Lock()
+        self._usage = {}  # KnowledgeId -> số lần dùng chưa ghi
+        self._index = None  # (ids, answers, matrix)
+        self._index_version = None
+        self._index_checked = 0.0
+        self._stop = threading.Event()
+        self._flusher = None
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._init_process_state()
+
+    @property
+    def conn(self):
+        self._check_pid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _encode(self, texts):
+        vectors = np.asarray(self.encoder.encode(texts), dtype=np.float32).reshape(len(texts), -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    @staticmethod
+    def _is_reusable(question: str, answer: str, tools_used=None):
+        # tools_used NULL (lượt ghi trước migration 010) = không rõ câu trả lời lấy từ đâu -> bỏ
+        if tools_used is None or not set(filter(None, tools_used.split(","))) <= _STATIC_TOOLS:
+            return False
+        return (
+            len(question.split()) >= 4 and len(answer.strip()) >= 20
+            and not answer.startswith(_NOT_ANSWERS)
+            and not _PERSONAL.search(question) and not _PERSONAL.search(answer)
+            and not _VOLATILE.search(answer) and not _FOLLOW_UP.search(question)
+        )
+
+    # ----------- NẠP TỪ HỘI THOẠI -----------
+    def _read_page(self, conn, batch_size):
+        """Trang chat_memory tiếp theo chưa mine: (LastId lúc đọc, các dòng). Chưa dời LastId"""
+        row = conn.execute("SELECT LastId FROM knowledge_mining_state WHERE Source = 'chat_memory'").fetchone()
+        start = row[0] if row else 0
+        page = conn.execute(
+            "SELECT MemoryId, UserMessage, BotResponse, ToolsUsed FROM chat_memory WHERE MemoryId > ? "
+            "ORDER BY MemoryId LIMIT ?", (start, batch_size)
+        ).fetchall()
+        return start, page
+
+    def _claim_page(self, conn, start, last_id):
+        """Dời LastId từ start sang last_id trong transaction đang mở (BEGIN IMMEDIATE).
+        False nếu worker khác đã mine trang này trước (LastId đã đổi)"""
+        row = conn.execute("SELECT LastId FROM knowledge_mining_state WHERE Source = 'chat_memory'").fetchone()
+        if (row[0] if row else 0) != start:
+            return False
+        conn.execute(
+            "INSERT INTO knowledge_mining_state (Source, LastId) VALUES ('chat_memory', ?) "
+            "ON CONFLICT(Source) DO UPDATE SET LastId = excluded.LastId, UpdatedAt = CURRENT_TIMESTAMP",
+            (last_id,)
+        )
+        return True
+
+    def _load_mined(self, conn):
+        ids, titles, extra = load_matrix("knowledge_base", model=self.model_name, conn=conn,
+                                         column="TitleEmbedding", extra=("ConfirmCount",))
+        answer_ids, answers = load_matrix("knowledge_base", where="TitleEmbedding IS NOT NULL",
+                                          model=self.model_name, conn=conn)
+        answer_by_id = dict(zip(answer_ids.tolist(), answers))
+        keep = [i for i, kid in enumerate(ids.tolist()) if kid in answer_by_id]
+        if not keep:
+            return [], None, [], []
+        return ([int(ids[i]) for i in keep], titles[keep], [answer_by_id[int(ids[i])] for i in keep],
+                [extra[i][0] or 1 for i in keep])
+
+    def mine(self, batch_size: int = 500):
+        """Đưa các lượt mới của chat_memory vào knowledge_base (chờ duyệt), trả về (số câu hỏi mới, số lần xác nhận)"""
+        added = confirmed = 0
+        with self._mine_lock:
+            conn = self.conn
+            while True:
+                start, page = self._read_page(conn, batch_size)
+                if not page:
+                    break
+                turns = [(q, a) for _, q, a, tools in page if self._is_reusable(q, a, tools)]
+                # Encode ngoài transaction để không giữ khóa ghi của store.db
+                if turns:
+                    with metrics.timer("embed", help="Thời gian encode embedding", kind="knowledge"):
+                        vectors = self._encode([q for q, _ in turns] + [a for _, a in turns])
+
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    # LastId chỉ được dời cùng transaction với các dòng mới: lỗi ở bất kỳ bước nào thì trang
+                    # vẫn chưa mine, lần sau đọc lại. Worker khác đã mine trang này -> bỏ kết quả, đọc trang tiếp
+                    if not self._claim_page(conn, start, page[-1][0]):
+                        conn.rollback()
+                        continue
+                    page_added = page_confirmed = 0
+                    # Đọc lại trong transaction: thấy cả các dòng worker khác vừa thêm
+                    ids, titles, answers, confirms = self._load_mined(conn) if turns else ([], None, [], [])
+                    for (question, answer), q_vec, a_vec in zip(turns, vectors[:len(turns)], vectors[len(turns):]):
+                        scores = titles @ q_vec if titles is not None else np.zeros(0)
+                        j = int(np.argmax(scores)) if len(scores) else -1
+                        if j >= 0 and scores[j] >= self.match_threshold:
+                            # Câu trả lời khác hẳn câu đã lưu -> chưa chắc chắn, không tính là xác nhận
+                            if float(answers[j] @ a_vec) < self.answer_threshold:
+                                continue
+                            confirms[j] += 1
+                            page_confirmed += 1
+                            conn.execute(
+                                "UPDATE knowledge_base SET ConfirmCount = ?, UpdatedAt = CURRENT_TIMESTAMP "
+                                "WHERE KnowledgeId = ?", (confirms[j], ids[j])
+                            )
+                            continue
+                        ids.append(self._insert(conn, question, answer, q_vec, a_vec, "conversation", active=False))
+                        titles = q_vec[None, :] if titles is None else np.vstack([titles, q_vec])
+                        answers.append(a_vec)
+                        confirms.append(1)
+                        page_added += 1
+                    conn.commit()
+                except BaseException:
+                    conn.rollback()
+                    raise
+                added += page_added
+                confirmed += page_confirmed
+        if added or confirmed:
+            print(f"✅ Knowledge base: thêm {added} câu hỏi chờ duyệt, {confirmed} lần xác nhận")
+        return added, confirmed
+
+    def pending(self, limit: int = 50):
+        """Các dòng lấy từ hội thoại đang chờ duyệt, nhiều lần xác nhận trước"""
+        return self.conn.execute(
+            "SELECT KnowledgeId, ConfirmCount, Title, Content FROM knowledge_base "
+            "WHERE SourceType = 'conversation' AND IsActive = 0 AND ConfirmCount >= ? "
+            "ORDER BY ConfirmCount DESC, KnowledgeId LIMIT ?", (self.min_confirmations, limit)
+        ).fetchall()
+
+    def _insert(self, conn, question, answer, q_vec, a_vec, source_type, active):
+        return conn.execute(
+            "INSERT INTO knowledge_base (Title, Content, TitleEmbedding, ContentEmbedding, EmbeddingModel, SourceType, "
+            "Category, IsActive) VALUES (?, ?, ?, ?, ?, ?, 'faq', ?)",
+            (question, answer, encode_vector(q_vec, "float16", self.model_name),
+             encode_vector(a_vec, "float16", self.model_name), self.model_name, source_type, int(active))
+        ).lastrowid
+
+    def add(self, question: str, answer: str):
+        """Thêm 1 cặp hỏi / đáp nhập tay (bật ngay, không hết hạn)"""
+        q_vec, a_vec = self._encode([question, answer])
+        with self.conn as conn:
+            knowledge_id = self._insert(conn, question, answer, q_vec, a_vec, "manual", active=True)
+        self._index_checked = 0.0
+        return knowledge_id
+
+    def set_active(self, knowledge_id: int, active: bool = True):
+        with self.conn as conn:
+            conn.execute(
+                "UPDATE knowledge_base SET IsActive = ?, UpdatedAt = CURRENT_TIMESTAMP WHERE KnowledgeId = ?",
+                (int(active), knowledge_id)
+            )
+        self._index_checked = 0.0
+
+    # ----------- TRA CỨU -----------
+    def _active_filter(self):
+        return (
+            "IsActive = 1 AND EmbeddingModel = ? AND TitleEmbedding IS NOT NULL "
+            "AND (SourceType != 'conversation' OR UpdatedAt >= datetime('now', ?))",
+            (self.model_name, f"-{self.max_age_days} days")
+        )
+
+    def _load_index(self):
+        """Ma trận Title của các dòng đang bật, chỉ nạp lại khi knowledge_base thay đổi"""
+        self._check_pid()
+        now = time.monotonic()
+        if self._index is not None and now - self._index_checked < self.refresh_interval:
+            return self._index
+        where, params = self._active_filter()
+        conn = self.conn
+        version = conn.execute(
+            f"SELECT COUNT(*), MAX(KnowledgeId), MAX(UpdatedAt) FROM knowledge_base WHERE {where}", params
+        ).fetchone()
+        if version != self._index_version:
+            ids, matrix, extra = load_matrix("knowledge_base", where=where, params=params, conn=conn,
+                                             column="TitleEmbedding", extra=("Content",))
+            self._index = (ids.tolist(), [r[0] for r in extra], matrix if len(ids) else None)
+            self._index_version = version
+        self._index_checked = now
+        return self._index
+
+    def lookup(self, question: str):
+        """Câu trả lời đã xác nhận cho câu hỏi trùng nghĩa: {knowledge_id, answer, score} hoặc None"""
+        ids, contents, matrix = self._load_index()
+        # Câu hỏi nối tiếp lượt trước cần ngữ cảnh của session -> để graph trả lời
+        if matrix is None or not question.strip() or _FOLLOW_UP.search(question):
+            metrics.inc("knowledge_lookup_total", result="miss", help="Số lần tra cứu knowledge base")
+            return None
+        rows, scores = top_k(matrix, self._encode([question])[0], k=1)
+        best, score = int(rows[0]), float(scores[0])
+        if score < self.match_threshold:
+            metrics.inc("knowledge_lookup_total", result="miss", help="Số lần tra cứu knowledge base")
+            return None
+        metrics.inc("knowledge_lookup_total", result="hit", help="Số lần tra cứu knowledge base")
+        self._record_use(ids[best])
+        return {"knowledge_id": ids[best], "answer": contents[best], "score": round(score, 4)}
+
+    # ----------- USECOUNT (ghi theo batch) -----------
+    def _record_use(self, knowledge_id: int):
+        with self._lock:
+            self._usage[knowledge_id] = self._usage.get(knowledge_id, 0) + 1
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run_flusher, name="knowledge-usage", daemon=True)
+                self._flusher.start()
+
+    def _run_flusher(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Lỗi khi ghi UseCount của knowledge base: {e}")
+
+    def flush(self):
+        """Ghi các lần dùng đang chờ trong 1 transaction, trả về số dòng đã cập nhật"""
+        self._check_pid()
+        with self._lock:
+            usage, self._usage = self._usage, {}
+        if not usage:
+            return 0
+        with self.conn as conn:
+            conn.executemany(
+                "UPDATE knowledge_base SET UseCount = UseCount + ? WHERE KnowledgeId = ?",
+                [(count, knowledge_id) for knowledge_id, count in usage.items()]
+            )
+        return len(usage)
+
+    def start_miner(self, interval: float = None):
+        """Chạy mine() định kỳ ở thread nền (KB_MINE_INTERVAL_SECONDS, 0 = tắt)"""
+        interval = interval if interval is not None else float(os.getenv("KB_MINE_INTERVAL_SECONDS", 0))
+        if interval <= 0:
+            return
+        threading.Thread(target=self._run_miner, args=(interval,), name="knowledge-miner", daemon=True).start()
+
+    def _run_miner(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.mine()
+            except Exception as e:
+                print(f"❌ Lỗi khi nạp knowledge base từ hội thoại: {e}")
+
+    def close(self):
+        """Dừng thread nền và ghi nốt UseCount (gọi khi tắt server)"""
+        self._stop.set()
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"❌ Lỗi khi ghi UseCount của knowledge base: {e}")
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+
+if __name__ == "__main__":
+    # python -m src.controller.knowledge mine | pending | add "<câu hỏi>" "<câu trả lời>" | approve <id> | disable <id>
+    command = sys.argv[1] if len(sys.argv) > 1 else "mine"
+    kb = KnowledgeBase(encoder=EmbeddingBatcher(enabled=False))
+    if command == "mine":
+        kb.mine()
+    elif command == "pending":
+        for knowledge_id, confirm_count, title, content in kb.pending():
+            print(f"[{knowledge_id}] x{confirm_count} {title}\n    -> {content[:200]}")
+    elif command == "add":
+        print(f"✅ Đã thêm KnowledgeId = {kb.add(sys.argv[2], sys.argv[3])}")
+    elif command in ("approve", "disable"):
+        kb.set_active(int(sys.argv[2]), active=command == "approve")
+    else:
+        sys.exit(f"Lệnh không hợp lệ: {command}")
@@ -0,0 +1,179 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+from ..chatTools.embedding_batcher import EmbeddingBatcher
+from ..utils import apply_migrations, metrics, encode_vector, load_matrix
+from ..utils.tools import db_path
+
+
+class SemanticMemory:
+    """Bộ nhớ dài hạn theo session: tra cứu lại các lượt hội thoại cũ liên quan tới tin nhắn mới.
+
+    - Mỗi lượt (câu hỏi + câu trả lời cuối) được embed ở thread nền (gom batch) rồi ghi vào chat_memory
+    - Mỗi session giữ 1 ma trận NumPy (đã chuẩn hóa) trong RAM, chỉ nạp thêm các dòng mới (MemoryId > cuối)
+      nên worker khác ghi vào vẫn thấy được; số dòng trong DB ít hơn trong RAM (worker khác clear session)
+      thì nạp lại từ đầu; giữ tối đa max_sessions session gần nhất (LRU)
+    - search(): cosine = ma trận @ vector câu hỏi, lấy top-k bằng argpartition
+    - Sau khi fork (gunicorn preload) connection, buffer và thread nền được tạo lại trong worker
+    """
+    _instance = None
+
+    def __init__(self, encoder=None, DB_PATH: str = db_path, model_name: str = None, vector_dtype: str = "float16",
+                 flush_interval: float = 0.5, max_sessions: int = 256):
+        # Câu hỏi tra cứu (1 câu) được gom batch với query RAG của các request khác
+        self.encoder = encoder or EmbeddingBatcher.get_instance()
+        self.db_path = DB_PATH
+        self.model_name = model_name or os.getenv("MEMORY_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+        self.vector_dtype = vector_dtype  # định dạng lưu BLOB (utils/vector_codec.py)
+        self.flush_interval = flush_interval
+        self.max_sessions = max_sessions
+
+        apply_migrations(self.db_path)
+        self._init_process_state()
+
+    def _init_process_state(self):
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._sessions_lock = threading.Lock()
+        self._pending = []  # [(session_id, user_message, bot_response, tools_used)]
+        self._sessions = OrderedDict()  # session_id -> {"last_id", "turns", "matrix"}
+        self._stop = threading.Event()
+        self._flusher = None
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._init_process_state()
+
+    @property
+    def conn(self):
+        self._check_pid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _encode(self, texts):
+        vectors = np.asarray(self.encoder.encode(texts), dtype=np.float32).reshape(len(texts), -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    @staticmethod
+    def _turn_text(user_message, bot_response):
+        return f"{user_message}\n{bot_response}"
+
+    # ----------- GHI (embed ở thread nền) -----------
+    def add(self, session_id: str, user_message: str, bot_response: str, tools=None):
+        """Đưa 1 lượt hội thoại vào hàng đợi embed, không chặn lượt chat hiện tại.
+        tools: tên các tool đã gọi trong lượt (None = không rõ)"""
+        if not user_message or not bot_response:
+            return
+        self._check_pid()
+        tools_used = None if tools is None else ",".join(sorted(set(tools)))
+        with self._lock:
+            self._pending.append((session_id, user_message, bot_response, tools_used))
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run_flusher, name="memory-embed", daemon=True)
+                self._flusher.start()
+
+    def _run_flusher(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Lỗi khi embed bộ nhớ hội thoại: {e}")
+
+    def flush(self):
+        """Embed và ghi toàn bộ hàng đợi trong 1 batch, trả về số lượt đã ghi"""
+        self._check_pid()
+        with self._write_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return 0
+            with metrics.timer("embed", help="Thời gian encode embedding", kind="memory"):
+                vectors = self._encode([self._turn_text(u, b) for _, u, b, _ in pending])
+            conn = self.conn
+            with conn:
+                conn.executemany(
+                    "INSERT INTO chat_memory (SessionId, UserMessage, BotResponse, ContentEmbedding, EmbeddingModel, "
+                    "ToolsUsed) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(sid, u, b, encode_vector(vec, self.vector_dtype, self.model_name), self.model_name, tools)
+                     for (sid, u, b, tools), vec in zip(pending, vectors)]
+                )
+        return len(pending)
+
+    # ----------- ĐỌC -----------
+    def _session(self, session_id: str):
+        """(turns, matrix) của session, chỉ nạp thêm các dòng mới từ DB"""
+        with self._sessions_lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = {"last_id": 0, "turns": [], "matrix": None}
+                self._sessions[session_id] = entry
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+            conn = self.conn
+            # Dòng đã bị xóa (clear() ở worker khác) -> bỏ cache, nạp lại toàn bộ
+            (count,) = conn.execute(
+                "SELECT COUNT(*) FROM chat_memory WHERE SessionId = ? AND MemoryId <= ? AND EmbeddingModel = ?",
+                (session_id, entry["last_id"], self.model_name)
+            ).fetchone()
+            if count < len(entry["turns"]):
+                entry.update(last_id=0, turns=[], matrix=None)
+
+            ids, new, turns = load_matrix("chat_memory", where="SessionId = ? AND MemoryId > ?",
+                                          params=(session_id, entry["last_id"]), model=self.model_name, conn=conn,
+                                          extra=("UserMessage", "BotResponse"))
+            if len(ids):
+                entry["matrix"] = new if entry["matrix"] is None else np.vstack([entry["matrix"], new])
+                entry["turns"] = entry["turns"] + turns
+                entry["last_id"] = int(ids[-1])
+            return entry["turns"], entry["matrix"]
+
+    def search(self, session_id: str, query: str, k: int = 3, min_score: float = 0.3, exclude=()):
+        """Top-k lượt cũ liên quan tới query (theo thứ tự thời gian), bỏ các lượt có câu hỏi nằm trong exclude
+        (vd: các lượt còn trong context). Trả về [{user_message, bot_response, score}]"""
+        turns, matrix = self._session(session_id)
+        if not turns or k <= 0:
+            return []
+
+        with metrics.timer("memory_search", help="Thời gian tra cứu bộ nhớ hội thoại"):
+            scores = matrix @ self._encode([query])[0]
+            if exclude:
+                scores[[i for i, (u, _) in enumerate(turns) if u in exclude]] = -np.inf
+            top = np.flatnonzero(scores >= min_score)
+            if k < len(top):
+                top = top[np.argpartition(-scores[top], k - 1)[:k]]
+        return [
+            {"user_message": turns[i][0], "bot_response": turns[i][1], "score": round(float(scores[i]), 4)}
+            for i in sorted(top)
+        ]
+
+    def clear(self, session_id: str):
+        self.flush()
+        with self.conn as conn:
+            conn.execute("DELETE FROM chat_memory WHERE SessionId = ?", (session_id,))
+        with self._sessions_lock:
+            self._sessions.pop(session_id, None)
+
+    def close(self):
+        """Dừng thread nền và ghi nốt hàng đợi (gọi khi tắt server)"""
+        self._stop.set()
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"❌ Lỗi khi embed bộ nhớ hội thoại: {e}")
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
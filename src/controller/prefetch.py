@@ -0,0 +1,130 @@
+import asyncio
+import contextvars
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from langgraph.prebuilt.tool_node import msg_content_output
+from ..utils import ProductCatalog, metrics
+
+# Khách hỏi khuyến mãi -> gần như chắc chắn LLM gọi get_discounted_products
+_DISCOUNT = re.compile(r"khuyến mãi|giảm giá|ưu đãi|sale|voucher|khuyen mai|giam gia", re.IGNORECASE)
+PREFETCH_TOOLS = ("get_product_by_name", "list_products_by_category", "get_discounted_products")
+
+
+def tool_call_key(name: str, args: dict) -> str:
+    """Khóa của 1 lời gọi tool: tên + args đã chuẩn hóa (không phân biệt hoa thường, khoảng trắng)"""
+    def normalize(value):
+        if isinstance(value, str):
+            return " ".join(value.lower().split())
+        if isinstance(value, dict):
+            return {k: normalize(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [normalize(v) for v in value]
+        return value
+    return json.dumps([name, normalize(args)], sort_keys=True, ensure_ascii=False)
+
+
+class ToolPrefetcher:
+    """Chạy trước các tool LLM nhiều khả năng sẽ gọi, song song với lần gọi LLM đầu tiên của lượt.
+
+    - Dự đoán từ tin nhắn của khách: tên sản phẩm / danh mục (ProductCatalog.mentions) -> get_product_by_name /
+      list_products_by_category; có nhắc khuyến mãi / giảm giá -> get_discounted_products
+    - Khi LLM trả về: kết quả của các lời gọi trùng dự đoán được giữ lại (state["prefetched"]) để tool node
+      trả ngay, phần còn lại bị hủy / bỏ đi
+    - Metrics: prefetch_total, prefetch_hits_total, prefetch_wasted_total theo tool (hit rate = hits / total)
+    - TOOL_PREFETCH=0 để tắt; sau khi fork (gunicorn preload) thread pool được tạo lại trong worker
+    """
+
+    def __init__(self, tools, catalog: ProductCatalog = None, max_mentions: int = 2, max_workers: int = 4):
+        self.tools = {t.name: t for t in tools if t.name in PREFETCH_TOOLS}
+        self.catalog = catalog or ProductCatalog.get_instance()
+        self.max_mentions = max_mentions
+        self.max_workers = max_workers
+        self.enabled = os.getenv("TOOL_PREFETCH", "1") != "0"
+        self._init_process_state()
+
+    def _init_process_state(self):
+        self._pid = os.getpid()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._init_process_state()
+
+    @property
+    def executor(self):
+        self._check_pid()
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="prefetch")
+        return self._executor
+
+    def predict(self, text: str):
+        """Các lời gọi tool [(name, args)] dự đoán từ tin nhắn của khách"""
+        if not self.enabled or not text:
+            return []
+        try:
+            found = self.catalog.mentions(text, limit=self.max_mentions)
+        except Exception as e:
+            print(f"❌ Lỗi khi dự đoán tool cần gọi: {e}")
+            return []
+        calls = [("get_product_by_name", {"product_name": name}) for name in found["products"]]
+        calls += [("list_products_by_category", {"category_name": name}) for name in found["categories"]]
+        if _DISCOUNT.search(text):
+            calls.append(("get_discounted_products", {}))
+        return [(name, args) for name, args in calls if name in self.tools]
+
+    # ----------- BẮT ĐẦU (trước khi gọi LLM) -----------
+    def start(self, text: str):
+        """Chạy các tool dự đoán ở thread pool, trả về {khóa: (tên tool, Future)}"""
+        pending = {}
+        for name, args in self.predict(text):
+            # Mỗi tool 1 bản sao context để giữ trace_id của lượt (metrics/trace) trong thread pool
+            future = self.executor.submit(contextvars.copy_context().run, self.tools[name].invoke, args)
+            pending[tool_call_key(name, args)] = (name, future)
+            metrics.inc("prefetch_total", tool=name, help="Số tool được chạy trước khi LLM gọi")
+        return pending
+
+    def astart(self, text: str):
+        """Bản async: mỗi tool là 1 task trên event loop, trả về {khóa: (tên tool, Task)}"""
+        pending = {}
+        for name, args in self.predict(text):
+            pending[tool_call_key(name, args)] = (name, asyncio.ensure_future(self.tools[name].ainvoke(args)))
+            metrics.inc("prefetch_total", tool=name, help="Số tool được chạy trước khi LLM gọi")
+        return pending
+
+    # ----------- THU KẾT QUẢ (sau khi LLM trả về) -----------
+    def _split(self, pending, response):
+        called = {tool_call_key(tc["name"], tc["args"]) for tc in getattr(response, "tool_calls", None) or []}
+        hits, wasted = [], []
+        for key, (name, future) in pending.items():
+            (hits if key in called else wasted).append((key, name, future))
+        for _, name, future in wasted:
+            future.cancel()
+            metrics.inc("prefetch_wasted_total", tool=name, help="Số tool chạy trước nhưng LLM không gọi")
+        return hits
+
+    def collect(self, pending, response):
+        """{khóa: nội dung ToolMessage} của các tool LLM thực sự gọi; hủy phần còn lại"""
+        results = {}
+        for key, name, future in self._split(pending, response):
+            try:
+                results[key] = msg_content_output(future.result())
+            except Exception:
+                continue  # lỗi -> để tool node chạy lại như bình thường
+            metrics.inc("prefetch_hits_total", tool=name, help="Số tool chạy trước được LLM gọi đúng")
+        return results
+
+    async def acollect(self, pending, response):
+        results = {}
+        for key, name, task in self._split(pending, response):
+            try:
+                results[key] = msg_content_output(await task)
+            except Exception:
+                continue
+            metrics.inc("prefetch_hits_total", tool=name, help="Số tool chạy trước được LLM gọi đúng")
+        return results
@@ -0,0 +1,61 @@
+import json
+import threading
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from ..utils import metrics, estimate_tokens
+
+# Tool cần cho từng intent (xem src/Prompts/assembler.py); tool không có trong nhóm nào luôn được bind
+TOOL_GROUPS = {
+    "browsing": ["smart_search", "check_categories", "list_products_by_category", "get_all_products",
+                 "get_product_by_name", "get_discounted_products", "compare_products", "recommend_related"],
+    "checkout": ["add_order", "view_cart", "get_product_by_name", "get_customer_info", "get_customer_orders",
+                 "recommend_related"],
+    "account": ["register_customer", "get_customer_info", "get_customer_orders", "update_customer_info"],
+    "policy": ["rag_tool", "smart_search"],
+    "support": ["rag_tool", "get_customer_orders", "get_product_by_name"],
+}
+# Luôn bind: thông tin cửa hàng, mở rộng trường [ref:Rn] của bất kỳ tool nào và tool đặt đơn
+# (câu chốt đơn như "Có, lấy cho tôi 1 cái" không phải lúc nào cũng nhận ra được là checkout)
+ALWAYS_BOUND = ("rag_tool", "get_reference_detail", "add_order", "view_cart")
+
+
+class ToolSelector:
+    """Chỉ bind các tool liên quan tới intent của lượt hiện tại thay vì gửi schema của mọi tool mỗi lần gọi LLM.
+
+    - Intent do PromptAssembler.detect_intents() nhận ra (từ khóa + tool vừa được gọi), không có intent -> mọi tool
+    - Model đã bind được cache theo tập tool (frozenset tên tool), không bind lại mỗi lần gọi
+    - Metrics: tools_bound_total theo số tool, tool_schema_tokens_total (token ước lượng của schema đã gửi)
+    """
+
+    def __init__(self, llm, tools, groups=None, always=ALWAYS_BOUND):
+        self.llm = llm
+        self.tools = list(tools)
+        groups = groups or TOOL_GROUPS
+        grouped = {name for names in groups.values() for name in names}
+        self.always = {t.name for t in self.tools if t.name in always or t.name not in grouped}
+        self.groups = {intent: set(names) for intent, names in groups.items()}
+        self._bound = {}  # frozenset(tên tool) -> (llm đã bind, số token schema)
+        self._lock = threading.Lock()
+
+    def select(self, intents):
+        """Các tool (giữ thứ tự ban đầu) cho 1 tập intent"""
+        if not intents:
+            return self.tools
+        names = set(self.always)
+        for intent in intents:
+            names |= self.groups.get(intent, set())
+        return [t for t in self.tools if t.name in names]
+
+    def bind(self, intents):
+        """Model đã bind tool cho tập intent (cache theo tập tool)"""
+        tools = self.select(intents)
+        key = frozenset(t.name for t in tools)
+        entry = self._bound.get(key)
+        if entry is None:
+            with self._lock:
+                entry = self._bound.get(key)
+                if entry is None:
+                    schema = json.dumps([convert_to_openai_tool(t) for t in tools], ensure_ascii=False)
+                    entry = self._bound[key] = (self.llm.bind_tools(tools), estimate_tokens(schema))
+        metrics.inc("tools_bound_total", tools=str(len(tools)), help="Số lần gọi LLM theo số tool được bind")
+        metrics.inc("tool_schema_tokens_total", entry[1], help="Tổng token (ước lượng) của schema tool đã gửi")
+        return entry[0]
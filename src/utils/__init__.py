@@ -1 +1,13 @@
-from .tools import run_query
\ No newline at end of file
+from .tools import run_query
+from .formatter import ToolOutputFormatter, estimate_tokens
+from .migrations import apply_migrations
+from .checkpointer import SqliteCheckpointSaver
+from .metrics import metrics, MetricsRegistry, MetricsCallbackHandler, start_trace, get_trace_id, get_trace_spans
+from .profiling import RequestProfiler, StackSampler, trace_thread, traced
+from .session_store import SessionStore, SqliteSessionStore, InMemorySessionStore
+from .async_db import AsyncDatabase, arun_query, Query, Call, run_plan, arun_plan
+from .catalog import ProductCatalog
+from .inventory import InventoryManager, OutOfStockError
+from .reports import ReportStore
+from .vector_codec import encode_vector, decode_vector, load_matrix, top_k
+from .session_clusters import SessionClusterer
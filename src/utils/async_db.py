@@ -0,0 +1,288 @@
+import asyncio
+import contextvars
+import os
+import queue
+import sqlite3
+import threading
+import time
+from .tools import db_path, run_query, _query_labels
+from .metrics import metrics
+from .profiling import trace_thread, traced
+
+
+class Query:
+    """Một câu SQL trong query plan của tool (xem run_plan / arun_plan)"""
+    __slots__ = ("query", "params", "fetch")
+
+    def __init__(self, query: str, params=(), fetch: bool = False):
+        self.query = query
+        self.params = params
+        self.fetch = fetch
+
+    @property
+    def is_read(self):
+        # last_insert_rowid() / changes() phải chạy trên connection vừa ghi
+        sql = self.query.lstrip().upper()
+        return (self.fetch and sql.startswith(("SELECT", "WITH"))
+                and "LAST_INSERT_ROWID" not in sql and "CHANGES()" not in sql)
+
+
+class Call:
+    """Lời gọi blocking khác (vd: Tavily) trong query plan: bản async chạy trong thread pool"""
+    __slots__ = ("fn", "args", "kwargs")
+
+    def __init__(self, fn, *args, **kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+
+class AsyncDatabase:
+    """Truy cập SQLite không chặn event loop.
+
+    - 1 thread ghi (connection read-write duy nhất) nhận việc qua queue: ghi tuần tự, không tranh lock
+    - N thread đọc, mỗi thread 1 connection read-only: WAL cho phép đọc song song với ghi
+    - Thread đọc gom các câu đọc đang chờ thành 1 batch, chạy trong 1 read transaction
+    - Kết quả trả về qua asyncio.Future của event loop gọi tới
+    """
+    _instance = None
+
+    def __init__(self, DB_PATH: str = db_path, readers: int = 4, batch_size: int = 16):
+        self.db_path = DB_PATH
+        self.readers = readers
+        self.batch_size = batch_size
+        self._init_process_state()
+
+    def _init_process_state(self):
+        self._pid = os.getpid()
+        self._write_queue = queue.Queue()
+        self._read_queue = queue.Queue()
+        self._threads = []
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._pid != os.getpid():
+            # Worker được fork: thread / connection của process cha không còn dùng được
+            self._init_process_state()
+        if self._threads:
+            return
+        with self._start_lock:
+            if self._threads:
+                return
+            threads = [threading.Thread(target=self._writer_loop, name="db-writer", daemon=True)]
+            threads += [
+                threading.Thread(target=self._reader_loop, name=f"db-reader-{i}", daemon=True)
+                for i in range(self.readers)
+            ]
+            for t in threads:
+                t.start()
+            self._threads = threads
+
+    def _connect(self, readonly: bool):
+        if readonly:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, timeout=30,
+                                   check_same_thread=False, isolation_level=None)
+        else:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # ----------- WORKER THREADS -----------
+    def _writer_loop(self):
+        conn = self._connect(readonly=False)
+        while True:
+            job = self._write_queue.get()
+            if job is None:
+                break
+            self._run_job(conn, job, transaction=True)
+        conn.close()
+
+    def _reader_loop(self):
+        conn = self._connect(readonly=True)
+        while True:
+            job = self._read_queue.get()
+            if job is None:
+                break
+            # Gom thêm các câu đọc đang chờ (không đợi) thành 1 batch
+            jobs, stop = [job], False
+            while len(jobs) < self.batch_size:
+                try:
+                    more = self._read_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if more is None:
+                    stop = True
+                    break
+                jobs.append(more)
+
+            metrics.observe("db_read_batch_size", len(jobs), help="Số job đọc được gom trong 1 read transaction")
+            try:
+                conn.execute("BEGIN")
+                for job in jobs:
+                    self._run_job(conn, job)
+                conn.execute("COMMIT")
+            except Exception as e:
+                # BEGIN / COMMIT lỗi: báo lỗi cho các future của batch chưa có kết quả, thread vẫn chạy tiếp
+                print(f"❌ Lỗi read transaction của AsyncDatabase: {e}")
+                for _, future, loop, _, _ in jobs:
+                    loop.call_soon_threadsafe(_set_exception, future, e)
+                conn = self._reset_reader(conn)
+            if stop:
+                break
+        conn.close()
+
+    def _reset_reader(self, conn):
+        # Rollback transaction còn dở, connection hỏng thì mở lại
+        try:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            return conn
+        except Exception:
+            try:
+                conn.close()
+            except Exception:
+                pass
+            return self._connect(readonly=True)
+
+    def _run_job(self, conn, job, transaction: bool = False):
+        queries, future, loop, ctx, queued_at = job
+        metrics.observe("db_queue_wait_seconds", time.perf_counter() - queued_at,
+                        help="Thời gian job SQL chờ trong queue")
+        try:
+            # Chạy trong context của request để span SQL gắn vào trace
+            result = ctx.run(self._execute, conn, queries, transaction)
+        except Exception as e:
+            loop.call_soon_threadsafe(_set_exception, future, e)
+        else:
+            loop.call_soon_threadsafe(_set_result, future, result)
+
+    def _execute(self, conn, queries, transaction):
+        with trace_thread():
+            return self._execute_queries(conn, queries, transaction)
+
+    def _execute_queries(self, conn, queries, transaction):
+        results = []
+        if transaction:
+            # Các câu ghi trong 1 job: 1 transaction (lỗi thì rollback cả job)
+            with conn:
+                for q in queries:
+                    results.append(self._execute_one(conn, q))
+        else:
+            for q in queries:
+                results.append(self._execute_one(conn, q))
+        return results
+
+    def _execute_one(self, conn, q: Query):
+        with metrics.timer("sql_query", help="Thời gian chạy run_query", mode="async", **_query_labels(q.query)):
+            cur = conn.execute(q.query, q.params)
+            return cur.fetchall() if q.fetch else "✅ Done"
+
+    # ----------- PUBLIC API -----------
+    def _submit(self, queries, write: bool):
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        job = (queries, future, loop, contextvars.copy_context(), time.perf_counter())
+        (self._write_queue if write else self._read_queue).put(job)
+        return future
+
+    async def run_query(self, query: str, params=(), fetch: bool = False):
+        """Bản async của utils.run_query (cùng tham số, cùng kết quả)"""
+        q = Query(query, params, fetch)
+        return (await self._submit([q], write=not q.is_read))[0]
+
+    async def fetch_many(self, queries):
+        """Chạy nhiều câu đọc trong cùng 1 read transaction (snapshot nhất quán)"""
+        queries = [q if isinstance(q, Query) else Query(*q, fetch=True) for q in queries]
+        write = not all(q.is_read for q in queries)
+        return await self._submit(queries, write=write)
+
+    async def execute_many(self, queries):
+        """Chạy nhiều câu ghi trong 1 transaction trên thread ghi"""
+        queries = [q if isinstance(q, Query) else Query(*q) for q in queries]
+        return await self._submit(queries, write=True)
+
+    def close(self):
+        """Dừng các thread (các job đã nhận vẫn được chạy xong)"""
+        if not self._threads or self._pid != os.getpid():
+            return
+        self._write_queue.put(None)
+        for _ in range(self.readers):
+            self._read_queue.put(None)
+        for t in self._threads:
+            t.join(timeout=5)
+        self._threads = []
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future, error):
+    if not future.done():
+        future.set_exception(error)
+
+
+async def arun_query(query, params=(), fetch=False):
+    """run_query cho code async: không chặn event loop"""
+    return await AsyncDatabase.get_instance().run_query(query, params, fetch)
+
+
+# ----------- QUERY PLAN -----------
+# Tool viết 1 lần dạng generator: `rows = yield Query(...)`, `a, b = yield [Query(...), Query(...)]`,
+# `res = yield Call(fn, ...)`. run_plan chạy bằng run_query (sync), arun_plan chạy qua AsyncDatabase.
+
+def _run_step(step):
+    if isinstance(step, Query):
+        return run_query(step.query, step.params, fetch=step.fetch)
+    if isinstance(step, Call):
+        return step.fn(*step.args, **step.kwargs)
+    return [_run_step(s) for s in step]
+
+
+async def _arun_step(step):
+    if isinstance(step, Query):
+        return await arun_query(step.query, step.params, fetch=step.fetch)
+    if isinstance(step, Call):
+        return await asyncio.to_thread(traced(step.fn), *step.args, **step.kwargs)
+    if all(isinstance(s, Query) and s.is_read for s in step):
+        return await AsyncDatabase.get_instance().fetch_many(step)
+    return [await _arun_step(s) for s in step]
+
+
+def run_plan(plan):
+    """Chạy query plan (generator) đồng bộ, lỗi của từng bước được ném lại vào generator"""
+    value, error = None, None
+    while True:
+        try:
+            step = plan.throw(error) if error is not None else plan.send(value)
+        except StopIteration as stop:
+            return stop.value
+        value, error = None, None
+        try:
+            value = _run_step(step)
+        except Exception as e:
+            error = e
+
+
+async def arun_plan(plan):
+    """Chạy query plan (generator) bất đồng bộ"""
+    value, error = None, None
+    while True:
+        try:
+            step = plan.throw(error) if error is not None else plan.send(value)
+        except StopIteration as stop:
+            return stop.value
+        value, error = None, None
+        try:
+            value = await _arun_step(step)
+        except Exception as e:
+            error = e
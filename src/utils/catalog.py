@@ -0,0 +1,320 @@
+import os
+import re
+import sqlite3
+import threading
+import numpy as np
+from .tools import db_path
+from .migrations import apply_migrations
+from .metrics import metrics
+
+# Thứ tự cột khi đọc bảng products
+_PRODUCT_COLUMNS = """
+    SELECT ProductId, ProductName, CategoryId,
+           COALESCE(Description, 'Không có mô tả'),
+           Price, Quantity, ImageUrl, COALESCE(IsActive, 1),
+           CreatedAt, UpdatedAt
+    FROM products
+"""
+
+_SORT_KEYS = ("name", "price", "quantity", "id")
+
+_WORDS = re.compile(r"\w+")
+
+
+def _phrase_index(names):
+    """từ đầu tiên -> [(các từ của tên, tên)], tên dài trước: tìm tên xuất hiện trong câu bằng 1 lượt quét"""
+    index = {}
+    for name in names:
+        words = tuple(_WORDS.findall(name.lower()))
+        if words:
+            index.setdefault(words[0], []).append((words, name))
+    for candidates in index.values():
+        candidates.sort(key=lambda c: -len(c[0]))
+    return index
+
+
+class _Snapshot:
+    """Bản chụp catalogue dạng cột (numpy), không đổi sau khi tạo: đọc không cần lock"""
+
+    def __init__(self, columns: dict, categories: dict, watermark: str):
+        self.ids = columns["ids"]
+        self.names = columns["names"]
+        self.category_ids = columns["category_ids"]
+        self.descriptions = columns["descriptions"]
+        self.prices = columns["prices"]
+        self.quantities = columns["quantities"]
+        self.image_urls = columns["image_urls"]
+        self.active = columns["active"]
+        self.created_at = columns["created_at"]
+        self.updated_at = columns["updated_at"]
+        self.categories = categories
+        self.watermark = watermark
+
+        # Index theo tên / id, thứ hạng tên để sort bằng numpy
+        self.names_lower = np.array([n.lower() for n in self.names], dtype=str)
+        self.name_rank = np.empty(len(self.ids), dtype=np.int64)
+        self.name_rank[np.argsort(self.names_lower, kind="stable")] = np.arange(len(self.ids))
+        self.row_by_id = {int(pid): i for i, pid in enumerate(self.ids)}
+        self.row_by_name = {}
+        for i in np.argsort(self.ids):
+            self.row_by_name.setdefault(self.names_lower[i], int(i))
+        self.category_by_name = {name.lower(): cid for cid, name in categories.items()}
+        self._mention_index = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def mention_index(self):
+        """(index tên sản phẩm, index tên danh mục) cho ProductCatalog.mentions, tạo lần đầu khi cần"""
+        if self._mention_index is None:
+            product_names = [self.names[i] for i in self.row_by_name.values()]
+            self._mention_index = (_phrase_index(product_names), _phrase_index(self.categories.values()))
+        return self._mention_index
+
+    @staticmethod
+    def columns_from_rows(rows):
+        return {
+            "ids": np.array([r[0] for r in rows], dtype=np.int64),
+            "names": np.array([r[1] for r in rows], dtype=object),
+            "category_ids": np.array([r[2] for r in rows], dtype=np.int64),
+            "descriptions": np.array([r[3] for r in rows], dtype=object),
+            "prices": np.array([float(r[4]) for r in rows], dtype=np.float64),
+            "quantities": np.array([r[5] for r in rows], dtype=np.int64),
+            "image_urls": np.array([r[6] for r in rows], dtype=object),
+            "active": np.array([bool(r[7]) for r in rows], dtype=bool),
+            "created_at": np.array([r[8] for r in rows], dtype=object),
+            "updated_at": np.array([r[9] for r in rows], dtype=object),
+        }
+
+    def merge(self, rows, categories: dict, watermark: str):
+        """Tạo snapshot mới: cập nhật các dòng đã có, thêm dòng mới (copy-on-write)"""
+        changed = _Snapshot.columns_from_rows(rows)
+        existing = np.array([self.row_by_id.get(int(pid), -1) for pid in changed["ids"]], dtype=np.int64)
+        is_new = existing < 0
+
+        columns = {}
+        for key, values in changed.items():
+            col = getattr(self, key).copy()
+            col[existing[~is_new]] = values[~is_new]
+            columns[key] = np.concatenate([col, values[is_new]])
+        return _Snapshot(columns, categories, watermark)
+
+    def row(self, i: int) -> dict:
+        cid = int(self.category_ids[i])
+        return {
+            "id": int(self.ids[i]),
+            "name": self.names[i],
+            "category_id": cid,
+            "category_name": self.categories.get(cid),
+            "description": self.descriptions[i],
+            "price": float(self.prices[i]),
+            "quantity": int(self.quantities[i]),
+            "image_url": self.image_urls[i],
+            "is_active": bool(self.active[i]),
+            "created_at": self.created_at[i],
+            "updated_at": self.updated_at[i],
+        }
+
+
+class ProductCatalog:
+    """Catalogue sản phẩm nằm trong RAM, dạng cột numpy (giá, tồn kho, danh mục, trạng thái) + index theo tên.
+
+    - Lần đọc đầu nạp toàn bộ bảng, sau đó thread nền refresh tăng dần theo products.UpdatedAt
+      mỗi refresh_interval giây (hoặc ngay khi mark_dirty() sau khi ghi)
+    - Đọc (get / find_by_name / query) chỉ chạm vào snapshot hiện tại, không truy cập disk
+    - Snapshot không đổi sau khi tạo, refresh tạo snapshot mới rồi thay tham chiếu
+    - Sau khi fork (gunicorn preload) snapshot của master được dùng lại, thread nền được tạo lại trong worker
+    """
+    _instance = None
+
+    def __init__(self, DB_PATH: str = db_path, refresh_interval: float = None):
+        self.db_path = DB_PATH
+        self.refresh_interval = refresh_interval or float(os.getenv("CATALOG_REFRESH_SECONDS", 2))
+        self._snapshot = None
+        self._init_process_state()
+
+    def _init_process_state(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._refresher = None
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._init_process_state()
+
+    # ----------- REFRESH -----------
+    def _load_categories(self, conn):
+        return {cid: name for cid, name in conn.execute("SELECT CategoryId, CategoryName FROM categories")}
+
+    def refresh(self, full: bool = False) -> int:
+        """Đọc các sản phẩm thay đổi từ lần refresh trước, trả về số dòng được cập nhật"""
+        self._check_pid()
+        with self._lock, metrics.timer("catalog_refresh", help="Thời gian refresh catalogue snapshot",
+                                       full=str(full or self._snapshot is None).lower()):
+            apply_migrations(self.db_path)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            try:
+                categories = self._load_categories(conn)
+                snapshot = self._snapshot
+                if not full and snapshot is not None:
+                    # So số dòng để phát hiện sản phẩm bị xóa (hiếm) -> nạp lại toàn bộ
+                    (count,) = conn.execute("SELECT COUNT(*) FROM products").fetchone()
+                    full = count < len(snapshot)
+
+                if full or snapshot is None:
+                    rows = conn.execute(_PRODUCT_COLUMNS + " ORDER BY ProductId").fetchall()
+                    changed = len(rows)
+                    snapshot = _Snapshot(_Snapshot.columns_from_rows(rows), categories, _watermark(rows, ""))
+                else:
+                    # UpdatedAt chỉ chính xác tới giây: đọc lại cả các dòng trùng mốc (>=)
+                    rows = conn.execute(_PRODUCT_COLUMNS + " WHERE UpdatedAt >= ?", (snapshot.watermark,)).fetchall()
+                    rows = [r for r in rows if not _unchanged(snapshot, r)]
+                    changed = len(rows)
+                    if rows or categories != snapshot.categories:
+                        snapshot = snapshot.merge(rows, categories, _watermark(rows, snapshot.watermark))
+            finally:
+                conn.close()
+
+            self._snapshot = snapshot
+        if changed:
+            metrics.inc("catalog_rows_refreshed_total", changed, help="Số dòng sản phẩm được refresh vào catalogue")
+        return changed
+
+    def mark_dirty(self):
+        """Báo có ghi vào products (vd: đặt hàng trừ tồn kho): refresh ngay ở thread nền"""
+        self._wakeup.set()
+
+    def _ensure_refresher(self):
+        self._check_pid()
+        if self._refresher is not None:
+            return
+        with self._lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(target=self._run_refresher, name="catalog-refresh", daemon=True)
+                self._refresher.start()
+
+    def _run_refresher(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.refresh_interval)
+            self._wakeup.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"❌ Lỗi khi refresh catalogue: {e}")
+
+    @property
+    def snapshot(self) -> _Snapshot:
+        if self._snapshot is None:
+            self.refresh(full=True)
+        self._ensure_refresher()
+        return self._snapshot
+
+    def warmup(self):
+        """Nạp snapshot trước (gọi ở master trước khi fork)"""
+        if self._snapshot is None:
+            self.refresh(full=True)
+        print(f"✅ Đã nạp catalogue: {len(self._snapshot)} sản phẩm")
+
+    def close(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    # ----------- READ -----------
+    def get(self, product_id: int):
+        snap = self.snapshot
+        i = snap.row_by_id.get(int(product_id))
+        return None if i is None else snap.row(i)
+
+    def find_by_name(self, name: str):
+        """Tìm theo tên chính xác (không phân biệt hoa thường)"""
+        snap = self.snapshot
+        i = snap.row_by_name.get(name.strip().lower())
+        return None if i is None else snap.row(i)
+
+    def mentions(self, text: str, limit: int = 3):
+        """Tên sản phẩm / danh mục (đúng như trong DB) được nhắc nguyên cụm trong câu, ưu tiên tên dài nhất.
+        Trả về {"products": [...], "categories": [...]}, mỗi loại tối đa limit tên"""
+        words = _WORDS.findall(text.lower())
+        found = {"products": [], "categories": []}
+        for key, index in zip(found, self.snapshot.mention_index):
+            i = 0
+            while i < len(words) and len(found[key]) < limit:
+                match = next((c for c in index.get(words[i], ()) if tuple(words[i:i + len(c[0])]) == c[0]), None)
+                if match is None:
+                    i += 1
+                    continue
+                if match[1] not in found[key]:
+                    found[key].append(match[1])
+                i += len(match[0])
+        return found
+
+    def category_id(self, category_name: str):
+        return self.snapshot.category_by_name.get(category_name.strip().lower())
+
+    def query(self, category: str = None, category_id: int = None, name_contains: str = None,
+              min_price: float = None, max_price: float = None, in_stock: bool = None,
+              active: bool = None, product_ids=None, sort_by: str = "name",
+              descending: bool = False, k: int = None):
+        """Lọc / sắp xếp / lấy top-k trên snapshot bằng numpy, trả về list dict như get_all_products.
+        sort_by: name | price | quantity | id"""
+        if sort_by not in _SORT_KEYS:
+            raise ValueError(f"sort_by phải là một trong {_SORT_KEYS}")
+        snap = self.snapshot
+        mask = np.ones(len(snap), dtype=bool)
+
+        if category is not None:
+            category_id = snap.category_by_name.get(category.strip().lower())
+            if category_id is None:
+                return []
+        if category_id is not None:
+            mask &= snap.category_ids == category_id
+        if name_contains:
+            mask &= np.char.find(snap.names_lower, name_contains.strip().lower()) >= 0
+        if min_price is not None:
+            mask &= snap.prices >= min_price
+        if max_price is not None:
+            mask &= snap.prices <= max_price
+        if in_stock is not None:
+            mask &= (snap.quantities > 0) == in_stock
+        if active is not None:
+            mask &= snap.active == active
+        if product_ids is not None:
+            mask &= np.isin(snap.ids, np.asarray(list(product_ids), dtype=np.int64))
+
+        idx = np.flatnonzero(mask)
+        key = {"name": snap.name_rank, "price": snap.prices,
+               "quantity": snap.quantities, "id": snap.ids}[sort_by][idx]
+        if descending:
+            key = -key
+        if k is not None and k < len(idx):
+            # Top-k: argpartition O(n) rồi chỉ sort k phần tử
+            top = np.argpartition(key, k - 1)[:k] if k > 0 else np.array([], dtype=np.int64)
+            idx, key = idx[top], key[top]
+        order = np.lexsort((snap.name_rank[idx], key))
+        return [snap.row(i) for i in idx[order]]
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+
+def _watermark(rows, current: str) -> str:
+    return max([current] + [r[9] for r in rows if r[9]])
+
+
+def _unchanged(snapshot: _Snapshot, row) -> bool:
+    # Dòng trùng mốc UpdatedAt đã có trong snapshot với đúng giá trị -> bỏ qua
+    i = snapshot.row_by_id.get(row[0])
+    if i is None:
+        return False
+    current = (snapshot.names[i], snapshot.category_ids[i], snapshot.descriptions[i], snapshot.prices[i],
+               snapshot.quantities[i], snapshot.image_urls[i], snapshot.active[i], snapshot.created_at[i],
+               snapshot.updated_at[i])
+    return current == (row[1], row[2], row[3], float(row[4]), row[5], row[6], bool(row[7]), row[8], row[9])
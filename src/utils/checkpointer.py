@@ -0,0 +1,372 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+from langchain_core.messages import BaseMessage
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from .tools import db_path
+from .migrations import apply_migrations
+from .profiling import traced
+
+# Channel là list messages được lưu dạng danh sách hash, mỗi message chỉ lưu 1 lần
+MESSAGE_REFS_TYPE = "msgrefs"
+
+
+class SqliteCheckpointSaver(BaseCheckpointSaver[str]):
+    """Checkpointer của LangGraph lưu trong SQLite (store.db).
+
+    - thread_id = session_id, state không còn nằm trong object Python của process
+    - Mỗi bước chỉ lưu channel có version mới; message đã lưu thì không lưu lại (delta)
+    - Dữ liệu nằm trên đĩa nên có thể resume sau khi process crash / dùng nhiều worker
+    - prune() xóa checkpoint cũ, chỉ giữ lại N checkpoint gần nhất của mỗi thread
+    """
+
+    def __init__(self, DB_PATH: str = db_path, keep_last: int = 20, *, serde=None):
+        super().__init__(serde=serde)
+        self.db_path = DB_PATH
+        self.keep_last = keep_last
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+        apply_migrations(self.db_path)
+
+    # ----------- CONNECTION -----------
+    @property
+    def conn(self):
+        """Mỗi thread dùng một connection riêng (WAL cho phép đọc song song)"""
+        if self._pid != os.getpid():
+            # Worker được fork (gunicorn preload): không dùng lại connection của process cha
+            self._local = threading.local()
+            self._pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ----------- SERIALIZE CHANNEL VALUES -----------
+    def _is_message_list(self, value):
+        return isinstance(value, list) and len(value) > 0 and all(isinstance(m, BaseMessage) for m in value)
+
+    def _dump_channel(self, conn, thread_id, value):
+        if not self._is_message_list(value):
+            return self.serde.dumps_typed(value)
+
+        hashes, rows = [], []
+        for msg in value:
+            value_type, blob = self.serde.dumps_typed(msg)
+            message_hash = hashlib.sha1(value_type.encode() + blob).hexdigest()
+            hashes.append(message_hash)
+            rows.append((thread_id, message_hash, value_type, blob))
+        conn.executemany(
+            "INSERT OR IGNORE INTO graph_checkpoint_messages (ThreadId, MessageHash, ValueType, Value) VALUES (?, ?, ?, ?)",
+            rows
+        )
+        return MESSAGE_REFS_TYPE, json.dumps(hashes).encode()
+
+    def _load_channel(self, thread_id, value_type, blob):
+        if value_type != MESSAGE_REFS_TYPE:
+            return self.serde.loads_typed((value_type, blob))
+
+        hashes = json.loads(blob)
+        messages = {}
+        # Chia nhỏ để không vượt giới hạn số tham số của SQLite
+        unique_hashes = list(set(hashes))
+        for i in range(0, len(unique_hashes), 500):
+            batch = unique_hashes[i:i + 500]
+            rows = self.conn.execute(
+                f"SELECT MessageHash, ValueType, Value FROM graph_checkpoint_messages "
+                f"WHERE ThreadId = ? AND MessageHash IN ({','.join('?' * len(batch))})",
+                (thread_id, *batch)
+            ).fetchall()
+            for message_hash, t, b in rows:
+                messages[message_hash] = self.serde.loads_typed((t, b))
+        return [messages[h] for h in hashes if h in messages]
+
+    def _load_blobs(self, thread_id, checkpoint_ns, versions):
+        channel_values = {}
+        for channel, version in versions.items():
+            row = self.conn.execute(
+                "SELECT ValueType, Value FROM graph_checkpoint_blobs "
+                "WHERE ThreadId = ? AND CheckpointNs = ? AND Channel = ? AND Version = ?",
+                (thread_id, checkpoint_ns, channel, str(version))
+            ).fetchone()
+            if row and row[0] != "empty":
+                channel_values[channel] = self._load_channel(thread_id, row[0], row[1])
+        return channel_values
+
+    def _make_tuple(self, thread_id, checkpoint_ns, row):
+        checkpoint_id, parent_id, c_type, c_blob, m_type, m_blob = row
+        checkpoint = self.serde.loads_typed((c_type, c_blob))
+        writes = self.conn.execute(
+            "SELECT TaskId, Channel, ValueType, Value FROM graph_checkpoint_writes "
+            "WHERE ThreadId = ? AND CheckpointNs = ? AND CheckpointId = ? ORDER BY TaskId, Idx",
+            (thread_id, checkpoint_ns, checkpoint_id)
+        ).fetchall()
+        return CheckpointTuple(
+            config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": checkpoint_id,
+                }
+            },
+            checkpoint={
+                **checkpoint,
+                "channel_values": self._load_blobs(thread_id, checkpoint_ns, checkpoint["channel_versions"]),
+            },
+            metadata=self.serde.loads_typed((m_type, m_blob)),
+            pending_writes=[(task_id, channel, self.serde.loads_typed((t, v))) for task_id, channel, t, v in writes],
+            parent_config=(
+                {
+                    "configurable": {
+                        "thread_id": thread_id,
+                        "checkpoint_ns": checkpoint_ns,
+                        "checkpoint_id": parent_id,
+                    }
+                }
+                if parent_id
+                else None
+            ),
+        )
+
+    # ----------- BaseCheckpointSaver API -----------
+    def get_tuple(self, config):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        select = (
+            "SELECT CheckpointId, ParentCheckpointId, CheckpointType, Checkpoint, MetadataType, Metadata "
+            "FROM graph_checkpoints WHERE ThreadId = ? AND CheckpointNs = ?"
+        )
+        if checkpoint_id := get_checkpoint_id(config):
+            row = self.conn.execute(select + " AND CheckpointId = ?", (thread_id, checkpoint_ns, checkpoint_id)).fetchone()
+        else:
+            row = self.conn.execute(select + " ORDER BY CheckpointId DESC LIMIT 1", (thread_id, checkpoint_ns)).fetchone()
+        if row is None:
+            return None
+        return self._make_tuple(thread_id, checkpoint_ns, row)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        query = (
+            "SELECT ThreadId, CheckpointNs, CheckpointId, ParentCheckpointId, CheckpointType, Checkpoint, MetadataType, Metadata "
+            "FROM graph_checkpoints WHERE 1 = 1"
+        )
+        params = []
+        if config:
+            query += " AND ThreadId = ?"
+            params.append(config["configurable"]["thread_id"])
+            if (checkpoint_ns := config["configurable"].get("checkpoint_ns")) is not None:
+                query += " AND CheckpointNs = ?"
+                params.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                query += " AND CheckpointId = ?"
+                params.append(checkpoint_id)
+        if before and (before_id := get_checkpoint_id(before)):
+            query += " AND CheckpointId < ?"
+            params.append(before_id)
+        query += " ORDER BY CheckpointId DESC"
+
+        rows = self.conn.execute(query, params).fetchall()
+        for thread_id, checkpoint_ns, *row in rows:
+            if limit is not None and limit <= 0:
+                break
+            if filter:
+                metadata = self.serde.loads_typed((row[4], row[5]))
+                if not all(metadata.get(k) == v for k, v in filter.items()):
+                    continue
+            if limit is not None:
+                limit -= 1
+            yield self._make_tuple(thread_id, checkpoint_ns, row)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        c = checkpoint.copy()
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        values = c.pop("channel_values")
+
+        conn = self.conn
+        with conn:
+            # Chỉ lưu các channel có version mới (delta so với checkpoint trước)
+            blob_rows = []
+            for channel, version in new_versions.items():
+                value_type, blob = self._dump_channel(conn, thread_id, values[channel]) if channel in values else ("empty", None)
+                blob_rows.append((thread_id, checkpoint_ns, channel, str(version), value_type, blob))
+            conn.executemany(
+                "INSERT OR REPLACE INTO graph_checkpoint_blobs (ThreadId, CheckpointNs, Channel, Version, ValueType, Value) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                blob_rows
+            )
+
+            c_type, c_blob = self.serde.dumps_typed(c)
+            m_type, m_blob = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+            conn.execute(
+                "INSERT OR REPLACE INTO graph_checkpoints "
+                "(ThreadId, CheckpointNs, CheckpointId, ParentCheckpointId, CheckpointType, Checkpoint, MetadataType, Metadata) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+                 c_type, c_blob, m_type, m_blob)
+            )
+
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            value_type, blob = self.serde.dumps_typed(value)
+            rows.append((thread_id, checkpoint_ns, checkpoint_id, task_id, WRITES_IDX_MAP.get(channel, idx),
+                         channel, value_type, blob, task_path))
+
+        # Write đặc biệt (idx < 0: error, interrupt...) được ghi đè, write thường giữ bản đầu tiên
+        verb = "INSERT OR REPLACE" if all(w[0] in WRITES_IDX_MAP for w in writes) else "INSERT OR IGNORE"
+        with self.conn:
+            self.conn.executemany(
+                f"{verb} INTO graph_checkpoint_writes "
+                "(ThreadId, CheckpointNs, CheckpointId, TaskId, Idx, Channel, ValueType, Value, TaskPath) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def delete_thread(self, thread_id):
+        with self.conn:
+            for table in ("graph_checkpoints", "graph_checkpoint_blobs", "graph_checkpoint_writes", "graph_checkpoint_messages"):
+                self.conn.execute(f"DELETE FROM {table} WHERE ThreadId = ?", (thread_id,))
+
+    def get_next_version(self, current, channel):
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        next_v = current_v + 1
+        next_h = random.random()
+        return f"{next_v:032}.{next_h:016}"
+
+    # ----------- ASYNC (chạy bản sync trong thread pool) -----------
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(traced(self.get_tuple), config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        items = await asyncio.to_thread(traced(lambda: list(self.list(config, filter=filter, before=before, limit=limit))))
+        for item in items:
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(traced(self.put), config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        return await asyncio.to_thread(traced(self.put_writes), config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id):
+        return await asyncio.to_thread(traced(self.delete_thread), thread_id)
+
+    # ----------- PRUNE -----------
+    def prune(self, thread_id: str = None, keep_last: int = None, max_age_days: float = None):
+        """Xóa checkpoint cũ.
+        - keep_last: giữ lại N checkpoint mới nhất của mỗi (thread, namespace)
+        - max_age_days: xóa toàn bộ thread không có hoạt động trong X ngày
+        """
+        keep_last = self.keep_last if keep_last is None else keep_last
+        conn = self.conn
+        deleted_threads = 0
+
+        if max_age_days is not None:
+            stale = conn.execute(
+                "SELECT ThreadId FROM graph_checkpoints GROUP BY ThreadId "
+                "HAVING MAX(CreatedAt) < datetime('now', ?)",
+                (f"-{max_age_days} days",)
+            ).fetchall()
+            for (stale_thread,) in stale:
+                if thread_id is None or stale_thread == thread_id:
+                    self.delete_thread(stale_thread)
+                    deleted_threads += 1
+
+        if thread_id is not None:
+            threads = [(thread_id,)]
+        else:
+            threads = conn.execute("SELECT DISTINCT ThreadId FROM graph_checkpoints").fetchall()
+
+        deleted_checkpoints = 0
+        for (tid,) in threads:
+            deleted_checkpoints += self._prune_thread(tid, keep_last)
+
+        return {"deleted_threads": deleted_threads, "deleted_checkpoints": deleted_checkpoints}
+
+    def _prune_thread(self, thread_id, keep_last):
+        conn = self.conn
+        with conn:
+            namespaces = [r[0] for r in conn.execute(
+                "SELECT DISTINCT CheckpointNs FROM graph_checkpoints WHERE ThreadId = ?", (thread_id,)
+            )]
+            deleted = 0
+            for ns in namespaces:
+                old_ids = [r[0] for r in conn.execute(
+                    "SELECT CheckpointId FROM graph_checkpoints WHERE ThreadId = ? AND CheckpointNs = ? "
+                    "ORDER BY CheckpointId DESC LIMIT -1 OFFSET ?",
+                    (thread_id, ns, keep_last)
+                )]
+                if not old_ids:
+                    continue
+                deleted += len(old_ids)
+                conn.executemany(
+                    "DELETE FROM graph_checkpoints WHERE ThreadId = ? AND CheckpointNs = ? AND CheckpointId = ?",
+                    [(thread_id, ns, cid) for cid in old_ids]
+                )
+                conn.executemany(
+                    "DELETE FROM graph_checkpoint_writes WHERE ThreadId = ? AND CheckpointNs = ? AND CheckpointId = ?",
+                    [(thread_id, ns, cid) for cid in old_ids]
+                )
+
+            if deleted == 0:
+                return 0
+
+            # Xóa blob không còn checkpoint nào tham chiếu
+            referenced = set()
+            for ns, c_type, c_blob in conn.execute(
+                "SELECT CheckpointNs, CheckpointType, Checkpoint FROM graph_checkpoints WHERE ThreadId = ?", (thread_id,)
+            ):
+                checkpoint = self.serde.loads_typed((c_type, c_blob))
+                referenced.update((ns, ch, str(v)) for ch, v in checkpoint["channel_versions"].items())
+
+            blob_keys = conn.execute(
+                "SELECT CheckpointNs, Channel, Version, ValueType, Value FROM graph_checkpoint_blobs WHERE ThreadId = ?", (thread_id,)
+            ).fetchall()
+            conn.executemany(
+                "DELETE FROM graph_checkpoint_blobs WHERE ThreadId = ? AND CheckpointNs = ? AND Channel = ? AND Version = ?",
+                [(thread_id, ns, ch, v) for ns, ch, v, _, _ in blob_keys if (ns, ch, v) not in referenced]
+            )
+
+            # Xóa message không còn blob nào tham chiếu
+            referenced_messages = set()
+            for ns, ch, v, value_type, blob in blob_keys:
+                if (ns, ch, v) in referenced and value_type == MESSAGE_REFS_TYPE:
+                    referenced_messages.update(json.loads(blob))
+            message_hashes = [r[0] for r in conn.execute(
+                "SELECT MessageHash FROM graph_checkpoint_messages WHERE ThreadId = ?", (thread_id,)
+            )]
+            conn.executemany(
+                "DELETE FROM graph_checkpoint_messages WHERE ThreadId = ? AND MessageHash = ?",
+                [(thread_id, h) for h in message_hashes if h not in referenced_messages]
+            )
+        return deleted
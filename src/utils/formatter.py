@@ -0,0 +1,242 @@
+import contextvars
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import StructuredTool
+from .metrics import metrics
+from .profiling import trace_thread
+from .session_store import SessionStore
+
+# Các giá trị "rỗng" không mang thông tin, bỏ qua khi gửi cho LLM
+BOILERPLATE_VALUES = {"", "Không có mô tả", "Không tìm thấy", "None", "null"}
+
+# Session (thread_id) của tool đang chạy: reference chỉ được đọc lại bởi chính session đã tạo ra nó
+_ref_owner = contextvars.ContextVar("tool_ref_owner", default="")
+
+
+def estimate_tokens(text: str) -> int:
+    """Ước lượng số token của một đoạn text (~4 ký tự / token)"""
+    if not text:
+        return 0
+    return math.ceil(len(text) / 4)
+
+
+class ToolOutputFormatter:
+    """Chuyển kết quả tool (dict/list) thành dạng bảng gọn để giảm input tokens.
+
+    - List các dict cùng cấu trúc -> bảng: header 1 lần, mỗi dòng 1 bản ghi
+    - Bỏ các field null / boilerplate (vd: 'Không có mô tả')
+    - Cắt text dài, kèm mã tham chiếu [ref:Rn] để LLM gọi get_reference_detail khi cần
+    - Nếu session store dùng chung (nhiều worker) thì reference được ghi thêm vào store,
+      mã có tiền tố riêng của từng process để không trùng nhau
+    - Reference gắn với session (thread_id trong config của tool): session khác đoán mã Rn cũng không đọc được
+    """
+    _instance = None
+
+    def __init__(self, max_text_len: int = 160, max_references: int = 1000, store=None, reference_ttl: float = 86400):
+        self.max_text_len = max_text_len
+        self.max_references = max_references
+        self.reference_ttl = reference_ttl
+
+        self._references = OrderedDict()
+        self._ref_counter = 0
+        self._lock = threading.Lock()
+        self._store = store
+        self._ref_prefix_pid = None
+        self._ref_prefix = ""
+
+        self.stats = {"calls": 0, "raw_tokens": 0, "compact_tokens": 0, "truncated_fields": 0}
+
+    # ----------- PUBLIC API -----------
+    def format(self, result) -> str:
+        """Format kết quả tool thành string gọn. String giữ nguyên."""
+        if isinstance(result, str):
+            return result
+
+        lines = self._render(result, depth=0)
+        compact = "\n".join(lines) if lines else "(trống)"
+
+        raw = self._raw_serialize(result)
+        with self._lock:
+            self.stats["calls"] += 1
+            self.stats["raw_tokens"] += estimate_tokens(raw)
+            self.stats["compact_tokens"] += estimate_tokens(compact)
+        return compact
+
+    def wrap_tool(self, tool):
+        """Bọc một tool để output của nó được format gọn trước khi vào ToolMessage"""
+        formatter = self
+
+        def _call(config: RunnableConfig, **kwargs):
+            token = _ref_owner.set(formatter._owner(config))
+            try:
+                # Tool sync chạy trong executor: đánh dấu thread cho profiler của request
+                with trace_thread():
+                    return formatter.format(tool.invoke(kwargs))
+            finally:
+                _ref_owner.reset(token)
+
+        async def _acall(config: RunnableConfig, **kwargs):
+            token = _ref_owner.set(formatter._owner(config))
+            try:
+                return formatter.format(await tool.ainvoke(kwargs))
+            finally:
+                _ref_owner.reset(token)
+
+        return StructuredTool.from_function(
+            func=_call,
+            coroutine=_acall,
+            name=tool.name,
+            description=tool.description,
+            args_schema=tool.args_schema,
+            infer_schema=False,
+        )
+
+    @staticmethod
+    def _owner(config) -> str:
+        return str(((config or {}).get("configurable") or {}).get("thread_id") or "")
+
+    def get_reference(self, ref_id: str, owner: str = None):
+        """Lấy lại nội dung đầy đủ của một field đã bị cắt (chỉ reference của session hiện tại)"""
+        ref_id = ref_id.strip().strip("[]").replace("ref:", "")
+        key = f"{_ref_owner.get() if owner is None else owner}/{ref_id}"
+        with self._lock:
+            text = self._references.get(key)
+        if text is None and self.store.shared:
+            # Reference có thể do worker khác tạo ra
+            text = self.store.get_value("tool_ref", key)
+        metrics.inc("cache_total", cache="tool_output_refs", result="hit" if text is not None else "miss")
+        return text
+
+    def get_stats(self):
+        """Thống kê số token đã tiết kiệm"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats["saved_tokens"] = stats["raw_tokens"] - stats["compact_tokens"]
+        stats["saved_ratio"] = round(stats["saved_tokens"] / stats["raw_tokens"], 3) if stats["raw_tokens"] else 0.0
+        return stats
+
+    # ----------- RENDERING -----------
+    def _raw_serialize(self, result) -> str:
+        # Giống cách ToolNode serialize output trước đây
+        try:
+            return json.dumps(result, ensure_ascii=False, default=str)
+        except Exception:
+            return str(result)
+
+    def _is_empty(self, value) -> bool:
+        if value is None:
+            return True
+        if isinstance(value, str) and value.strip() in BOILERPLATE_VALUES:
+            return True
+        if isinstance(value, (list, dict)) and len(value) == 0:
+            return True
+        return False
+
+    def _is_scalar(self, value) -> bool:
+        return not isinstance(value, (list, dict, tuple))
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = SessionStore.get_instance()
+        return self._store
+
+    def _process_prefix(self):
+        # Tiền tố ngẫu nhiên cho mỗi process (tạo lại sau khi fork)
+        if self._ref_prefix_pid != os.getpid():
+            self._ref_prefix_pid = os.getpid()
+            self._ref_prefix = os.urandom(2).hex() + "-" if self.store.shared else ""
+        return self._ref_prefix
+
+    def _store_reference(self, text: str) -> str:
+        prefix = self._process_prefix()
+        with self._lock:
+            self._ref_counter += 1
+            ref_id = f"R{prefix}{self._ref_counter}"
+            key = f"{_ref_owner.get()}/{ref_id}"
+            self._references[key] = text
+            while len(self._references) > self.max_references:
+                self._references.popitem(last=False)
+            self.stats["truncated_fields"] += 1
+        if self.store.shared:
+            self.store.set_value("tool_ref", key, text, ttl=self.reference_ttl)
+        return ref_id
+
+    def _scalar(self, value) -> str:
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        text = " ".join(str(value).split())
+        if len(text) > self.max_text_len:
+            ref_id = self._store_reference(str(value))
+            text = f"{text[:self.max_text_len].rstrip()}…[ref:{ref_id}]"
+        return text
+
+    def _cell(self, value) -> str:
+        if self._is_empty(value):
+            return ""
+        return self._scalar(value).replace("|", "/")
+
+    def _is_table(self, items) -> bool:
+        if len(items) < 2 or not all(isinstance(it, dict) for it in items):
+            return False
+        return all(self._is_scalar(v) for it in items for v in it.values())
+
+    def _render_table(self, key, items, pad):
+        columns = []
+        for it in items:
+            for k, v in it.items():
+                if k not in columns and not self._is_empty(v):
+                    columns.append(k)
+        lines = [f"{pad}{key}[{len(items)}]{{{'|'.join(columns)}}}:"]
+        for it in items:
+            lines.append(pad + "  " + "|".join(self._cell(it.get(c)) for c in columns))
+        return lines
+
+    def _render(self, value, depth=0, key="items"):
+        pad = "  " * depth
+
+        if isinstance(value, dict):
+            lines = []
+            for k, v in value.items():
+                if self._is_empty(v):
+                    continue
+                if self._is_scalar(v):
+                    lines.append(f"{pad}{k}: {self._scalar(v)}")
+                elif isinstance(v, dict):
+                    # Dict lồng nhau: giữ tên key làm tiêu đề, nội dung thụt vào 1 cấp
+                    sub = self._render(v, depth + 1, key=k)
+                    if sub:
+                        lines.append(f"{pad}{k}:")
+                        lines.extend(sub)
+                else:
+                    lines.extend(self._render(v, depth, key=k))
+            return lines
+
+        if isinstance(value, (list, tuple)):
+            items = [it for it in value if not self._is_empty(it)]
+            if not items:
+                return []
+            if self._is_table(items):
+                return self._render_table(key, items, pad)
+            if all(self._is_scalar(it) for it in items):
+                return [f"{pad}{key}: " + ", ".join(self._scalar(it) for it in items)]
+
+            lines = [f"{pad}{key}[{len(items)}]:"]
+            for it in items:
+                sub = self._render(it, depth + 2, key=key) if not self._is_scalar(it) else [f"{pad}    {self._scalar(it)}"]
+                if sub:
+                    sub[0] = f"{pad}  - " + sub[0].lstrip()
+                lines.extend(sub)
+            return lines
+
+        return [f"{pad}{self._scalar(value)}"]
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
@@ -0,0 +1,241 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+from .tools import db_path
+from .migrations import apply_migrations
+from .metrics import metrics
+from .catalog import ProductCatalog
+
+
+class OutOfStockError(Exception):
+    """Không đủ hàng khi trừ tồn kho (đơn hàng đã được rollback)"""
+
+    def __init__(self, product_id: int, product_name: str, available: int, requested: int):
+        self.product_id = product_id
+        self.product_name = product_name
+        self.available = available
+        self.requested = requested
+        super().__init__(f"Sản phẩm '{product_name}' không đủ hàng (còn {available}, cần {requested})")
+
+
+def _is_busy(error: sqlite3.OperationalError) -> bool:
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+class InventoryManager:
+    """Trừ / hoàn tồn kho khi đặt hàng, an toàn khi nhiều khách checkout cùng lúc.
+
+    - Đặt hàng trong 1 transaction (BEGIN IMMEDIATE): tạo đơn, trừ kho có điều kiện
+      `UPDATE ... WHERE Quantity >= ?` (0 dòng bị ảnh hưởng = hết hàng -> rollback cả đơn)
+    - Không khóa ở tầng ứng dụng: transaction ngắn, gặp SQLITE_BUSY thì retry với backoff + jitter
+    - Mỗi sản phẩm của đơn Pending có 1 reservation (Held) tới ExpiresAt; thread nền hoàn kho
+      và hủy các đơn Pending có reservation hết hạn
+    - Đơn được chuyển khỏi Pending ở hệ thống quản lý đơn (ghi thẳng orders.Status): trigger của
+      migration 012 chốt reservation (Committed), hủy từ bên ngoài thì hoàn kho (Released)
+    - Sau khi fork (gunicorn preload) connection và thread nền được tạo lại trong worker
+    """
+    _instance = None
+
+    def __init__(self, DB_PATH: str = db_path, reservation_ttl: float = None, sweep_interval: float = None,
+                 max_retries: int = 5):
+        self.db_path = DB_PATH
+        self.reservation_ttl = reservation_ttl or float(os.getenv("RESERVATION_TTL_MINUTES", 30)) * 60
+        self.sweep_interval = sweep_interval or float(os.getenv("RESERVATION_SWEEP_SECONDS", 60))
+        self.max_retries = max_retries
+
+        apply_migrations(self.db_path)
+        self._init_process_state()
+
+    def _init_process_state(self):
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sweeper = None
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._init_process_state()
+
+    @property
+    def conn(self):
+        self._check_pid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: tự quản lý BEGIN IMMEDIATE / COMMIT
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, name: str, fn, *args):
+        """Chạy fn(conn, *args) trong 1 write transaction, retry khi DB đang bận"""
+        conn = self.conn
+        for attempt in range(self.max_retries + 1):
+            try:
+                with metrics.timer("inventory_txn", help="Thời gian transaction tồn kho", op=name):
+                    conn.execute("BEGIN IMMEDIATE")
+                    try:
+                        result = fn(conn, *args)
+                    except BaseException:
+                        conn.execute("ROLLBACK")
+                        raise
+                    conn.execute("COMMIT")
+                return result
+            except sqlite3.OperationalError as e:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                if not _is_busy(e) or attempt == self.max_retries:
+                    raise
+                metrics.inc("inventory_retries_total", op=name, help="Số lần retry transaction tồn kho do DB bận")
+                time.sleep(min(0.01 * 2 ** attempt, 0.5) * (0.5 + random.random()))
+
+    # ----------- ĐẶT HÀNG -----------
+    def place_order(self, customer_id: int, items, shipping_address: str, payment_method: str, notes: str = None):
+        """Tạo đơn Pending + trừ kho + giữ hàng. items: [{"pid", "qty", "price"}].
+        Hết hàng thì ném OutOfStockError (không có dữ liệu nào được ghi)"""
+        self._ensure_sweeper()
+        result = self._transaction("place_order", self._place_order, customer_id, items,
+                                   shipping_address, payment_method, notes)
+        ProductCatalog.get_instance().mark_dirty()
+        return result
+
+    def _place_order(self, conn, customer_id, items, shipping_address, payment_method, notes):
+        order_id = conn.execute(
+            """INSERT INTO orders (CustomerId, Status, ShippingAddress, PaymentMethod, Notes, TotalAmount)
+               VALUES (?, 'Pending', ?, ?, ?, 0)""",
+            (customer_id, shipping_address, payment_method, notes)
+        ).lastrowid
+
+        expires_at = time.time() + self.reservation_ttl
+        for item in items:
+            updated = conn.execute(
+                """UPDATE products SET Quantity = Quantity - ?, UpdatedAt = CURRENT_TIMESTAMP
+                   WHERE ProductId = ? AND IsActive = 1 AND Quantity >= ?""",
+                (item["qty"], item["pid"], item["qty"])
+            ).rowcount
+            if updated == 0:
+                row = conn.execute("SELECT ProductName, Quantity FROM products WHERE ProductId = ?",
+                                   (item["pid"],)).fetchone()
+                metrics.inc("inventory_out_of_stock_total", help="Số lần đặt hàng thất bại do hết hàng")
+                raise OutOfStockError(item["pid"], row[0] if row else item.get("name"), row[1] if row else 0, item["qty"])
+
+            conn.execute(
+                "INSERT INTO order_details (OrderId, ProductId, Quantity, UnitPrice) VALUES (?, ?, ?, ?)",
+                (order_id, item["pid"], item["qty"], item["price"])
+            )
+            conn.execute(
+                "INSERT INTO stock_reservations (OrderId, ProductId, Quantity, ExpiresAt) VALUES (?, ?, ?, ?)",
+                (order_id, item["pid"], item["qty"], expires_at)
+            )
+
+        details = conn.execute(
+            """SELECT od.ProductId, p.ProductName, od.Quantity, od.UnitPrice, od.SubTotal
+               FROM order_details od
+               JOIN products p ON od.ProductId = p.ProductId
+               WHERE od.OrderId = ?""",
+            (order_id,)
+        ).fetchall()
+        (total,) = conn.execute("SELECT TotalAmount FROM orders WHERE OrderId = ?", (order_id,)).fetchone()
+        return {"order_id": order_id, "total_amount": total, "details": details, "reserved_until": expires_at}
+
+    # ----------- HỦY ĐƠN -----------
+    def cancel_order(self, order_id: int):
+        """Hủy đơn Pending: hoàn kho phần đang giữ rồi xóa đơn. Trả về [(product_id, quantity)] đã hoàn"""
+        restored = self._transaction("cancel_order", self._cancel_order, order_id)
+        ProductCatalog.get_instance().mark_dirty()
+        return restored
+
+    def _cancel_order(self, conn, order_id):
+        status = conn.execute("SELECT Status FROM orders WHERE OrderId = ?", (order_id,)).fetchone()
+        if not status or status[0] != "Pending":
+            return []
+
+        held = conn.execute(
+            "SELECT ProductId, Quantity FROM stock_reservations WHERE OrderId = ? AND Status = 'Held'",
+            (order_id,)
+        ).fetchall()
+        has_reservations = conn.execute(
+            "SELECT 1 FROM stock_reservations WHERE OrderId = ? LIMIT 1", (order_id,)
+        ).fetchone()
+        # Đơn tạo trước khi có reservation: hoàn kho theo order_details
+        restored = held if has_reservations else conn.execute(
+            "SELECT ProductId, Quantity FROM order_details WHERE OrderId = ?", (order_id,)
+        ).fetchall()
+
+        conn.executemany(
+            "UPDATE products SET Quantity = Quantity + ? WHERE ProductId = ?",
+            [(qty, pid) for pid, qty in restored]
+        )
+        conn.execute("UPDATE stock_reservations SET Status = 'Released' WHERE OrderId = ? AND Status = 'Held'",
+                     (order_id,))
+        conn.execute("DELETE FROM order_details WHERE OrderId = ?", (order_id,))
+        conn.execute("DELETE FROM orders WHERE OrderId = ?", (order_id,))
+        return restored
+
+    # ----------- THU HỒI HÀNG HẾT HẠN -----------
+    def release_expired(self, now: float = None):
+        """Hoàn kho các reservation hết hạn của đơn còn Pending (và hủy đơn). Trả về số reservation được xử lý"""
+        released = self._transaction("release_expired", self._release_expired, now or time.time())
+        if released:
+            metrics.inc("inventory_expired_total", released, help="Số reservation hết hạn đã được hoàn kho")
+            ProductCatalog.get_instance().mark_dirty()
+        return released
+
+    def _release_expired(self, conn, now):
+        expired = conn.execute(
+            """SELECT r.ReservationId, r.OrderId, r.ProductId, r.Quantity, o.Status
+               FROM stock_reservations r
+               LEFT JOIN orders o ON o.OrderId = r.OrderId
+               WHERE r.Status = 'Held' AND r.ExpiresAt < ?""",
+            (now,)
+        ).fetchall()
+        if not expired:
+            return 0
+
+        # Đơn đã rời trạng thái Pending (đang xử lý / đã giao) thì giữ nguyên số đã trừ
+        pending = [r for r in expired if r[4] == "Pending" or r[4] is None]
+        done = [r for r in expired if r not in pending]
+
+        conn.executemany("UPDATE products SET Quantity = Quantity + ? WHERE ProductId = ?",
+                         [(qty, pid) for _, _, pid, qty, _ in pending])
+        conn.executemany("UPDATE stock_reservations SET Status = 'Expired' WHERE ReservationId = ?",
+                         [(rid,) for rid, *_ in pending])
+        conn.executemany("UPDATE stock_reservations SET Status = 'Committed' WHERE ReservationId = ?",
+                         [(rid,) for rid, *_ in done])
+        conn.executemany("UPDATE orders SET Status = 'Cancelled' WHERE OrderId = ? AND Status = 'Pending'",
+                         [(oid,) for oid in {r[1] for r in pending}])
+        return len(expired)
+
+    def start_sweeper(self):
+        """Chạy thread nền thu hồi hàng giữ quá hạn (gọi khi server khởi động)"""
+        self._ensure_sweeper()
+
+    def _ensure_sweeper(self):
+        self._check_pid()
+        if self._sweeper is not None:
+            return
+        with self._lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._run_sweeper, name="inventory-sweeper", daemon=True)
+                self._sweeper.start()
+
+    def _run_sweeper(self):
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                self.release_expired()
+            except Exception as e:
+                print(f"❌ Lỗi khi thu hồi hàng giữ quá hạn: {e}")
+
+    def close(self):
+        self._stop.set()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
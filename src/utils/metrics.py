@@ -0,0 +1,378 @@
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Bucket (giây) cho histogram latency: từ truy vấn SQL (ms) tới lời gọi LLM (chục giây)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+_trace_spans = contextvars.ContextVar("trace_spans", default=None)
+_trace_start = contextvars.ContextVar("trace_start", default=None)
+
+
+def get_trace_id():
+    """Trace id của request hiện tại (None nếu không nằm trong trace)"""
+    return _trace_id.get()
+
+
+def get_trace_spans():
+    """Danh sách span của trace hiện tại, sắp xếp theo thời điểm bắt đầu (start_ms tính từ đầu trace)"""
+    spans = _trace_spans.get()
+    return sorted(spans, key=lambda s: s["start_ms"]) if spans is not None else []
+
+
+@contextmanager
+def start_trace(trace_id: str = None):
+    """Mở một trace cho 1 request: mọi timer bên trong được gắn vào trace này"""
+    trace_id = trace_id or uuid.uuid4().hex[:16]
+    id_token = _trace_id.set(trace_id)
+    spans_token = _trace_spans.set([])
+    start_token = _trace_start.set(time.perf_counter())
+    try:
+        yield trace_id
+    finally:
+        _trace_id.reset(id_token)
+        _trace_spans.reset(spans_token)
+        _trace_start.reset(start_token)
+
+
+def _label_key(labels: dict):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra=None):
+    items = list(key) + (extra or [])
+    if not items:
+        return ""
+    escaped = [(k, v.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")) for k, v in items]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+class MetricsRegistry:
+    """Registry counter / histogram, xuất ra định dạng text của Prometheus (/metrics).
+
+    - shared (METRICS_STORE=sqlite, mặc định): RAM chỉ giữ phần tăng thêm chưa ghi, thread nền cộng dồn vào
+      bảng metric_series của store.db mỗi flush_interval giây (METRICS_FLUSH_SECONDS). /metrics flush rồi đọc
+      tổng của mọi worker, worker restart (max_requests) không làm counter bị reset
+    - METRICS_STORE=memory: registry trong process như trước (chỉ đúng khi chạy 1 worker)
+    - Sau khi fork (gunicorn preload) buffer, lock, connection và thread nền được tạo lại trong worker;
+      phần chưa ghi của process cha không bị tính lại ở process con
+    """
+    _instance = None
+
+    def __init__(self, prefix: str = "smartshop", buckets=DEFAULT_BUCKETS, shared: bool = None,
+                 DB_PATH: str = None, flush_interval: float = None):
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self.shared = os.getenv("METRICS_STORE", "sqlite") != "memory" if shared is None else shared
+        self.db_path = DB_PATH
+        self.flush_interval = flush_interval or float(os.getenv("METRICS_FLUSH_SECONDS", 5))
+        self._help = {}
+        self._init_process_state()
+
+    def _init_process_state(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._counters = {}    # name -> {label_key: value}
+        self._histograms = {}  # name -> {label_key: [bucket_counts, sum, count]}
+        self._conn = None
+        self._stop = threading.Event()
+        self._flusher = None
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._init_process_state()
+        if self.shared and self._flusher is None:
+            with self._lock:
+                if self._flusher is None:
+                    self._flusher = threading.Thread(target=self._run_flusher, name="metrics-flush", daemon=True)
+                    self._flusher.start()
+
+    # ----------- RECORD -----------
+    def inc(self, name: str, value: float = 1.0, help: str = None, **labels):
+        key = _label_key(labels)
+        self._check_pid()
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+            if help:
+                self._help.setdefault(name, help)
+
+    def observe(self, name: str, value: float, help: str = None, **labels):
+        key = _label_key(labels)
+        self._check_pid()
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+            if help:
+                self._help.setdefault(name, help)
+
+    @contextmanager
+    def timer(self, name: str, help: str = None, **labels):
+        """Đo thời gian một khối code: histogram <name>_seconds, lỗi -> errors_total, span vào trace hiện tại"""
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.record_span(name, time.perf_counter() - start, error, help=help, **labels)
+
+    def record_span(self, name: str, seconds: float, error: str = None, help: str = None, **labels):
+        self.observe(f"{name}_seconds", seconds, help=help, **labels)
+        if error:
+            self.inc("errors_total", component=name, error=error, **labels)
+        spans = _trace_spans.get()
+        if spans is not None:
+            start_ms = (time.perf_counter() - seconds - _trace_start.get()) * 1000
+            spans.append({"name": name, **labels, "start_ms": round(start_ms, 3),
+                          "duration_ms": round(seconds * 1000, 3), "error": error})
+
+    # ----------- SHARED STORE -----------
+    @property
+    def conn(self):
+        if self._conn is None:
+            # Import muộn: tools / migrations import module này
+            from .tools import db_path
+            from .migrations import apply_migrations
+            self.db_path = self.db_path or db_path
+            try:
+                apply_migrations(self.db_path)
+            except sqlite3.IntegrityError:
+                # Worker khác vừa áp dụng cùng migration -> chạy lại để kiểm tra phần còn lại
+                apply_migrations(self.db_path)
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._conn = conn
+        return self._conn
+
+    def _run_flusher(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Lỗi khi ghi metrics: {e}")
+
+    def flush(self):
+        """Cộng phần tăng thêm của process này vào metric_series, trả về số series đã ghi"""
+        if not self.shared:
+            return 0
+        self._check_pid()
+        with self._write_lock:
+            with self._lock:
+                counters, self._counters = self._counters, {}
+                histograms, self._histograms = self._histograms, {}
+                help_text = dict(self._help)
+            if not counters and not histograms:
+                return 0
+            try:
+                self._write(counters, histograms, help_text)
+            except Exception:
+                # Ghi lỗi (DB bận...) -> trả delta về buffer để lần sau ghi tiếp
+                with self._lock:
+                    for name, series in counters.items():
+                        for key, value in series.items():
+                            self._add_counter(name, key, value)
+                    for name, series in histograms.items():
+                        for key, state in series.items():
+                            self._add_histogram(name, key, state)
+                raise
+        return sum(map(len, counters.values())) + sum(map(len, histograms.values()))
+
+    def _add_counter(self, name, key, value):
+        series = self._counters.setdefault(name, {})
+        series[key] = series.get(key, 0.0) + value
+
+    def _add_histogram(self, name, key, state):
+        current = self._histograms.setdefault(name, {}).setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+        current[0] = [a + b for a, b in zip(current[0], state[0])]
+        current[1] += state[1]
+        current[2] += state[2]
+
+    def _write(self, counters, histograms, help_text):
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO metric_series (Name, Labels, Kind, Value, Help) VALUES (?, ?, 'counter', ?, ?) "
+                "ON CONFLICT (Name, Labels) DO UPDATE SET Value = Value + excluded.Value, "
+                "Help = COALESCE(excluded.Help, Help), UpdatedAt = CURRENT_TIMESTAMP",
+                [(name, json.dumps(key, ensure_ascii=False), value, help_text.get(name))
+                 for name, series in counters.items() for key, value in series.items()]
+            )
+            for name, series in histograms.items():
+                for key, (bucket_counts, total, count) in series.items():
+                    labels = json.dumps(key, ensure_ascii=False)
+                    row = conn.execute("SELECT Buckets FROM metric_series WHERE Name = ? AND Labels = ?",
+                                       (name, labels)).fetchone()
+                    stored = json.loads(row[0]) if row and row[0] else []
+                    if len(stored) == len(bucket_counts):
+                        bucket_counts = [a + b for a, b in zip(stored, bucket_counts)]
+                    conn.execute(
+                        "INSERT INTO metric_series (Name, Labels, Kind, Value, Count, Buckets, Help) "
+                        "VALUES (?, ?, 'histogram', ?, ?, ?, ?) "
+                        "ON CONFLICT (Name, Labels) DO UPDATE SET Value = Value + excluded.Value, "
+                        "Count = Count + excluded.Count, Buckets = excluded.Buckets, "
+                        "Help = COALESCE(excluded.Help, Help), UpdatedAt = CURRENT_TIMESTAMP",
+                        (name, labels, total, count, json.dumps(bucket_counts), help_text.get(name))
+                    )
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def _read_shared(self):
+        counters, histograms, help_text = {}, {}, {}
+        rows = self.conn.execute("SELECT Name, Labels, Kind, Value, Count, Buckets, Help FROM metric_series").fetchall()
+        for name, labels, kind, value, count, buckets, help in rows:
+            key = tuple(tuple(item) for item in json.loads(labels))
+            if kind == "counter":
+                counters.setdefault(name, {})[key] = value
+            else:
+                bucket_counts = json.loads(buckets) if buckets else []
+                if len(bucket_counts) != len(self.buckets):
+                    bucket_counts = [count] * len(self.buckets)
+                histograms.setdefault(name, {})[key] = (bucket_counts, value, count)
+            if help:
+                help_text[name] = help
+        return counters, histograms, help_text
+
+    # ----------- EXPORT -----------
+    def render_prometheus(self) -> str:
+        """Text Prometheus: tổng của mọi worker (shared) hoặc của process này (memory)"""
+        if self.shared:
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Lỗi khi ghi metrics: {e}")
+            with self._write_lock:
+                counters, histograms, help_text = self._read_shared()
+        else:
+            with self._lock:
+                counters = {name: dict(series) for name, series in self._counters.items()}
+                histograms = {name: {k: (list(s[0]), s[1], s[2]) for k, s in series.items()}
+                              for name, series in self._histograms.items()}
+                help_text = dict(self._help)
+        return self._render(counters, histograms, help_text)
+
+    def _render(self, counters, histograms, help_text) -> str:
+        lines = []
+        for name, series in sorted(counters.items()):
+            full = f"{self.prefix}_{name}"
+            if name in help_text:
+                lines.append(f"# HELP {full} {help_text[name]}")
+            lines.append(f"# TYPE {full} counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{full}{_format_labels(key)} {value:g}")
+
+        for name, series in sorted(histograms.items()):
+            full = f"{self.prefix}_{name}"
+            if name in help_text:
+                lines.append(f"# HELP {full} {help_text[name]}")
+            lines.append(f"# TYPE {full} histogram")
+            for key, (bucket_counts, total, count) in sorted(series.items()):
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    lines.append(f"{full}_bucket{_format_labels(key, [('le', f'{bound:g}')])} {bucket_count}")
+                lines.append(f"{full}_bucket{_format_labels(key, [('le', '+Inf')])} {count}")
+                lines.append(f"{full}_sum{_format_labels(key)} {total:.6f}")
+                lines.append(f"{full}_count{_format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """Xoá số liệu của process này (shared: cả bảng metric_series)"""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+        if self.shared:
+            with self._write_lock:
+                with self.conn:
+                    self.conn.execute("DELETE FROM metric_series")
+
+    def close(self):
+        """Dừng thread nền và ghi nốt phần tăng thêm còn lại (gọi khi tắt server)"""
+        self._stop.set()
+        if self._flusher is not None and self._pid == os.getpid():
+            self._flusher.join(timeout=5)
+        self.flush()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+
+metrics = MetricsRegistry.get_instance()
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Callback LangChain ghi metrics cho từng node của StateGraph, từng tool và token của LLM"""
+    # Chỉ ghi số liệu trong bộ nhớ: chạy ngay trên event loop thay vì đẩy sang thread pool (ainvoke)
+    run_inline = True
+
+    def __init__(self, registry: MetricsRegistry = None):
+        self.registry = registry or metrics
+        self._starts = {}
+
+    # ----------- GRAPH NODES -----------
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        name = kwargs.get("name")
+        if metadata and name and metadata.get("langgraph_node") == name:
+            self._starts[run_id] = ("graph_node", {"node": name}, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        # interrupt() (chờ xác nhận tool nhạy cảm) không phải lỗi
+        self._finish(run_id, None if type(error).__name__ == "GraphInterrupt" else type(error).__name__)
+
+    # ----------- TOOLS -----------
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name", "unknown")
+        self._starts[run_id] = ("tool", {"tool": name}, time.perf_counter())
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, type(error).__name__)
+
+    # ----------- LLM -----------
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._starts[run_id] = ("llm_call", {}, time.perf_counter())
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._finish(run_id)
+        for generations in response.generations:
+            for gen in generations:
+                usage = getattr(getattr(gen, "message", None), "usage_metadata", None) or {}
+                for token_type in ("input_tokens", "output_tokens"):
+                    if usage.get(token_type):
+                        self.registry.inc("llm_tokens_total", usage[token_type],
+                                          help="Số token LLM (Gemini usage metadata)", type=token_type.split("_")[0])
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, type(error).__name__)
+
+    def _finish(self, run_id, error=None):
+        started = self._starts.pop(run_id, None)
+        if started is not None:
+            name, labels, start = started
+            self.registry.record_span(name, time.perf_counter() - start, error, **labels)
@@ -0,0 +1,39 @@
+import sqlite3
+import os
+from .tools import db_path
+
+PROJECT_DIR = os.path.abspath(os.path.join(__file__, "..", "..", ".."))
+migrations_dir = os.path.join(PROJECT_DIR, "database", "repo", "migrations")
+
+_applied_paths = set()
+
+def apply_migrations(DB_PATH = db_path, MIGRATIONS_DIR = migrations_dir):
+    """Chạy các file migrations/*.sql chưa được áp dụng (theo thứ tự tên file)"""
+    if DB_PATH in _applied_paths:
+        return []
+
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    try:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                Version TEXT PRIMARY KEY,
+                AppliedAt DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        applied = {r[0] for r in conn.execute("SELECT Version FROM schema_migrations")}
+
+        newly_applied = []
+        for file_name in sorted(os.listdir(MIGRATIONS_DIR)):
+            if not file_name.endswith(".sql") or file_name in applied:
+                continue
+            with open(os.path.join(MIGRATIONS_DIR, file_name), "r", encoding="utf-8") as f:
+                script = f.read()
+            # executescript tự COMMIT trước khi chạy -> bọc trong transaction riêng
+            conn.executescript(f"BEGIN;\n{script}\nINSERT INTO schema_migrations (Version) VALUES ('{file_name}');\nCOMMIT;")
+            newly_applied.append(file_name)
+            print(f"✅ Đã áp dụng migration: {file_name}")
+    finally:
+        conn.close()
+
+    _applied_paths.add(DB_PATH)
+    return newly_applied
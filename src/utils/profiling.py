@@ -0,0 +1,258 @@
+import asyncio
+import functools
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from .metrics import metrics, get_trace_id, get_trace_spans
+
+PROJECT_DIR = os.path.abspath(os.path.join(__file__, "..", "..", ".."))
+slow_request_dir = os.path.join(PROJECT_DIR, "logs", "slow_requests")
+
+# Frame lá của thread đang rảnh (chờ lock / chờ việc) -> bỏ qua khi lấy mẫu
+_IDLE_FRAMES = {
+    ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"), ("queue.py", "get"), ("thread.py", "_worker"),
+}
+
+# Trace đang được profile và thread đang làm việc cho chúng (thread ident -> Counter(trace_id)).
+# Request chạy trên nhiều thread (to_thread, executor của tool, thread của AsyncDatabase / EmbeddingBatcher),
+# các thread này tự đánh dấu bằng trace_thread() để StackSampler biết thread nào thuộc request
+_profiled_traces = set()
+_thread_traces = {}
+_thread_traces_lock = threading.Lock()
+
+
+@contextmanager
+def trace_thread(trace_ids=None):
+    """Đánh dấu thread hiện tại đang chạy cho trace (mặc định trace của context hiện tại).
+    Chỉ ghi nhận trace đang được profile nên bình thường gần như không tốn gì"""
+    ids = [get_trace_id()] if trace_ids is None else trace_ids
+    ids = [t for t in ids if t in _profiled_traces]
+    if not ids:
+        yield
+        return
+    ident = threading.get_ident()
+    with _thread_traces_lock:
+        _thread_traces.setdefault(ident, Counter()).update(ids)
+    try:
+        yield
+    finally:
+        with _thread_traces_lock:
+            counter = _thread_traces[ident]
+            counter.subtract(ids)
+            for t in ids:
+                if counter[t] <= 0:
+                    del counter[t]
+            if not counter:
+                del _thread_traces[ident]
+
+
+def traced(fn):
+    """Bọc hàm sẽ chạy ở thread khác (asyncio.to_thread copy context nên trace id vẫn đúng)"""
+    @functools.wraps(fn)
+    def _traced(*args, **kwargs):
+        with trace_thread():
+            return fn(*args, **kwargs)
+    return _traced
+
+
+class StackSampler:
+    """Sampling profiler: định kỳ lấy stack qua sys._current_frames().
+
+    Chi phí thấp, không cần cProfile nên bật được trong production (opt-in).
+    Stack ghép dạng "file:func;file:func" (collapsed, dùng được cho flamegraph).
+    - thread_ids: chỉ lấy mẫu các thread này (None = mọi thread)
+    - task: request chạy trên event loop dùng chung -> chỉ lấy mẫu khi task đang chạy của loop là task này,
+      lúc loop đang chạy request khác thì bỏ qua (đếm vào other_samples)
+    - trace_id: lấy mẫu thêm các thread đang đánh dấu trace_thread() cho trace này
+    """
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 64, thread_ids=None, task=None, trace_id=None):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.thread_ids = set(thread_ids) if thread_ids is not None else None
+        self.task = task
+        self.trace_id = trace_id
+        self._loop = task.get_loop() if task is not None else None
+        self.stacks = Counter()
+        self.threads = Counter()
+        self.samples = 0
+        self.other_samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        names = None
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            traced = self.trace_id is not None and self.trace_id in _thread_traces.get(thread_id, ())
+            if not traced and self.thread_ids is not None and thread_id not in self.thread_ids:
+                continue
+            code = frame.f_code
+            if (os.path.basename(code.co_filename), code.co_name) in _IDLE_FRAMES:
+                continue
+            if not traced and self.task is not None and asyncio.current_task(self._loop) is not self.task:
+                self.other_samples += 1
+                continue
+
+            if names is None:
+                names = {t.ident: t.name for t in threading.enumerate()}
+            self.threads[names.get(thread_id, str(thread_id))] += 1
+
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def report(self, top: int = 30):
+        """Top stack và top function (self = ở đỉnh stack, total = có mặt trong stack)"""
+        self_counts, total_counts = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            funcs = stack.split(";")
+            self_counts[funcs[-1]] += count
+            for func in set(funcs):
+                total_counts[func] += count
+
+        return {
+            "samples": self.samples,
+            "other_samples": self.other_samples,
+            "interval_ms": self.interval * 1000,
+            "threads": dict(self.threads.most_common()),
+            "top_functions": [
+                {"function": func, "self": self_counts[func], "total": count}
+                for func, count in total_counts.most_common(top)
+            ],
+            "top_self": self_counts.most_common(top),
+            "top_stacks": self.stacks.most_common(top),
+        }
+
+
+class RequestProfiler:
+    """Profiling theo request cho /chat.
+
+    - Bật bằng header (force, chỉ khi khớp PROFILE_TOKEN) hoặc lấy mẫu ngẫu nhiên theo sample_rate
+    - Chỉ lấy mẫu thread (và asyncio task) đang xử lý request cùng các thread đang chạy việc của request
+      (to_thread, tool, SQL, embedding; xem trace_thread), không lẫn stack của các request chạy song song
+    - Request chậm hơn slow_ms (hoặc bị force) được ghi ra dump_dir: các bước graph theo thứ tự
+      kèm thời gian, CPU profile (nếu có lấy mẫu) và toàn bộ message của session
+    - dump_dir xoay vòng, chỉ giữ max_files file mới nhất
+    """
+    _instance = None
+
+    def __init__(self,
+                 sample_rate: float = None,
+                 slow_ms: float = None,
+                 dump_dir: str = None,
+                 max_files: int = None,
+                 interval: float = 0.005):
+        self.sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", 0.0)) if sample_rate is None else sample_rate
+        self.slow_ms = float(os.getenv("SLOW_REQUEST_MS", 5000)) if slow_ms is None else slow_ms
+        self.dump_dir = os.getenv("SLOW_REQUEST_DIR", slow_request_dir) if dump_dir is None else dump_dir
+        self.max_files = int(os.getenv("SLOW_REQUEST_MAX_FILES", 50)) if max_files is None else max_files
+        self.interval = interval
+        self.token = os.getenv("PROFILE_TOKEN", "")
+        self._lock = threading.Lock()
+
+    def authorized(self, header_value: str) -> bool:
+        """Header X-Profile chỉ có hiệu lực khi khớp PROFILE_TOKEN (không đặt token = bỏ qua header):
+        dump chứa toàn bộ message của session"""
+        return bool(self.token) and bool(header_value) and hmac.compare_digest(header_value, self.token)
+
+    @contextmanager
+    def profile(self, force: bool = False, messages_fn=None, **info):
+        """Bọc xử lý 1 request. messages_fn() chỉ được gọi khi cần ghi dump.
+        Yield dict kết quả: duration_ms, sampled, dump_path (nếu có ghi)."""
+        sampled = force or (self.sample_rate > 0 and random.random() < self.sample_rate)
+        sampler = None
+        trace_id = get_trace_id()
+        if sampled:
+            try:
+                task = asyncio.current_task()
+            except RuntimeError:
+                task = None  # không chạy trong event loop
+            if trace_id is not None:
+                _profiled_traces.add(trace_id)
+            sampler = StackSampler(self.interval, thread_ids={threading.get_ident()}, task=task,
+                                   trace_id=trace_id).start()
+        result = {"sampled": sampled, "dump_path": None}
+        start = time.perf_counter()
+        try:
+            yield result
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            if sampler is not None:
+                sampler.stop()
+                _profiled_traces.discard(trace_id)
+            result["duration_ms"] = round(duration_ms, 3)
+
+            if force or duration_ms >= self.slow_ms:
+                metrics.inc("slow_requests_total", forced=str(force).lower())
+                try:
+                    result["dump_path"] = self._dump(info, duration_ms, sampler, messages_fn)
+                except Exception as e:
+                    print(f"❌ Lỗi khi ghi slow request: {e}")
+
+    def _dump(self, info, duration_ms, sampler, messages_fn):
+        steps = get_trace_spans()
+        breakdown = {}
+        for step in steps:
+            entry = breakdown.setdefault(step["name"], {"count": 0, "total_ms": 0.0})
+            entry["count"] += 1
+            entry["total_ms"] = round(entry["total_ms"] + step["duration_ms"], 3)
+
+        record = {
+            **info,
+            "timestamp": datetime.now().isoformat(),
+            "duration_ms": round(duration_ms, 3),
+            "breakdown": breakdown,
+            "steps": steps,
+            "profile": sampler.report() if sampler is not None else None,
+            "messages": messages_fn() if messages_fn else None,
+        }
+
+        os.makedirs(self.dump_dir, exist_ok=True)
+        file_name = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}_{info.get('trace_id') or 'request'}.json"
+        path = os.path.join(self.dump_dir, file_name)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False, indent=2, default=str)
+        self._rotate()
+        print(f"🐢 Request chậm ({duration_ms:.0f} ms) đã được ghi tại {path}")
+        return path
+
+    def _rotate(self):
+        with self._lock:
+            files = sorted(f for f in os.listdir(self.dump_dir) if f.endswith(".json"))
+            for old in files[:max(0, len(files) - self.max_files)]:
+                os.remove(os.path.join(self.dump_dir, old))
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
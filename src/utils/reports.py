@@ -0,0 +1,185 @@
+import sqlite3
+import sys
+from .tools import db_path
+from .migrations import apply_migrations
+from .async_db import Query
+
+# Đơn "đã bán" (giống các view báo cáo trong schema.sql)
+SOLD_STATUSES = "('Completed', 'Delivered')"
+
+# Aggregate đầy đủ từ orders / order_details: dùng cho rebuild và verify.
+# table -> (cột, câu SELECT, cột đếm: dòng có giá trị 0 là dòng không còn đơn nào)
+_FULL_AGGREGATES = {
+    "report_customer_summary": (
+        "CustomerId, TotalOrders, CompletedOrderValue, TotalOrderValue, LastOrderDate",
+        """SELECT CustomerId, COUNT(*),
+                  SUM(CASE WHEN Status = 'Completed' THEN TotalAmount ELSE 0 END),
+                  SUM(TotalAmount), MAX(OrderDate)
+           FROM orders GROUP BY CustomerId""",
+        "TotalOrders",
+    ),
+    "report_product_sales": (
+        "ProductId, TotalSold, Revenue, LineCount, UnitPriceSum",
+        f"""SELECT od.ProductId, SUM(od.Quantity), SUM(od.SubTotal), COUNT(*), SUM(od.UnitPrice)
+            FROM order_details od JOIN orders o ON o.OrderId = od.OrderId
+            WHERE o.Status IN {SOLD_STATUSES}
+            GROUP BY od.ProductId""",
+        "LineCount",
+    ),
+    "report_daily_sales": (
+        "SaleDate, TotalOrders, TotalSales, CompletedOrders, CompletedSales",
+        f"""SELECT DATE(OrderDate), COUNT(*), SUM(TotalAmount),
+                   SUM(Status IN {SOLD_STATUSES}),
+                   SUM(CASE WHEN Status IN {SOLD_STATUSES} THEN TotalAmount ELSE 0 END)
+            FROM orders GROUP BY DATE(OrderDate)""",
+        "TotalOrders",
+    ),
+    "report_daily_customers": (
+        "SaleDate, CustomerId, Orders",
+        "SELECT DATE(OrderDate), CustomerId, COUNT(*) FROM orders GROUP BY DATE(OrderDate), CustomerId",
+        "Orders",
+    ),
+}
+
+# ----------- QUERY PLAN ĐỌC BÁO CÁO (chạy bằng run_plan / arun_plan hoặc yield from trong tool) -----------
+_CUSTOMER_SORT = {"value": "s.TotalOrderValue", "completed": "s.CompletedOrderValue",
+                  "orders": "s.TotalOrders", "recent": "s.LastOrderDate"}
+_PRODUCT_SORT = {"revenue": "s.Revenue", "sold": "s.TotalSold"}
+
+
+def customer_summary(limit: int = 20, sort_by: str = "value"):
+    """Top khách hàng theo tổng giá trị đơn (value | completed | orders | recent)"""
+    order = _CUSTOMER_SORT.get(sort_by)
+    if order is None:
+        raise ValueError(f"sort_by phải là một trong {tuple(_CUSTOMER_SORT)}")
+    rows = yield Query(
+        f"""SELECT s.CustomerId, c.Name, c.Email, s.TotalOrders, s.CompletedOrderValue,
+                   s.TotalOrderValue, s.LastOrderDate
+            FROM report_customer_summary s
+            JOIN customers c ON c.CustomerId = s.CustomerId
+            WHERE s.TotalOrders > 0
+            ORDER BY {order} DESC LIMIT ?""",
+        (limit,), fetch=True
+    )
+    return [
+        {"customer_id": r[0], "name": r[1], "email": r[2], "total_orders": r[3],
+         "completed_order_value": r[4], "total_order_value": r[5], "last_order_date": r[6]}
+        for r in rows
+    ]
+
+
+def product_sales(limit: int = 20, sort_by: str = "revenue"):
+    """Top sản phẩm bán chạy (revenue | sold), chỉ tính đơn Completed / Delivered"""
+    order = _PRODUCT_SORT.get(sort_by)
+    if order is None:
+        raise ValueError(f"sort_by phải là một trong {tuple(_PRODUCT_SORT)}")
+    rows = yield Query(
+        f"""SELECT s.ProductId, p.ProductName, c.CategoryName, p.Price, p.Quantity,
+                   s.TotalSold, s.Revenue, s.UnitPriceSum * 1.0 / s.LineCount
+            FROM report_product_sales s
+            JOIN products p ON p.ProductId = s.ProductId
+            JOIN categories c ON c.CategoryId = p.CategoryId
+            WHERE s.LineCount > 0 AND p.IsActive = 1
+            ORDER BY {order} DESC LIMIT ?""",
+        (limit,), fetch=True
+    )
+    return [
+        {"product_id": r[0], "name": r[1], "category_name": r[2], "price": r[3], "stock_quantity": r[4],
+         "total_sold": r[5], "revenue": r[6], "avg_sell_price": round(r[7], 2)}
+        for r in rows
+    ]
+
+
+def daily_sales(days: int = 30, date_from: str = None, date_to: str = None):
+    """Doanh số theo ngày (mới nhất trước): days ngày gần nhất có đơn, hoặc khoảng [date_from, date_to]"""
+    where, params = [], []
+    if date_from:
+        where.append("d.SaleDate >= ?")
+        params.append(date_from)
+    if date_to:
+        where.append("d.SaleDate <= ?")
+        params.append(date_to)
+    rows = yield Query(
+        f"""SELECT d.SaleDate, d.TotalOrders,
+                   (SELECT COUNT(*) FROM report_daily_customers dc WHERE dc.SaleDate = d.SaleDate),
+                   d.CompletedSales, d.TotalSales,
+                   CASE WHEN d.CompletedOrders > 0 THEN d.CompletedSales * 1.0 / d.CompletedOrders END
+            FROM report_daily_sales d
+            WHERE d.TotalOrders > 0 {''.join(' AND ' + w for w in where)}
+            ORDER BY d.SaleDate DESC LIMIT ?""",
+        (*params, days), fetch=True
+    )
+    return [
+        {"sale_date": r[0], "total_orders": r[1], "unique_customers": r[2], "completed_sales": r[3],
+         "total_sales": r[4], "avg_order_value": round(r[5], 2) if r[5] is not None else None}
+        for r in rows
+    ]
+
+
+# ----------- BACKFILL / KIỂM TRA -----------
+class ReportStore:
+    """Bảng tổng hợp báo cáo (migration 006) được trigger cập nhật tăng dần khi có đơn mới / đổi trạng thái.
+
+    - rebuild(): tính lại toàn bộ từ orders / order_details trong 1 transaction (backfill, sửa lệch)
+    - verify(): so bảng tổng hợp với aggregate đầy đủ, trả về các bảng bị lệch
+    - Backfill dữ liệu cũ nằm trong migration 011_report_backfill.sql (cùng transaction, không phụ thuộc thứ tự
+      khởi tạo các singleton)
+    """
+    _instance = None
+
+    def __init__(self, DB_PATH: str = db_path):
+        self.db_path = DB_PATH
+        apply_migrations(self.db_path)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def rebuild(self):
+        """Tính lại toàn bộ bảng tổng hợp, trả về số dòng của từng bảng"""
+        conn = self._connect()
+        counts = {}
+        try:
+            with conn:
+                for table, (columns, select, _) in _FULL_AGGREGATES.items():
+                    conn.execute(f"DELETE FROM {table}")
+                    counts[table] = conn.execute(f"INSERT INTO {table} ({columns}) {select}").rowcount
+        finally:
+            conn.close()
+        print(f"✅ Đã rebuild bảng báo cáo: {counts}")
+        return counts
+
+    def verify(self):
+        """Trả về {table: số dòng lệch} (rỗng nếu bảng tổng hợp khớp với dữ liệu gốc)"""
+        conn = self._connect()
+        mismatches = {}
+        try:
+            for table, (columns, select, count_column) in _FULL_AGGREGATES.items():
+                # Bỏ các dòng đã về 0 (khách / ngày / sản phẩm không còn đơn)
+                stored = f"SELECT {columns} FROM {table} WHERE {count_column} != 0"
+                diff = sum(
+                    conn.execute(f"SELECT COUNT(*) FROM ({a} EXCEPT {b})").fetchone()[0]
+                    for a, b in ((stored, select), (select, stored))
+                )
+                if diff:
+                    mismatches[table] = diff
+        finally:
+            conn.close()
+        return mismatches
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+
+if __name__ == "__main__":
+    # python -m src.utils.reports rebuild | verify
+    command = sys.argv[1] if len(sys.argv) > 1 else "verify"
+    store = ReportStore()
+    if command == "rebuild":
+        store.rebuild()
+    else:
+        mismatches = store.verify()
+        print(f"❌ Bảng báo cáo bị lệch: {mismatches}" if mismatches else "✅ Bảng báo cáo khớp với dữ liệu gốc")
+        sys.exit(1 if mismatches else 0)
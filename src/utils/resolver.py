@@ -0,0 +1,97 @@
+import re
+from .async_db import Query
+
+# Tra cứu khách hàng / đơn hàng theo định danh tự nhiên (email, số điện thoại).
+# Các hàm là query plan: dùng `yield from` trong tool (chạy được cả sync lẫn async).
+# Mọi câu SQL ở đây phải dùng index, không quét bảng: python -m benchmark.query_plans
+
+CUSTOMER_COLUMNS = "CustomerId, Name, Email, Phone, Address, CreatedAt, UpdatedAt"
+
+CUSTOMER_BY_ID = f"SELECT {CUSTOMER_COLUMNS} FROM customers WHERE CustomerId = ?"
+CUSTOMER_BY_EMAIL = f"SELECT {CUSTOMER_COLUMNS} FROM customers WHERE Email = ? COLLATE NOCASE LIMIT 1"
+CUSTOMER_BY_PHONE = f"SELECT {CUSTOMER_COLUMNS} FROM customers WHERE Phone = ? ORDER BY CustomerId LIMIT 1"
+
+# Covering index (CustomerId, Status, OrderDate, TotalAmount) / (CustomerId, OrderDate, Status, TotalAmount)
+ORDERS_BY_STATUS = """
+    SELECT OrderId, Status, OrderDate, TotalAmount FROM orders
+    WHERE CustomerId = ? AND Status = ?
+    ORDER BY OrderDate DESC LIMIT ?
+"""
+RECENT_ORDERS = """
+    SELECT OrderId, Status, OrderDate, TotalAmount FROM orders
+    WHERE CustomerId = ?
+    ORDER BY OrderDate DESC LIMIT ?
+"""
+# Giỏ hàng = các đơn Pending (view_cart, get_latest_cart)
+PENDING_ORDERS = """
+    SELECT OrderId, TotalAmount, OrderDate, ShippingAddress, PaymentMethod, Notes
+    FROM orders
+    WHERE CustomerId = ? AND Status = 'Pending'
+    ORDER BY OrderDate DESC LIMIT ?
+"""
+
+# Tên -> (SQL, tham số mẫu) để kiểm tra EXPLAIN QUERY PLAN
+LOOKUP_QUERIES = {
+    "customer_by_id": (CUSTOMER_BY_ID, (1,)),
+    "customer_by_email": (CUSTOMER_BY_EMAIL, ("vanan@gmail.com",)),
+    "customer_by_phone": (CUSTOMER_BY_PHONE, ("0905123456",)),
+    "orders_by_status": (ORDERS_BY_STATUS, (1, "Pending", 5)),
+    "recent_orders": (RECENT_ORDERS, (1, 5)),
+    "pending_orders": (PENDING_ORDERS, (1, -1)),
+}
+
+
+def normalize_email(email: str) -> str:
+    return email.strip().lower()
+
+
+def normalize_phone(phone: str) -> str:
+    """Chuẩn hóa về dạng lưu trong DB: chỉ chữ số, +84 / 84 -> 0 (vd: '+84 905-123-456' -> '0905123456')"""
+    digits = re.sub(r"\D", "", phone or "")
+    if digits.startswith("84") and len(digits) == 11:
+        digits = "0" + digits[2:]
+    return digits
+
+
+def _customer_dict(r):
+    return {
+        "customer_id": r[0],
+        "name": r[1],
+        "email": r[2],
+        "phone": r[3],
+        "address": r[4],
+        "created_at": r[5],
+        "updated_at": r[6]
+    }
+
+
+def resolve_customer(customer_id: int = None, email: str = None, phone: str = None):
+    """Tìm khách hàng theo customer_id, email hoặc số điện thoại (theo thứ tự ưu tiên).
+    Trả về (customer, error): customer là dict, error là thông báo khi không tìm thấy"""
+    if customer_id is not None:
+        rows = yield Query(CUSTOMER_BY_ID, (customer_id,), fetch=True)
+        target = f"ID {customer_id}"
+    elif email:
+        rows = yield Query(CUSTOMER_BY_EMAIL, (normalize_email(email),), fetch=True)
+        target = f"email {email}"
+    elif phone:
+        rows = yield Query(CUSTOMER_BY_PHONE, (normalize_phone(phone),), fetch=True)
+        target = f"số điện thoại {phone}"
+    else:
+        return None, "Cần customer_id, email hoặc số điện thoại của khách hàng"
+
+    if not rows:
+        return None, f"Không tìm thấy khách hàng {target}"
+    return _customer_dict(rows[0]), None
+
+
+def recent_orders(customer_id: int, status: str = None, limit: int = 5):
+    """Các đơn gần nhất của khách hàng (lọc theo trạng thái nếu có), chỉ đọc từ index"""
+    if status:
+        rows = yield Query(ORDERS_BY_STATUS, (customer_id, status, limit), fetch=True)
+    else:
+        rows = yield Query(RECENT_ORDERS, (customer_id, limit), fetch=True)
+    return [
+        {"order_id": r[0], "status": r[1], "order_date": r[2], "total_amount": r[3]}
+        for r in rows
+    ]
@@ -0,0 +1,280 @@
+import os
+import sqlite3
+import sys
+import threading
+import numpy as np
+from .tools import db_path
+from .migrations import apply_migrations
+from .metrics import metrics
+from .vector_codec import encode_vector, load_matrix
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+class SessionClusterer:
+    """Phân cụm chat_sessions theo nội dung, ghi vào conversation_clusters / session_clusters.
+
+    - Vector của session: SummaryEmbedding của bản tóm tắt mới nhất (embed SummaryContent nếu chưa có),
+      không có thì trung bình ContentEmbedding của chat_messages, cuối cùng là embed các tin nhắn của khách
+    - Mini-batch k-means: đọc session theo trang (keyset theo SessionId, không nạp toàn bộ), mỗi trang cập nhật
+      centroid với learning rate 1 / số session của cụm, rồi gán trang đó vào cụm gần nhất (cosine)
+    - Mỗi trang ghi session_clusters + centroid trong 1 transaction (trigger tự cập nhật SessionCount)
+    - Nhiều worker cùng chạy: vector được tính ngoài transaction, rồi mỗi trang được "nhận" bằng BEGIN IMMEDIATE:
+      nạp lại centroid (tạo mới nếu chưa có), bỏ các session worker khác vừa gán -> không tạo 2 bộ centroid,
+      không gán lại cùng 1 session
+    - Session mới: assign_session() gán online theo centroid gần nhất, không cập nhật centroid
+    """
+    _instance = None
+
+    def __init__(self, DB_PATH: str = db_path, n_clusters: int = None, batch_size: int = 5000,
+                 model_name: str = None, encoder=None):
+        self.db_path = DB_PATH
+        self.n_clusters = n_clusters or int(os.getenv("SESSION_CLUSTERS", 16))
+        self.batch_size = batch_size
+        self.model_name = model_name or os.getenv("MEMORY_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+        self._encoder = encoder
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._scheduler = None
+        apply_migrations(self.db_path)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    @property
+    def encoder(self):
+        if self._encoder is None:
+            from ..models import model_emb
+            self._encoder = model_emb
+        return self._encoder
+
+    # ----------- VECTOR CỦA SESSION -----------
+    def _session_vectors(self, conn, session_ids):
+        """Ma trận (đã chuẩn hóa) cho 1 trang session, bỏ session không có nội dung"""
+        placeholders = ",".join("?" * len(session_ids))
+        latest = (f"SessionId IN ({placeholders}) AND SummaryId = (SELECT MAX(s2.SummaryId) "
+                  "FROM conversation_summaries s2 WHERE s2.SessionId = conversation_summaries.SessionId)")
+
+        _, summary_matrix, summary_sessions = load_matrix("conversation_summaries", where=latest, params=session_ids,
+                                                          normalize=False, conn=conn, extra=("SessionId",))
+        vectors = {session_id: vec for (session_id,), vec in zip(summary_sessions, summary_matrix)}
+        missing = conn.execute(
+            f"SELECT SummaryId, SessionId, SummaryContent FROM conversation_summaries "
+            f"WHERE SummaryEmbedding IS NULL AND {latest}", session_ids
+        ).fetchall()
+        if missing:
+            # Embed bản tóm tắt chưa có vector rồi lưu lại để lần sau không phải embed nữa
+            embedded = np.asarray(self.encoder.encode([text for _, _, text in missing]), dtype=np.float32)
+            conn.executemany(
+                "UPDATE conversation_summaries SET SummaryEmbedding = ?, EmbeddingModel = ?, EmbeddingDimension = ? "
+                "WHERE SummaryId = ?",
+                [(encode_vector(vec, "float16", self.model_name), self.model_name, len(vec), sid)
+                 for (sid, _, _), vec in zip(missing, embedded)]
+            )
+            vectors.update({session_id: vec for (_, session_id, _), vec in zip(missing, embedded)})
+
+        rest = [sid for sid in session_ids if sid not in vectors]
+        if rest:
+            in_rest = f"SessionId IN ({','.join('?' * len(rest))})"
+            _, message_matrix, message_sessions = load_matrix(
+                "chat_messages", where=f"{in_rest} AND MessageType IN ('human', 'ai')", params=rest,
+                normalize=False, conn=conn, extra=("SessionId",)
+            )
+            sums = {}
+            for (session_id,), vec in zip(message_sessions, message_matrix):
+                sums[session_id] = sums[session_id] + vec if session_id in sums else vec.copy()
+            texts = {}
+            for session_id, content in conn.execute(
+                f"SELECT SessionId, Content FROM chat_messages WHERE {in_rest} AND MessageType = 'human' "
+                "AND ContentEmbedding IS NULL ORDER BY SessionId, MessageId", rest
+            ):
+                texts.setdefault(session_id, []).append(content)
+            vectors.update(sums)
+            no_vector = [sid for sid in rest if sid not in sums and sid in texts]
+            if no_vector:
+                embedded = self.encoder.encode([" ".join(texts[sid])[:2000] for sid in no_vector])
+                vectors.update(zip(no_vector, np.asarray(embedded, dtype=np.float32)))
+
+        ids = [sid for sid in session_ids if sid in vectors]
+        if not ids:
+            return [], np.zeros((0, 0), dtype=np.float32)
+        return ids, _normalize(np.stack([np.asarray(vectors[sid], dtype=np.float32) for sid in ids]))
+
+    def _pages(self, conn, only_unassigned: bool):
+        """Duyệt chat_sessions theo trang batch_size (keyset pagination)"""
+        last_id = 0
+        while True:
+            rows = conn.execute(f"""
+                SELECT s.SessionId FROM chat_sessions s
+                {"LEFT JOIN session_clusters sc ON sc.SessionId = s.SessionId" if only_unassigned else ""}
+                WHERE s.SessionId > ? {"AND sc.SessionId IS NULL" if only_unassigned else ""}
+                ORDER BY s.SessionId LIMIT ?
+            """, (last_id, self.batch_size)).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield [r[0] for r in rows]
+
+    # ----------- CENTROID -----------
+    def _load_centroids(self, conn):
+        ids, centroids, counts = load_matrix("conversation_clusters", model=self.model_name, conn=conn,
+                                             extra=("SessionCount",))
+        if not len(ids):
+            return [], None, None
+        return ids.tolist(), centroids, np.array([max(c or 0, 0) for (c,) in counts], dtype=np.float64)
+
+    def _init_centroids(self, conn, matrix):
+        """k-means++ trên trang đầu tiên, tạo các dòng conversation_clusters"""
+        rng = np.random.default_rng(0)
+        k = min(self.n_clusters, len(matrix))
+        chosen = [int(rng.integers(len(matrix)))]
+        closest = 1 - matrix @ matrix[chosen[0]]
+        for _ in range(1, k):
+            weights = np.maximum(closest, 0) ** 2
+            total = weights.sum()
+            nxt = int(rng.choice(len(matrix), p=weights / total)) if total > 0 else int(rng.integers(len(matrix)))
+            chosen.append(nxt)
+            closest = np.minimum(closest, 1 - matrix @ matrix[nxt])
+        centroids = matrix[chosen].copy()
+        cluster_ids = [
+            conn.execute(
+                "INSERT INTO conversation_clusters (ClusterName, ClusterEmbedding, EmbeddingModel, SessionCount) "
+                "VALUES (?, ?, ?, 0)",
+                (f"Cụm {i + 1}", encode_vector(c, "float32", self.model_name), self.model_name)
+            ).lastrowid
+            for i, c in enumerate(centroids)
+        ]
+        return cluster_ids, centroids, np.zeros(k, dtype=np.float64)
+
+    @staticmethod
+    def _mini_batch_update(centroids, counts, matrix, assign):
+        """Cập nhật centroid theo Sculley (mini-batch k-means): c += (x - c) / count"""
+        for c in np.unique(assign):
+            members = matrix[assign == c]
+            new_count = counts[c] + len(members)
+            centroids[c] += (members.sum(axis=0) - len(members) * centroids[c]) / new_count
+            counts[c] = new_count
+        return _normalize(centroids)
+
+    # ----------- JOB -----------
+    def run(self, reassign: bool = False, update_centroids: bool = True):
+        """Gán các session chưa có cụm (reassign=True: gán lại toàn bộ). Trả về số session đã gán"""
+        with self._lock:
+            conn = self._connect()
+            try:
+                return self._run(conn, reassign, update_centroids)
+            finally:
+                conn.close()
+
+    def _run(self, conn, reassign, update_centroids):
+        assigned, n_clusters = 0, 0
+        for session_ids in self._pages(conn, only_unassigned=not reassign):
+            with metrics.timer("session_cluster_batch", help="Thời gian phân cụm 1 trang session"):
+                # Embed (và lưu SummaryEmbedding) ngoài transaction ghi để không giữ lock lâu
+                with conn:
+                    ids, matrix = self._session_vectors(conn, session_ids)
+                if not ids:
+                    continue
+                ids, n_clusters = self._assign_page(conn, ids, matrix, reassign, update_centroids)
+            assigned += len(ids)
+            metrics.inc("session_clusters_assigned_total", len(ids), help="Số session đã được gán cụm")
+        if assigned:
+            print(f"✅ Đã gán {assigned} session vào {n_clusters} cụm")
+        return assigned
+
+    def _assign_page(self, conn, ids, matrix, reassign, update_centroids):
+        """Gán 1 trang trong 1 write transaction (BEGIN IMMEDIATE): centroid đọc lại trong transaction nên
+        worker chạy song song không tạo bộ centroid thứ 2; session worker khác đã gán (không reassign) bị bỏ qua.
+        Trả về (session đã gán, số cụm)"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not reassign:
+                taken = {r[0] for r in conn.execute(
+                    f"SELECT SessionId FROM session_clusters WHERE SessionId IN ({','.join('?' * len(ids))})", ids
+                )}
+                keep = [i for i, sid in enumerate(ids) if sid not in taken]
+                ids, matrix = [ids[i] for i in keep], matrix[keep]
+
+            cluster_ids, centroids, counts = self._load_centroids(conn)
+            if ids:
+                if centroids is None:
+                    cluster_ids, centroids, counts = self._init_centroids(conn, matrix)
+                assign = np.argmax(matrix @ centroids.T, axis=1)
+                if update_centroids:
+                    centroids = self._mini_batch_update(centroids, counts, matrix, assign)
+                    assign = np.argmax(matrix @ centroids.T, axis=1)
+                scores = np.einsum("ij,ij->i", matrix, centroids[assign])
+                self._write_assignments(conn, ids, [cluster_ids[c] for c in assign], scores)
+                if update_centroids:
+                    conn.executemany(
+                        "UPDATE conversation_clusters SET ClusterEmbedding = ?, UpdatedAt = CURRENT_TIMESTAMP "
+                        "WHERE ClusterId = ?",
+                        [(encode_vector(c, "float32", self.model_name), cid) for cid, c in zip(cluster_ids, centroids)]
+                    )
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return ids, len(cluster_ids)
+
+    @staticmethod
+    def _write_assignments(conn, session_ids, cluster_ids, scores):
+        # Mỗi session 1 cụm: xóa cụm cũ (trigger giảm SessionCount) rồi ghi cụm mới
+        conn.executemany("DELETE FROM session_clusters WHERE SessionId = ?", [(sid,) for sid in session_ids])
+        conn.executemany(
+            "INSERT INTO session_clusters (SessionId, ClusterId, SimilarityScore) VALUES (?, ?, ?)",
+            [(sid, cid, float(np.clip(score, 0, 1))) for sid, cid, score in zip(session_ids, cluster_ids, scores)]
+        )
+
+    def assign_session(self, session_id: int):
+        """Gán online 1 session theo centroid gần nhất (không cập nhật centroid). Trả về (ClusterId, score) hoặc None"""
+        conn = self._connect()
+        try:
+            with conn:
+                cluster_ids, centroids, _ = self._load_centroids(conn)
+                ids, matrix = self._session_vectors(conn, [session_id])
+                if centroids is None or not ids:
+                    return None
+                scores = centroids @ matrix[0]
+                best = int(np.argmax(scores))
+                self._write_assignments(conn, ids, [cluster_ids[best]], [scores[best]])
+            return cluster_ids[best], float(scores[best])
+        finally:
+            conn.close()
+
+    # ----------- CHẠY NỀN -----------
+    def start_scheduler(self, interval: float = None):
+        """Chạy run() định kỳ ở thread nền (SESSION_CLUSTER_INTERVAL_SECONDS, 0 = tắt)"""
+        interval = interval if interval is not None else float(os.getenv("SESSION_CLUSTER_INTERVAL_SECONDS", 0))
+        if interval <= 0 or self._scheduler is not None:
+            return
+        self._scheduler = threading.Thread(target=self._run_scheduler, args=(interval,), name="session-clusters",
+                                           daemon=True)
+        self._scheduler.start()
+
+    def _run_scheduler(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.run()
+            except Exception as e:
+                print(f"❌ Lỗi khi phân cụm session: {e}")
+
+    def close(self):
+        self._stop.set()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+
+if __name__ == "__main__":
+    # python -m src.utils.session_clusters [run | reassign]
+    command = sys.argv[1] if len(sys.argv) > 1 else "run"
+    SessionClusterer().run(reassign=command == "reassign")
@@ -0,0 +1,229 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from .tools import db_path
+from .migrations import apply_migrations
+from .metrics import metrics
+
+
+class InMemorySessionStore:
+    """Store trong process (fallback / dev): chỉ đúng khi chạy 1 worker"""
+    shared = False
+
+    def __init__(self, max_values: int = 5000):
+        self.max_values = max_values
+        self._history = {}
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    # ----------- HISTORY -----------
+    def append(self, session_id: str, entry: dict):
+        with self._lock:
+            self._history.setdefault(session_id, []).append(entry)
+
+    def get_history(self, session_id: str):
+        with self._lock:
+            return list(self._history.get(session_id, []))
+
+    def clear(self, session_id: str):
+        with self._lock:
+            self._history.pop(session_id, None)
+
+    def list_sessions(self):
+        with self._lock:
+            return list(self._history.keys())
+
+    # ----------- KEY-VALUE -----------
+    def set_value(self, namespace: str, key: str, value: str, ttl: float = None):
+        with self._lock:
+            self._values[(namespace, key)] = (value, time.time() + ttl if ttl else None)
+            while len(self._values) > self.max_values:
+                self._values.popitem(last=False)
+
+    def get_value(self, namespace: str, key: str):
+        with self._lock:
+            value, expires_at = self._values.get((namespace, key), (None, None))
+        return None if expires_at and expires_at < time.time() else value
+
+    def flush(self):
+        return 0
+
+    def close(self):
+        pass
+
+
+class SqliteSessionStore:
+    """Store dùng chung giữa các worker, nằm trong store.db (WAL).
+
+    - Ghi kiểu write-behind: append / set_value chỉ đưa vào buffer, thread nền flush mỗi flush_interval
+      giây trong 1 transaction (hoặc ngay khi buffer đầy)
+    - Đọc thì flush buffer của process trước để thấy được dữ liệu vừa ghi
+    - close() flush phần còn lại, gọi khi tắt server (graceful shutdown)
+    - Sau khi fork (gunicorn preload) connection, lock, buffer và thread nền được tạo lại trong worker
+    """
+    shared = True
+
+    def __init__(self, DB_PATH: str = db_path, flush_interval: float = 0.5, max_buffer: int = 200):
+        self.db_path = DB_PATH
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._flush_count = 0
+
+        apply_migrations(self.db_path)
+        self._init_process_state()
+
+    def _init_process_state(self):
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # flush tuần tự để giữ đúng thứ tự giữa các batch
+        self._pending = []  # [(op, params)] theo đúng thứ tự ghi
+        self._stop = threading.Event()
+        self._flusher = None
+
+    def _check_pid(self):
+        # Process con (fork) không dùng lại connection / thread của process cha
+        if self._pid != os.getpid():
+            self._init_process_state()
+
+    @property
+    def conn(self):
+        self._check_pid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ----------- WRITE-BEHIND -----------
+    def _enqueue(self, op, params):
+        self._check_pid()
+        with self._lock:
+            self._pending.append((op, params))
+            full = len(self._pending) >= self.max_buffer
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run_flusher, name="session-store-flush", daemon=True)
+                self._flusher.start()
+        if full:
+            self.flush()
+
+    def _run_flusher(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Lỗi khi flush session store: {e}")
+
+    def flush(self):
+        """Ghi toàn bộ buffer xuống SQLite, trả về số thao tác đã ghi"""
+        self._check_pid()
+        with self._write_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if pending:
+                self._write(pending)
+        return len(pending)
+
+    def _write(self, pending):
+        conn = self.conn
+        with metrics.timer("session_store_flush", help="Thời gian flush buffer của session store"):
+            with conn:
+                for op, params in pending:
+                    if op == "append":
+                        conn.execute(
+                            "INSERT INTO chat_session_history (SessionId, UserMessage, BotResponse, TraceId, CreatedAt) "
+                            "VALUES (?, ?, ?, ?, ?)", params
+                        )
+                    elif op == "set":
+                        conn.execute(
+                            "INSERT OR REPLACE INTO shared_kv (Namespace, Key, Value, ExpiresAt) VALUES (?, ?, ?, ?)",
+                            params
+                        )
+                    elif op == "clear":
+                        conn.execute("DELETE FROM chat_session_history WHERE SessionId = ?", params)
+
+                # Thỉnh thoảng dọn key đã hết hạn
+                self._flush_count += 1
+                if self._flush_count % 100 == 0:
+                    conn.execute("DELETE FROM shared_kv WHERE ExpiresAt IS NOT NULL AND ExpiresAt < ?", (time.time(),))
+
+    # ----------- HISTORY -----------
+    def append(self, session_id: str, entry: dict):
+        self._enqueue("append", (
+            session_id,
+            entry.get("user_message"),
+            entry.get("bot_response"),
+            entry.get("trace_id"),
+            entry.get("timestamp") or datetime.now().isoformat(sep=" "),
+        ))
+
+    def get_history(self, session_id: str):
+        self.flush()
+        rows = self.conn.execute(
+            "SELECT UserMessage, BotResponse, CreatedAt, TraceId FROM chat_session_history "
+            "WHERE SessionId = ? ORDER BY Id",
+            (session_id,)
+        ).fetchall()
+        return [
+            {"user_message": u, "bot_response": b, "timestamp": t, "trace_id": trace_id}
+            for u, b, t, trace_id in rows
+        ]
+
+    def clear(self, session_id: str):
+        self._enqueue("clear", (session_id,))
+        self.flush()
+
+    def list_sessions(self):
+        self.flush()
+        rows = self.conn.execute(
+            "SELECT SessionId FROM chat_session_history GROUP BY SessionId ORDER BY MIN(Id)"
+        ).fetchall()
+        return [r[0] for r in rows]
+
+    # ----------- KEY-VALUE -----------
+    def set_value(self, namespace: str, key: str, value: str, ttl: float = None):
+        self._enqueue("set", (namespace, key, value, time.time() + ttl if ttl else None))
+
+    def get_value(self, namespace: str, key: str):
+        self.flush()
+        row = self.conn.execute(
+            "SELECT Value FROM shared_kv WHERE Namespace = ? AND Key = ? AND (ExpiresAt IS NULL OR ExpiresAt >= ?)",
+            (namespace, key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        """Dừng thread nền và flush phần còn lại"""
+        self._stop.set()
+        if self._flusher is not None and self._pid == os.getpid():
+            self._flusher.join(timeout=5)
+        written = self.flush()
+        if written:
+            print(f"💾 Đã flush {written} thao tác còn lại của session store")
+
+
+class SessionStore:
+    """Chọn backend theo env SESSION_STORE: "sqlite" (mặc định, dùng chung giữa worker) hoặc "memory" """
+    _instance = None
+
+    @classmethod
+    def create(cls, backend: str = None):
+        backend = (backend or os.getenv("SESSION_STORE", "sqlite")).lower()
+        if backend == "memory":
+            return InMemorySessionStore()
+        try:
+            return SqliteSessionStore(os.getenv("SESSION_DB_PATH", db_path))
+        except Exception as e:
+            print(f"⚠️ Không mở được SQLite session store ({e}), dùng store trong process")
+            return InMemorySessionStore()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls.create()
+        return cls._instance
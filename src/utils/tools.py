@@ -1,17 +1,30 @@
 import sqlite3
 import os
+import re
+from .metrics import metrics
 
 PROJECT_DIR = os.path.abspath(os.path.join(__file__, "..", "..", ".."))
-db_path = os.path.join(PROJECT_DIR, "database", "repo", "store.db")
+# Có thể trỏ sang DB khác qua biến môi trường (benchmark, test...)
+db_path = os.getenv("STORE_DB_PATH", os.path.join(PROJECT_DIR, "database", "repo", "store.db"))
+
+_TABLE_RE = re.compile(r"\b(?:FROM|INTO|UPDATE)\s+([A-Za-z_]+)", re.IGNORECASE)
+
+def _query_labels(query):
+    """Label cho metrics: loại câu lệnh + bảng chính (không dùng cả câu SQL để tránh quá nhiều series)"""
+    words = query.split()
+    table = _TABLE_RE.search(query)
+    return {"op": words[0].upper() if words else "", "table": table.group(1) if table else ""}
 
 def run_query(query, params=(), fetch=False, DB_PATH = db_path):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(query, params)
-    if fetch:
-        rows = cur.fetchall()
-        conn.close()
-        return rows
-    conn.commit()
-    conn.close()
-    return "✅ Done"
\ No newline at end of file
+    with metrics.timer("sql_query", help="Thời gian chạy run_query", **_query_labels(query)):
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            cur = conn.cursor()
+            cur.execute(query, params)
+            if fetch:
+                return cur.fetchall()
+            conn.commit()
+            return "✅ Done"
+        finally:
+            # Luôn đóng connection (rollback nếu commit lỗi): không để transaction treo giữ write lock
+            conn.close()
\ No newline at end of file
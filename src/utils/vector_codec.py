@@ -0,0 +1,128 @@
+import sqlite3
+import struct
+from collections import namedtuple
+import numpy as np
+from .tools import db_path
+
+# Định dạng BLOB embedding dùng chung cho các bảng trong store.db:
+#   header 16 byte "<2sBBIff": magic b"VC", dtype, độ dài tên model, dim, norm (L2 của vector gốc), scale (int8)
+#   + tên model (utf-8) + padding tới bội số của 4 byte + dữ liệu vector (little-endian)
+# BLOB không có magic được coi là float32 thô (định dạng cũ).
+MAGIC = b"VC"
+_HEADER = struct.Struct("<2sBBIff")
+DTYPES = {"float32": (0, np.float32), "float16": (1, np.float16), "int8": (2, np.int8)}
+_DTYPE_BY_CODE = {code: (name, dtype) for name, (code, dtype) in DTYPES.items()}
+
+VectorHeader = namedtuple("VectorHeader", ["dtype", "dim", "model", "norm", "scale", "offset"])
+
+# Các cột embedding trong schema: table -> (cột id, cột BLOB, cột tên model)
+VECTOR_COLUMNS = {
+    "chat_messages": ("MessageId", "ContentEmbedding", "EmbeddingModel"),
+    "conversation_summaries": ("SummaryId", "SummaryEmbedding", "EmbeddingModel"),
+    "knowledge_base": ("KnowledgeId", "ContentEmbedding", "EmbeddingModel"),
+    "conversation_clusters": ("ClusterId", "ClusterEmbedding", "EmbeddingModel"),
+    "semantic_search_cache": ("CacheId", "QueryEmbedding", "EmbeddingModel"),
+    "chat_memory": ("MemoryId", "ContentEmbedding", "EmbeddingModel"),
+}
+
+
+def encode_vector(vector, dtype: str = "float16", model: str = None) -> bytes:
+    """Vector 1 chiều -> BLOB (float32 | float16 | int8 lượng tử hóa đối xứng theo max |x|)"""
+    code, np_dtype = DTYPES[dtype]
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    norm = float(np.linalg.norm(vector))
+    scale = 1.0
+    if dtype == "int8":
+        peak = float(np.abs(vector).max()) if len(vector) else 0.0
+        scale = peak / 127 if peak else 1.0
+        data = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+    else:
+        data = vector.astype(np_dtype)
+
+    model_bytes = (model or "").encode("utf-8")[:255]
+    padding = b"\0" * (-(_HEADER.size + len(model_bytes)) % 4)
+    header = _HEADER.pack(MAGIC, code, len(model_bytes), len(vector), norm, scale)
+    return header + model_bytes + padding + data.astype(data.dtype.newbyteorder("<"), copy=False).tobytes()
+
+
+def read_header(blob) -> VectorHeader:
+    """Đọc header (BLOB định dạng cũ: float32 thô, không có tên model / norm)"""
+    if len(blob) < _HEADER.size or bytes(blob[:2]) != MAGIC:
+        return VectorHeader("float32", len(blob) // 4, None, None, 1.0, 0)
+    _, code, model_len, dim, norm, scale = _HEADER.unpack_from(blob)
+    model = bytes(blob[_HEADER.size:_HEADER.size + model_len]).decode("utf-8") or None
+    offset = _HEADER.size + model_len + (-(_HEADER.size + model_len) % 4)
+    return VectorHeader(_DTYPE_BY_CODE[code][0], dim, model, norm, scale, offset)
+
+
+def decode_vector(blob, dequantize: bool = True):
+    """BLOB -> np.ndarray. Không copy (np.frombuffer, chỉ đọc) trừ khi phải giải lượng tử int8"""
+    header = read_header(blob)
+    data = np.frombuffer(blob, dtype=DTYPES[header.dtype][1], count=header.dim, offset=header.offset)
+    if dequantize and header.dtype == "int8":
+        return data.astype(np.float32) * np.float32(header.scale)
+    return data
+
+
+def load_matrix(table: str, where: str = None, params=(), model: str = None, normalize: bool = True,
+                DB_PATH: str = db_path, conn: sqlite3.Connection = None, column: str = None, extra=()):
+    """Nạp mọi vector của 1 bảng (trong VECTOR_COLUMNS) vào 1 ma trận float32 liên tục.
+    - where / params: lọc thêm (vd: "SessionId = ?"); model: chỉ lấy vector của model đó
+    - column: cột BLOB khác cột mặc định của bảng (vd: knowledge_base.TitleEmbedding)
+    - extra: các cột lấy kèm (vd: ("UserMessage", "BotResponse")), trả về thêm list tuple khớp thứ tự dòng
+    - Vector khác số chiều với dòng đầu tiên bị bỏ qua (embedding của model cũ)
+    Trả về (ids, matrix) hoặc (ids, matrix, extra_rows) với ids là np.ndarray int64 theo thứ tự dòng"""
+    id_column, blob_column, model_column = VECTOR_COLUMNS[table]
+    blob_column = column or blob_column
+    clauses = [f"{blob_column} IS NOT NULL"]
+    if where:
+        clauses.append(f"({where})")
+    if model:
+        # Giữ thứ tự tham số khớp thứ tự dấu ? trong câu SQL
+        clauses.append(f"{model_column} = ?")
+        params = (*params, model)
+    columns = ", ".join([id_column, blob_column, *extra])
+    query = f"SELECT {columns} FROM {table} WHERE {' AND '.join(clauses)} ORDER BY {id_column}"
+
+    own_conn = conn is None
+    conn = conn or sqlite3.connect(DB_PATH, timeout=30)
+    try:
+        rows = conn.execute(query, params).fetchall()
+    finally:
+        if own_conn:
+            conn.close()
+
+    if not rows:
+        empty = (np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float32))
+        return (*empty, []) if extra else empty
+    dim = read_header(rows[0][1]).dim
+    matrix = np.empty((len(rows), dim), dtype=np.float32)
+    ids = np.empty(len(rows), dtype=np.int64)
+    extra_rows = []
+    n = 0
+    for row in rows:
+        vector = decode_vector(row[1])
+        if len(vector) != dim:
+            continue
+        matrix[n] = vector
+        ids[n] = row[0]
+        if extra:
+            extra_rows.append(row[2:])
+        n += 1
+    matrix, ids = matrix[:n], ids[:n]
+    if normalize:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+    return (ids, matrix, extra_rows) if extra else (ids, matrix)
+
+
+def top_k(matrix, query, k: int = 5):
+    """Brute-force top-k theo tích vô hướng (cosine nếu đã chuẩn hóa). Trả về (chỉ số dòng, điểm), điểm giảm dần"""
+    if len(matrix) == 0 or k <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    scores = matrix @ np.asarray(query, dtype=np.float32)
+    rows = np.arange(len(scores))
+    if k < len(scores):
+        rows = np.argpartition(-scores, k - 1)[:k]
+    rows = rows[np.argsort(-scores[rows], kind="stable")]
+    return rows, scores[rows]